@@ -4,9 +4,13 @@ from transformers import AutoModel
 
 class PhoBERTPairABSA(nn.Module):
     """Pair-ABSA model: Predicts sentiment for a specific topic in a sentence"""
-    def __init__(self, base_model="vinai/phobert-base", num_cls=4, dropout=0.2):
+    def __init__(self, base_model="vinai/phobert-base", num_cls=4, dropout=0.2, config=None):
         super().__init__()
-        self.backbone = AutoModel.from_pretrained(base_model)
+        # config: khởi tạo backbone ngẫu nhiên từ config (benchmark/offline) thay vì tải weights
+        if config is not None:
+            self.backbone = AutoModel.from_config(config)
+        else:
+            self.backbone = AutoModel.from_pretrained(base_model)
         hidden_size = self.backbone.config.hidden_size
         self.classifier = nn.Sequential(
             nn.Dropout(dropout),
@@ -17,8 +21,11 @@ class PhoBERTPairABSA(nn.Module):
             nn.Linear(hidden_size, num_cls)
         )
     
-    def forward(self, input_ids, attention_mask):
+    def forward(self, input_ids, attention_mask, return_embedding=False):
         out = self.backbone(input_ids=input_ids, attention_mask=attention_mask)
         cls = out.last_hidden_state[:, 0, :]
         logits = self.classifier(cls)
+        # return_embedding: trả thêm vector [CLS] (embedding_index.py lưu để tìm feedback tương tự)
+        if return_embedding:
+            return logits, cls
         return logits
@@ -0,0 +1,196 @@
+"""Admission control trước model: giới hạn số lượt chạy đồng thời, hàng đợi có giới hạn, deadline, ưu tiên
+
+Trước đây mọi request /predict đều xếp hàng chờ model không giới hạn, tới lúc
+quá tải thì tất cả cùng chờ tới timeout của gunicorn. AdmissionController
+(mỗi process một instance `controller`) chỉ cho INFERENCE_CONCURRENCY lượt chạy
+model cùng lúc, phần còn lại chờ trong hàng đợi theo thứ tự ưu tiên:
+
+  - INTERACTIVE (/predict) luôn được chạy trước BULK (các chunk của /analyze-csv).
+  - Hàng đợi tối đa ADMISSION_QUEUE_SIZE lượt (BULK tối đa ADMISSION_BULK_QUEUE_SIZE);
+    đầy thì từ chối ngay (429).
+  - Mỗi lượt có deadline (PREDICT_DEADLINE / BULK_DEADLINE giây, client có thể
+    rút ngắn bằng header X-Request-Timeout): ước lượng thời gian chờ đã vượt
+    deadline thì từ chối ngay, chờ quá deadline thì bỏ (503) thay vì chạy model
+    cho client đã bỏ đi.
+
+Thời gian chờ được ước lượng từ phần việc thực sự đứng trước: thời gian còn lại
+của các lượt đang chạy cộng các lượt xếp trước, mỗi lượt tính theo thời gian chạy
+trung bình gần đây của đúng mức ưu tiên của nó (một chunk CSV 64 text chạy lâu
+hơn nhiều so với một /predict, nên không dùng chung một trung bình).
+
+Mọi lần từ chối đều raise Rejected kèm status và retry_after (giây, ước lượng như
+trên) để route trả về header Retry-After.
+Khi dùng INFERENCE_SOCKET, đặt INFERENCE_CONCURRENCY bằng số worker của
+inference_service.py.
+"""
+
+import os
+import math
+import time
+import heapq
+import itertools
+import threading
+from contextlib import contextmanager
+
+import metrics
+
+INFERENCE_CONCURRENCY = int(os.getenv('INFERENCE_CONCURRENCY', '1'))
+ADMISSION_QUEUE_SIZE = int(os.getenv('ADMISSION_QUEUE_SIZE', '32'))
+ADMISSION_BULK_QUEUE_SIZE = int(os.getenv('ADMISSION_BULK_QUEUE_SIZE', '4'))
+# Thấp hơn timeout mặc định của gunicorn (30 giây)
+PREDICT_DEADLINE = float(os.getenv('PREDICT_DEADLINE', '10'))
+BULK_DEADLINE = float(os.getenv('BULK_DEADLINE', '25'))
+
+INTERACTIVE = 0
+BULK = 1
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', BULK: 'bulk'}
+
+
+class Rejected(Exception):
+    def __init__(self, status: int, reason: str, retry_after: int):
+        """Request không được chạy model: status 429 (hàng đợi đầy) hoặc 503 (không kịp deadline, model đang load, inference service không trả lời)"""
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def message(self) -> str:
+        if self.status == 429:
+            return 'Hệ thống đang quá tải, vui lòng thử lại sau.'
+        if self.reason == 'model_loading':
+            return 'Model đang được tải, vui lòng thử lại sau ít giây.'
+        if self.reason == 'inference_unavailable':
+            return 'Dịch vụ phân tích tạm thời không kết nối được, vui lòng thử lại sau.'
+        return 'Hệ thống đang bận, không kịp xử lý yêu cầu. Vui lòng thử lại sau.'
+
+
+def deadline_for(priority: int, headers=None) -> float:
+    """Deadline (time.monotonic) cho một lượt chạy bắt đầu từ bây giờ"""
+    budget = PREDICT_DEADLINE if priority == INTERACTIVE else BULK_DEADLINE
+    requested = headers.get('X-Request-Timeout') if headers is not None else None
+    if requested:
+        try:
+            budget = min(budget, max(0.0, float(requested)))
+        except ValueError:
+            pass
+    return time.monotonic() + budget
+
+
+class AdmissionController:
+    def __init__(self, concurrency: int = INFERENCE_CONCURRENCY, queue_size: int = ADMISSION_QUEUE_SIZE,
+                 bulk_queue_size: int = ADMISSION_BULK_QUEUE_SIZE):
+        self.concurrency = max(1, concurrency)
+        self.queue_size = max(0, queue_size)
+        self.bulk_queue_size = max(0, bulk_queue_size)
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting = []
+        self._bulk_waiting = 0
+        self._seq = itertools.count()
+        # Thời gian chạy model trung bình (EWMA, giây) theo mức ưu tiên để ước lượng thời gian chờ
+        self._service_time = {INTERACTIVE: 0.2, BULK: 1.0}
+        # seq -> (priority, time.monotonic lúc bắt đầu chạy) của các lượt đang chạy
+        self._running = {}
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiting)
+
+    def _estimated_wait(self, priority: int = None) -> float:
+        """Thời gian chờ ước lượng của một lượt mới: phần còn lại của các lượt đang chạy
+        + các lượt đang chờ sẽ được chạy trước nó (None: mọi lượt đang chờ)"""
+        now = time.monotonic()
+        work = sum(max(0.0, self._service_time[p] - (now - started)) for p, started in self._running.values())
+        work += sum(self._service_time[p] for p, _ in self._waiting if priority is None or p <= priority)
+        return work / self.concurrency
+
+    def _retry_after(self, priority: int = None) -> int:
+        # Condition dùng RLock: gọi được cả khi admit() đang giữ lock
+        with self._cond:
+            return max(1, math.ceil(self._estimated_wait(priority)))
+
+    def reject(self, status: int, reason: str, priority: int = None) -> Rejected:
+        """Tạo Rejected (kèm Retry-After ước lượng) và đếm vào metrics"""
+        metrics.ADMISSION_REJECTED.inc(route=metrics.current_route(), reason=reason)
+        return Rejected(status, reason, self._retry_after(priority))
+
+    def _remove(self, entry):
+        self._waiting.remove(entry)
+        heapq.heapify(self._waiting)
+        if entry[0] == BULK:
+            self._bulk_waiting -= 1
+
+    @contextmanager
+    def admit(self, priority: int = INTERACTIVE, deadline: float = None):
+        """Chờ tới lượt chạy model (raise Rejected nếu hàng đợi đầy hoặc không kịp deadline)"""
+        start = time.monotonic()
+        with self._cond:
+            if self._active >= self.concurrency or self._waiting:
+                if len(self._waiting) >= self.queue_size:
+                    raise self.reject(429, 'queue_full', priority)
+                if priority == BULK and self._bulk_waiting >= self.bulk_queue_size:
+                    raise self.reject(429, 'queue_full', priority)
+                if deadline is not None and start + self._estimated_wait(priority) > deadline:
+                    raise self.reject(503, 'deadline', priority)
+
+            entry = (priority, next(self._seq))
+            heapq.heappush(self._waiting, entry)
+            if priority == BULK:
+                self._bulk_waiting += 1
+            try:
+                while self._active >= self.concurrency or self._waiting[0] != entry:
+                    timeout = None if deadline is None else deadline - time.monotonic()
+                    if timeout is not None and timeout <= 0:
+                        raise self.reject(503, 'deadline', priority)
+                    self._cond.wait(timeout)
+            except BaseException:
+                self._remove(entry)
+                self._cond.notify_all()
+                raise
+            self._remove(entry)
+            self._active += 1
+            run_start = time.monotonic()
+            self._running[entry[1]] = (priority, run_start)
+            # Lượt tiếp theo có thể chạy luôn nếu còn slot
+            self._cond.notify_all()
+
+        metrics.ADMISSION_WAIT_SECONDS.observe(run_start - start, route=metrics.current_route(),
+                                               priority=PRIORITY_NAMES[priority])
+        try:
+            yield
+        finally:
+            self._release(entry[1], priority, run_start)
+
+    def _release(self, seq: int, priority: int, run_start: float, record: bool = True):
+        elapsed = time.monotonic() - run_start
+        with self._cond:
+            self._active -= 1
+            del self._running[seq]
+            if record:
+                self._service_time[priority] = 0.8 * self._service_time[priority] + 0.2 * elapsed
+            self._cond.notify_all()
+
+    @contextmanager
+    def try_admit(self, priority: int = BULK):
+        """Chạy ngay nếu còn slot trống và không có lượt nào đang chờ, ngược lại yield False
+
+        Không xếp hàng, không tính vào giới hạn hàng đợi: dùng cho việc phụ có thể bỏ
+        qua khi bận (shadow scoring). Thời gian chạy không tính vào trung bình của priority.
+        """
+        with self._cond:
+            admitted = self._active < self.concurrency and not self._waiting
+            if admitted:
+                self._active += 1
+                seq, run_start = next(self._seq), time.monotonic()
+                self._running[seq] = (priority, run_start)
+        if not admitted:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            self._release(seq, priority, run_start, record=False)
+
+
+controller = AdmissionController()
@@ -1,27 +1,32 @@
 import os
-import torch
 import csv
-import io
 import atexit
 import schedule
 import time
+import threading
 from threading import Thread
-from transformers import AutoTokenizer
-from flask import Flask, request, jsonify, render_template, redirect, url_for, flash
+from flask import Flask, request, jsonify, render_template, redirect, url_for, flash, g, Response, send_file, abort, stream_with_context, session, make_response
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from functools import wraps
-from models import db, User, Feedback
+from models import db, User, Feedback, FeedbackScore, upgrade_schema
 from forms import RegistrationForm, LoginForm
-from PhoBERTPairABSA import PhoBERTPairABSA
+import inference_backend
+from inference_service import InferenceUnavailable, UNAVAILABLE_RETRY_AFTER
+import metrics
+import profiling
+import search_index
+import coordination
+import export
+import admission
+import model_registry
+import identity_cache
+import csv_upload
+import data_versions
+import trends
+import embedding_index
 from datetime import datetime, timedelta
 import pytz
 from database_manager import db_manager
-from model_config import (
-    get_prompt, ASPECTS_EN, ASPECTS_VI, LABEL_MAP, MAX_LEN, PRED_THRESHOLD,
-    MIN_SENT_PROB, MIN_MARGIN,
-    _is_garbage, _aspect_has_kw, _has_any_kw, _norm_match, ASPECT_REVERSE_MAPPING,
-    BASE_MODEL, NUM_CLASSES, DROPOUT
-)
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-change-this-in-production'
@@ -29,30 +34,67 @@ app.config['SECRET_KEY'] = 'your-secret-key-change-this-in-production'
 def backup_database(force: bool = False):
     """Backup database to Hugging Face Hub"""
     try:
-        return db_manager.backup_database(force=force)
+        with metrics.time_stage('backup'):
+            return db_manager.backup_database(force=force)
     except Exception:
         return False
 
 def restore_database():
     """Restore database from Hugging Face Hub"""
     try:
-        return db_manager.restore_database()
+        if not db_manager.restore_database():
+            return False
+        # id feedback_scores trong file vừa restore không còn khớp với index embedding
+        embedding_index.reset()
+        coordination.mark('restore')
+        reopen_database()
+        return True
     except Exception:
         return False
 
+def reopen_database():
+    """File database vừa được thay (restore): bỏ kết nối cũ, bổ sung cột/index còn thiếu"""
+    db.session.remove()
+    db.engine.dispose()
+    _restore_seen['at'] = coordination.last_marked('restore')
+    identity_cache.cache.clear()
+    data_versions.render_cache.clear()
+    upgrade_schema()
+    search_index.ensure_search_index()
+    trends.ensure_trend_buckets()
+
+# Chỉ một worker (leader) chạy backup theo lịch và lúc thoát
+scheduler_leader = coordination.Leader('scheduler')
+
 def run_scheduler():
     """Run scheduled backup every hour"""
     while True:
-        schedule.run_pending()
+        if scheduler_leader.try_acquire():
+            schedule.run_pending()
         time.sleep(60)
 
+def backup_on_exit():
+    if scheduler_leader.is_leader:
+        backup_database()
+
 schedule.every().hour.do(backup_database)
 scheduler_thread = Thread(target=run_scheduler, daemon=True)
 scheduler_thread.start()
-atexit.register(backup_database)
+atexit.register(backup_on_exit)
 
 VIETNAM_TIMEZONE = pytz.timezone('Asia/Ho_Chi_Minh')
 
+def parse_date_range(start_date, end_date):
+    """Ngày 'YYYY-MM-DD' (giờ Việt Nam) -> (start, end) UTC naive, end là cuối ngày; raise ValueError nếu sai định dạng"""
+    start_utc = end_utc = None
+    if start_date:
+        start_datetime = datetime.strptime(start_date, '%Y-%m-%d')
+        start_utc = VIETNAM_TIMEZONE.localize(start_datetime).astimezone(pytz.utc).replace(tzinfo=None)
+    if end_date:
+        end_datetime = datetime.strptime(end_date, '%Y-%m-%d').replace(hour=23, minute=59, second=59)
+        end_utc = VIETNAM_TIMEZONE.localize(end_datetime).astimezone(pytz.utc).replace(tzinfo=None)
+    return start_utc, end_utc
+
 def utc_to_vietnam_time(utc_datetime):
     """Chuyển đổi thời gian UTC sang múi giờ Việt Nam"""
     if utc_datetime is None:
@@ -73,123 +115,165 @@ login_manager.login_view = 'login'
 login_manager.login_message = 'Vui lòng đăng nhập để sử dụng hệ thống phân tích feedback.'
 login_manager.login_message_category = 'info'
 
+_restore_seen = {'at': coordination.last_marked('restore')}
+
+@app.before_request
+def reopen_database_after_restore():
+    # Worker khác vừa restore: kết nối đang mở vẫn trỏ vào file database cũ
+    if coordination.last_marked('restore') > _restore_seen['at']:
+        reopen_database()
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    g.metrics_route_token = metrics.set_route(route)
+
+    is_admin = current_user.is_authenticated and current_user.is_admin
+    if profiling.should_profile(route, request.headers, request.args, is_admin):
+        requested = request.headers.get('X-Profile') == '1' or request.args.get('profile') == '1'
+        trigger = 'admin' if is_admin and requested else 'sampled'
+        g.profiler = profiling.RequestProfiler.try_start(route, trigger)
+
+@app.after_request
+def record_request_timing(response):
+    start = g.get('request_start')
+    if start is not None:
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - start,
+                                        route=metrics.current_route(), status=response.status_code)
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profile_id = profiler.stop_and_save(response.status_code)
+        if profile_id:
+            response.headers['X-Profile-Id'] = profile_id
+    return response
+
+@app.teardown_request
+def stop_leaked_profiler(exc):
+    # Request lỗi không qua after_request: vẫn phải dừng profiler để nhả lock
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.stop_and_save(500)
+
+@app.teardown_request
+def reset_metrics_route(exc):
+    # Thread của worker được dùng lại cho request sau: không để route cũ gắn vào metrics ngoài request
+    token = g.pop('metrics_route_token', None)
+    if token is not None:
+        metrics.reset_route(token)
+
 @app.context_processor
 def utility_processor():
     return dict(utc_to_vietnam_time=utc_to_vietnam_time)
 
+def _load_user_snapshot(user_id):
+    user = db.session.get(User, user_id)
+    return identity_cache.CachedUser.from_model(user) if user is not None else None
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # Đa số request lấy user từ cache trong process, không query bảng users
+    return identity_cache.cache.get(int(user_id), _load_user_snapshot)
 
-def analyze_feedback(text):
-    """Phân tích feedback với model Pair-ABSA"""
-    if tokenizer is None or model is None:
-        return []
-    
-    text = str(text).strip()
-    if _is_garbage(text):
-        return []
-    
-    s_norm = _norm_match(text)
-    
-    tau_len = float(PRED_THRESHOLD)
-    
-    logits_list = []
-    has_keywords = []
-    
-    with torch.no_grad():
-        for aspect_en in ASPECTS_EN:
-            aspect_vi = ASPECT_REVERSE_MAPPING.get(aspect_en, "khac")
-            prompt = get_prompt(aspect_en, sentence=text, use_subprompt=True)
-            
-            inputs = tokenizer(
-                prompt, text,
-                return_tensors="pt", 
-                truncation="only_second", 
-                padding=True, 
-                max_length=MAX_LEN
-            ).to(device)
-            
-            logits = model(inputs["input_ids"], inputs["attention_mask"]).squeeze(0)
-            logits_list.append(logits)
-            has_keywords.append(_aspect_has_kw(aspect_vi, s_norm))
-    
-    logits_tensor = torch.stack(logits_list, dim=0)
-    
-    probs = torch.softmax(logits_tensor, dim=-1)
-    p_none = probs[:, 0]
-    conf_not_none = 1.0 - p_none
-    
-    KW_BOOST = 0.02  
-    conf_not_none_boosted = conf_not_none.clone()
-    for i, has_kw in enumerate(has_keywords):
-        if has_kw:
-            conf_not_none_boosted[i] = min(1.0, conf_not_none_boosted[i] + KW_BOOST)
-    
-    # Bước 1: Lọc aspects có confidence >= threshold VÀ có keywords
-    # Nếu không có keywords, cần confidence cao hơn nhiều (>= 0.85)
-    keep_indices = []
-    for i in range(len(ASPECTS_EN)):
-        if has_keywords[i]:
-            # Có keywords: cần confidence >= threshold
-            if conf_not_none_boosted[i] >= tau_len:
-                keep_indices.append(i)
+# Đổi template/code khi deploy phải đổi ETag dù dữ liệu không đổi
+_TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+_RENDER_EPOCH = max([os.path.getmtime(os.path.abspath(__file__))] +
+                    [os.path.getmtime(os.path.join(_TEMPLATE_DIR, name)) for name in os.listdir(_TEMPLATE_DIR)])
+
+def conditional_render(name, scopes, render):
+    """Trả 304 nếu client đã có bản mới nhất (If-None-Match), dùng lại body đã render nếu dữ liệu chưa đổi"""
+    if '_flashes' in session:
+        # Flash message chỉ hiện một lần: render thẳng, không cache
+        return render()
+    try:
+        versions = data_versions.read(db.session, scopes)
+    except Exception:
+        db.session.rollback()
+        return render()
+    # Khung giờ Việt Nam: các cửa sổ "hôm nay", "7/30 ngày" trôi theo thời gian dù dữ liệu không đổi
+    hour_bucket = utc_to_vietnam_time(datetime.utcnow()).strftime('%Y-%m-%d %H')
+    etag = data_versions.make_etag(name, current_user.id, current_user.is_admin,
+                                   sorted(request.args.items(multi=True)), versions.token(),
+                                   coordination.last_marked('restore'), _RENDER_EPOCH, hour_bucket)
+    route = metrics.current_route()
+    if request.if_none_match.contains(etag):
+        metrics.HTTP_CACHE.inc(route=route, result='not_modified')
+        response = app.response_class(status=304)
+    else:
+        cached = data_versions.render_cache.get(etag)
+        if cached is not None:
+            metrics.HTTP_CACHE.inc(route=route, result='hit')
+            response = app.response_class(cached[0], mimetype=cached[1])
         else:
-            # Không có keywords: cần confidence rất cao (>= 0.85)
-            if conf_not_none_boosted[i] >= 0.85:
-                keep_indices.append(i)
-    
-    # Bước 2: Kiểm tra xem có aspect nào có confidence rất cao không (>95%)
-    high_confidence_indices = [i for i in keep_indices if conf_not_none_boosted[i] >= 0.95]
-    
-    # Bước 3: Nếu có aspect với confidence rất cao, loại bỏ các aspects khác không có keywords
-    if len(high_confidence_indices) > 0:
-        # Loại bỏ các aspects không có keywords nếu đã có aspect khác có confidence rất cao
-        keep_indices = [i for i in keep_indices if has_keywords[i] or i in high_confidence_indices]
-        
-        # Nếu vẫn còn slot, có thể thêm aspects khác nếu có keywords VÀ confidence đủ cao
-        if len(keep_indices) < len(ASPECTS_EN):
-            tau_len_adjusted = tau_len - 0.05  # Chỉ giảm 5%
-            for i in range(len(ASPECTS_EN)):
-                if i not in keep_indices:
-                    # Chỉ giữ nếu có keywords VÀ confidence >= adjusted + 0.10
-                    if has_keywords[i] and conf_not_none_boosted[i] >= tau_len_adjusted + 0.10:
-                        keep_indices.append(i)
-    
-    if not keep_indices:
-        return []
-    
-    results = []
-    for i in sorted(keep_indices, key=lambda j: float(conf_not_none_boosted[j]), reverse=True):
-        sent_probs = probs[i, 1:].clone()
-        top_idx = int(torch.argmax(sent_probs).item())
-        top_p = float(sent_probs[top_idx].item())
-        
-        sent_probs[top_idx] = -1.0
-        second_p = float(sent_probs.max().item())
-        margin = top_p - second_p
-        
-        min_margin_adj = MIN_MARGIN
-        if has_keywords[i]:
-            min_margin_adj = MIN_MARGIN - 0.02
-        
-        if top_p < MIN_SENT_PROB or margin < min_margin_adj:
-            continue
-        
-        sentiment_str = LABEL_MAP[top_idx + 1]
-        results.append({
-            "topic": ASPECTS_EN[i],
-            "sentiment": sentiment_str,
-            "confidence": float(conf_not_none_boosted[i].item()),
-            "sentiment_confidence": top_p,
-            "margin": margin
-        })
-    
-    results.sort(key=lambda x: x["confidence"], reverse=True)
-    return results
+            metrics.HTTP_CACHE.inc(route=route, result='miss')
+            response = make_response(render())
+            # Chỉ cache trang thành công; lỗi/redirect (kèm flash) trả nguyên như cũ
+            if response.status_code != 200 or response.is_streamed or '_flashes' in session:
+                return response
+            data_versions.render_cache.put(etag, response.get_data(), response.mimetype)
+    response.set_etag(etag)
+    if versions.updated_at is not None:
+        response.last_modified = versions.updated_at
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    return response
 
-def save_feedback_to_db(text, results, user_id):
-    """Lưu feedback results vào database"""
+# model_version của engine vừa phân tích trong thread này (engine có thể bị đổi giữa lúc phân tích và lúc lưu)
+_served = threading.local()
+
+def served_model_version():
+    return getattr(_served, 'version', None) or engine.model_version
+
+def analyze_feedback(text, with_scores=False, deadline=None):
+    """Phân tích feedback với model Pair-ABSA (qua admission control, ưu tiên cao)"""
+    if with_scores:
+        results, scores = analyze_feedback_batch([text], True, admission.INTERACTIVE, deadline)
+        return results[0], scores[0]
+    return analyze_feedback_batch([text], False, admission.INTERACTIVE, deadline)[0]
+
+def analyze_feedback_batch(texts, with_scores=False, priority=admission.BULK, deadline=None):
+    """Phân tích nhiều feedback trong một lượt batch (thứ tự kết quả giữ nguyên)"""
+    current = engine
+    with admission.controller.admit(priority, deadline):
+        try:
+            output = current.analyze_many(texts, with_scores=with_scores)
+        except InferenceUnavailable:
+            raise admission.Rejected(503, 'inference_unavailable', UNAVAILABLE_RETRY_AFTER)
+    _served.version = current.model_version
+    model_manager.maybe_shadow(texts, output[0] if with_scores else output)
+    return output
+
+def analyze_upload_batch(texts, headers, resume=False):
+    """Một batch BULK của /analyze-csv
+
+    resume: upload đã lưu một phần vào database, batch bị admission từ chối được
+    chờ rồi thử lại (tối đa CSV_ADMISSION_WAIT giây) thay vì dừng lượt upload
+    """
+    give_up = time.monotonic() + CSV_ADMISSION_WAIT
+    while True:
+        try:
+            # Mỗi batch xếp hàng sau các request /predict đang chờ
+            deadline = admission.deadline_for(admission.BULK, headers)
+            return analyze_feedback_batch(texts, with_scores=True, deadline=deadline)
+        except admission.Rejected as e:
+            wait = min(e.retry_after, give_up - time.monotonic())
+            if not resume or wait <= 0:
+                raise
+            time.sleep(wait)
+
+def save_feedback_to_db(text, results, user_id, score=None, version=None):
+    """Lưu feedback results vào database (kèm xác suất thô nếu có score)"""
+    version = version or served_model_version()
+    score_row = None
+    if score is not None:
+        probs_blob, keyword_mask = score[:2]
+        score_row = FeedbackScore(text=text, probs=probs_blob, keyword_mask=keyword_mask, user_id=user_id,
+                                  model_version=version)
+        db.session.add(score_row)
+        if results and len(score) > 2 and score[2] is not None:
+            # Ghi vào embedding index sau khi commit (lúc đó score_row mới có id); không aspect nào
+            # được giữ thì không có dòng feedbacks để trả về trong /api/similar
+            embedding_index.stage(db.session, score_row, user_id, version, score[2])
     for result in results:
         sentiment_conf = result.get('sentiment_confidence', result['confidence'])
         topic_conf = result['confidence']
@@ -199,10 +283,20 @@ def save_feedback_to_db(text, results, user_id):
             topic=result['topic'],
             sentiment_confidence=sentiment_conf,
             topic_confidence=topic_conf,
-            user_id=user_id
+            user_id=user_id,
+            score=score_row,
+            model_version=version
         )
         db.session.add(feedback)
 
+@app.errorhandler(admission.Rejected)
+def rejected_response(error):
+    """Admission control từ chối: trả lỗi ngay kèm Retry-After thay vì để client chờ tới timeout"""
+    response = jsonify({'error': error.message, 'retry_after': error.retry_after})
+    response.status_code = error.status
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
 def admin_required(f):
     """Decorator để yêu cầu quyền admin"""
     @wraps(f)
@@ -215,27 +309,30 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-MODEL_REPO = "Ptul2x5/Student_Feedback_Sentiment"
+INFERENCE_SOCKET = os.environ.get("INFERENCE_SOCKET")
+CSV_BATCH_SIZE = int(os.environ.get("CSV_BATCH_SIZE", "64"))
+# Upload đã lưu một phần: thời gian tối đa chờ admission cho mỗi batch còn lại
+CSV_ADMISSION_WAIT = float(os.environ.get("CSV_ADMISSION_WAIT", "120"))
+# Số dòng kết quả trả về client (file lớn chỉ trả tổng số + các dòng đầu)
+CSV_RESULT_PREVIEW = 50
+LOAD_MODEL = os.environ.get("LOAD_MODEL", "True").lower() == "true"
 
-try:
-    os.environ['HF_HUB_ENABLE_HF_TRANSFER'] = '0'
-    tokenizer = AutoTokenizer.from_pretrained(MODEL_REPO, use_fast=False)
-    MODEL_URL = f"https://huggingface.co/{MODEL_REPO}/resolve/main/model.bin"
-    loaded = torch.hub.load_state_dict_from_url(MODEL_URL, map_location=device)
-    
-    if isinstance(loaded, dict) and "model_state" in loaded:
-        state_dict = loaded["model_state"]
-    else:
-        state_dict = loaded
-    
-    model = PhoBERTPairABSA(base_model=BASE_MODEL, num_cls=NUM_CLASSES, dropout=DROPOUT)
-    model.load_state_dict(state_dict, strict=False)
-    model.to(device)
-    model.eval()
-except Exception:
-    model = None
-    tokenizer = None
+# INFERENCE_SOCKET: model chạy trong inference_service.py, web worker chỉ gửi job qua UNIX socket;
+# LOAD_MODEL=False (benchmark/bảo trì): không có model, có thể gán engine khác sau khi import;
+# còn lại model được load trong thread nền, torch không được import lúc import app.py
+engine = inference_backend.create_engine(INFERENCE_SOCKET, LOAD_MODEL)
+
+def _set_engine(new_engine):
+    global engine
+    engine = new_engine
+
+model_manager = model_registry.ModelManager(lambda: engine, _set_engine)
+
+@app.before_request
+def sync_model_version():
+    # Worker khác vừa đổi model: load version mới trong nền, request này vẫn dùng model cũ
+    if not INFERENCE_SOCKET:
+        model_manager.sync()
 
 @app.route("/", methods=["GET"])
 @login_required
@@ -288,9 +385,19 @@ def logout():
 def health():
     return jsonify({"status": "healthy"})
 
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    token = os.environ.get("METRICS_TOKEN")
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        return Response("Unauthorized\n", status=401, mimetype="text/plain")
+    return Response(metrics.REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
 @app.route("/my-statistics")
 @login_required
 def my_statistics():
+    return conditional_render('my_statistics', [data_versions.user_scope(current_user.id)], _render_my_statistics)
+
+def _render_my_statistics():
     try:
         user_feedbacks = Feedback.query.filter_by(user_id=current_user.id).all()
         total_feedbacks = len(user_feedbacks)
@@ -335,6 +442,9 @@ def my_statistics():
 @app.route("/admin/database")
 @admin_required
 def view_database():
+    return conditional_render('view_database', [data_versions.GLOBAL], _render_database_view)
+
+def _render_database_view():
     try:
         total_users = User.query.count()
         total_feedbacks = Feedback.query.count()
@@ -361,20 +471,86 @@ def view_database():
         ).order_by('date').all()
         daily_stats = [{'date': str(item.date), 'count': item.count} for item in daily_stats]
         
+        with metrics.time_stage('db_query'):
+            trend_report = trends_payload(trends.report())
+            trend_series = trends_payload(trends.series())
+        
         return render_template('database_view.html',
                              total_users=total_users,
                              total_feedbacks=total_feedbacks,
                              recent_feedbacks=recent_feedbacks,
                              sentiment_stats=sentiment_stats,
                              topic_stats=topic_stats,
-                             daily_stats=daily_stats)
+                             daily_stats=daily_stats,
+                             trend_report=trend_report,
+                             trend_series=trend_series)
     except Exception as e:
         flash(f'Lỗi khi tải dữ liệu: {str(e)}', 'danger')
         return redirect(url_for('home'))
 
+def trends_payload(data):
+    """Đổi các mốc thời gian UTC trong báo cáo trends sang giờ Việt Nam (chuỗi) để trả JSON/hiển thị"""
+    if isinstance(data, datetime):
+        return utc_to_vietnam_time(data).strftime('%H:%M %d/%m/%Y')
+    if isinstance(data, dict):
+        return {key: trends_payload(value) for key, value in data.items()}
+    if isinstance(data, list):
+        return [trends_payload(value) for value in data]
+    return data
+
+@app.route("/api/trends", methods=["GET"])
+@admin_required
+def get_trends():
+    try:
+        window_hours = request.args.get('window_hours', trends.TREND_WINDOW_HOURS, type=int)
+        baseline_days = request.args.get('baseline_days', trends.TREND_BASELINE_DAYS, type=int)
+        days = request.args.get('days', 7, type=int)
+        hours_per_point = request.args.get('hours_per_point', 24, type=int)
+        if not (1 <= window_hours <= 24 * 31 and 1 <= baseline_days <= 365 and 1 <= days <= 365
+                and 1 <= hours_per_point <= 24 * 7):
+            return jsonify({'error': 'Tham số khoảng thời gian không hợp lệ'}), 400
+        
+        with metrics.time_stage('db_query'):
+            report = trends.report(window_hours=window_hours, baseline_days=baseline_days)
+            series = trends.series(days=days, hours_per_point=hours_per_point)
+        return jsonify({'report': trends_payload(report), 'series': trends_payload(series)})
+    except Exception as e:
+        return jsonify({"error": f"Có lỗi xảy ra: {str(e)}"}), 500
+
+@app.route("/admin/profiles")
+@admin_required
+def view_profiles():
+    return render_template('profiles.html',
+                           profiles=profiling.list_profiles(),
+                           selected=None,
+                           sample_rate=profiling._sample_rate())
+
+@app.route("/admin/profiles/<profile_id>")
+@admin_required
+def view_profile(profile_id):
+    selected = profiling.load_profile(profile_id)
+    if selected is None:
+        abort(404)
+    return render_template('profiles.html',
+                           profiles=profiling.list_profiles(),
+                           selected=selected,
+                           sample_rate=profiling._sample_rate())
+
+@app.route("/admin/profiles/<profile_id>/download")
+@admin_required
+def download_profile(profile_id):
+    path = os.path.join(profiling.PROFILE_DIR, f"{os.path.basename(profile_id)}.prof")
+    if not os.path.exists(path):
+        abort(404)
+    return send_file(path, as_attachment=True, download_name=f"{os.path.basename(profile_id)}.prof")
+
 @app.route("/api/feedback-history", methods=["GET"])
 @login_required
 def get_feedback_history():
+    return conditional_render('feedback_history', [data_versions.user_scope(current_user.id)],
+                              _render_feedback_history)
+
+def _render_feedback_history():
     try:
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 10, type=int)
@@ -409,8 +585,9 @@ def get_feedback_history():
                 except ValueError:
                     return jsonify({'error': 'Định dạng ngày không hợp lệ'}), 400
         
-        total_count = query.count()
-        feedbacks = query.order_by(Feedback.created_at.desc()).paginate(page=page, per_page=per_page, error_out=False)
+        with metrics.time_stage('db_query'):
+            total_count = query.count()
+            feedbacks = query.order_by(Feedback.created_at.desc()).paginate(page=page, per_page=per_page, error_out=False)
         
         feedback_list = []
         for feedback in feedbacks.items:
@@ -435,35 +612,219 @@ def get_feedback_history():
     except Exception as e:
         return jsonify({"error": f"Có lỗi xảy ra: {str(e)}"}), 500
 
-@app.route("/predict", methods=["POST"])
+@app.route("/api/search", methods=["GET"])
 @login_required
-def predict():
+def search_feedback():
+    """Tìm feedback theo nội dung (không phân biệt dấu), admin tìm trên toàn bộ, user chỉ trong feedback của mình"""
     try:
-        data = request.get_json()
-        text = data.get("text", "").strip()
+        q = request.args.get('q', '', type=str).strip()
+        if not q:
+            return jsonify({'error': "Thiếu tham số 'q'"}), 400
+        page = request.args.get('page', 1, type=int)
+        per_page = request.args.get('per_page', 20, type=int)
+        topic = request.args.get('topic') or None
+        sentiment = request.args.get('sentiment') or None
+        start_date = request.args.get('start_date', None, type=str)
+        end_date = request.args.get('end_date', None, type=str)
+        
+        try:
+            start_utc, end_utc = parse_date_range(start_date, end_date)
+        except ValueError:
+            return jsonify({'error': 'Định dạng ngày không hợp lệ'}), 400
+        
+        user_id = None if current_user.is_admin else current_user.id
+        with metrics.time_stage('db_query'):
+            rows, total = search_index.search(q, topic=topic, sentiment=sentiment, start=start_utc, end=end_utc,
+                                              user_id=user_id, page=page, per_page=per_page)
+        
+        usernames = {}
+        if current_user.is_admin and rows:
+            user_ids = {row.user_id for row in rows}
+            usernames = dict(db.session.query(User.id, User.username).filter(User.id.in_(user_ids)).all())
+        
+        per_page = max(1, min(per_page, search_index.MAX_PER_PAGE))
+        feedback_list = []
+        for row in rows:
+            created_at = row.created_at
+            if isinstance(created_at, str):
+                created_at = datetime.fromisoformat(created_at)
+            feedback_list.append({
+                'id': row.id,
+                'text': row.text,
+                'sentiment': row.sentiment,
+                'topic': row.topic,
+                'sentiment_confidence': row.sentiment_confidence,
+                'topic_confidence': row.topic_confidence,
+                'username': usernames.get(row.user_id),
+                'created_at': utc_to_vietnam_time(created_at).strftime('%H:%M:%S %d/%m/%Y') if created_at else None
+            })
+        
+        pages = (total + per_page - 1) // per_page
+        return jsonify({
+            'feedbacks': feedback_list,
+            'total': total,
+            'pages': pages,
+            'current_page': page,
+            'has_next': page < pages,
+            'has_prev': page > 1
+        })
+    except Exception as e:
+        return jsonify({"error": f"Có lỗi xảy ra: {str(e)}"}), 500
 
-        if not text:
-            return jsonify({"error": "Missing 'text' field"}), 400
+@app.route("/api/similar", methods=["GET"])
+@login_required
+def similar_feedback():
+    """Feedback tương tự một text hoặc một feedback đã lưu (embedding index), admin trên toàn bộ, user trong feedback của mình"""
+    try:
+        text = request.args.get('text', '', type=str).strip()
+        feedback_id = request.args.get('feedback_id', None, type=int)
+        k = max(1, min(request.args.get('k', 10, type=int), 50))
+        if not text and feedback_id is None:
+            return jsonify({'error': "Thiếu tham số 'text' hoặc 'feedback_id'"}), 400
+        
+        user_id = None if current_user.is_admin else current_user.id
+        version = engine.model_version
+        index = embedding_index.get_index(version)
+        exclude_score_id = None
+        if feedback_id is not None:
+            feedback = db.session.get(Feedback, feedback_id)
+            if feedback is None or (user_id is not None and feedback.user_id != user_id):
+                return jsonify({'error': 'Không tìm thấy feedback'}), 404
+            query = index.vector_of(feedback.score_id) if feedback.score_id is not None else None
+            if query is None:
+                return jsonify({'error': 'Feedback chưa có embedding với model hiện tại (chạy embedding_index.py --backfill)'}), 404
+            exclude_score_id = feedback.score_id
+        else:
+            if len(text) > 1000:
+                return jsonify({"error": "Text quá dài. Vui lòng nhập tối đa 1000 ký tự."}), 400
+            reject_if_model_loading()
+            deadline = admission.deadline_for(admission.INTERACTIVE, request.headers)
+            _, scores = analyze_feedback_batch([text], True, admission.INTERACTIVE, deadline)
+            score = scores[0]
+            if score is None or len(score) < 3 or score[2] is None:
+                return jsonify({'error': 'Không tính được embedding cho nội dung này'}), 400
+            query = embedding_index.vector_from_blob(score[2])
+        
+        # Index có thể còn vector của feedback đã xoá hoặc không có aspect nào (dữ liệu cũ):
+        # lấy dư rồi lọc, tăng dần tới khi đủ k kết quả có dòng feedbacks
+        fetch = k * 2
+        while True:
+            with metrics.time_stage('embedding_search'):
+                neighbours = index.search(query, k=fetch, user_id=user_id, exclude_score_id=exclude_score_id)
+            score_ids = [score_id for score_id, _ in neighbours]
+            with metrics.time_stage('db_query'):
+                aspects = {}
+                for row in Feedback.query.filter(Feedback.score_id.in_(score_ids)).order_by(Feedback.id).all():
+                    aspects.setdefault(row.score_id, []).append(row)
+            neighbours = [(score_id, similarity) for score_id, similarity in neighbours if score_id in aspects]
+            if len(neighbours) >= k or len(score_ids) < fetch or fetch >= len(index):
+                break
+            fetch *= 4
+        neighbours = neighbours[:k]
+        with metrics.time_stage('db_query'):
+            score_rows = {row.id: row for row in
+                          FeedbackScore.query.filter(FeedbackScore.id.in_([s for s, _ in neighbours])).all()}
+        
+        similar = []
+        for score_id, similarity in neighbours:
+            score_row = score_rows.get(score_id)
+            if score_row is None:
+                continue
+            rows = aspects[score_id]
+            similar.append({
+                'feedback_id': rows[0].id,
+                'text': score_row.text,
+                'similarity': round(similarity, 4),
+                'aspects': [{'topic': row.topic, 'sentiment': row.sentiment} for row in rows],
+                'created_at': utc_to_vietnam_time(score_row.created_at).strftime('%H:%M:%S %d/%m/%Y')
+                if score_row.created_at else None
+            })
+        
+        return jsonify({'model_version': version, 'indexed': len(index), 'similar': similar})
+    except admission.Rejected as e:
+        return rejected_response(e)
+    except Exception as e:
+        return jsonify({"error": f"Có lỗi xảy ra: {str(e)}"}), 500
 
-        if len(text) > 1000:
-            return jsonify({"error": "Text quá dài. Vui lòng nhập tối đa 1000 ký tự."}), 400
+@app.route("/api/export", methods=["GET"])
+@login_required
+def export_feedback():
+    """Tải feedback (CSV/Parquet/Arrow) dạng stream, admin xuất toàn bộ, user chỉ feedback của mình"""
+    fmt = request.args.get('format', 'csv', type=str).lower()
+    if fmt not in export.FORMATS:
+        return jsonify({'error': f"Định dạng không hỗ trợ, chọn một trong: {', '.join(export.FORMATS)}"}), 400
+    if fmt != 'csv' and not export.columnar_available():
+        return jsonify({'error': 'Server chưa cài pyarrow, chỉ xuất được CSV'}), 501
+    try:
+        start_utc, end_utc = parse_date_range(request.args.get('start_date'), request.args.get('end_date'))
+    except ValueError:
+        return jsonify({'error': 'Định dạng ngày không hợp lệ'}), 400
+    
+    user_id = request.args.get('user_id', None, type=int) if current_user.is_admin else current_user.id
+    body = export.export_stream(fmt, topic=request.args.get('topic') or None,
+                                sentiment=request.args.get('sentiment') or None,
+                                start=start_utc, end=end_utc, user_id=user_id)
+    mimetype, extension = export.FORMATS[fmt]
+    filename = f"feedback_export_{datetime.now(VIETNAM_TIMEZONE).strftime('%Y%m%d_%H%M%S')}.{extension}"
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
 
-        if tokenizer is None or model is None:
-            return jsonify({"error": "Model or tokenizer not loaded. Please restart the application."}), 500
+def reject_if_model_loading():
+    """Worker vừa khởi động, model còn đang load trong nền (hoặc inference service không trả lời):
+    trả 503 + Retry-After thay vì báo lỗi model"""
+    if getattr(engine, 'loading', False):
+        raise admission.Rejected(503, 'model_loading', inference_backend.MODEL_LOADING_RETRY_AFTER)
+    if getattr(engine, 'unavailable', False):
+        raise admission.Rejected(503, 'inference_unavailable', UNAVAILABLE_RETRY_AFTER)
 
-        results = analyze_feedback(text)
+def validate_predict_request(data):
+    """Kiểm tra body của /predict; trả về (text, None) hoặc (None, (payload lỗi, status))"""
+    text = (data or {}).get("text", "").strip()
+    if not text:
+        return None, ({"error": "Missing 'text' field"}, 400)
+    if len(text) > 1000:
+        return None, ({"error": "Text quá dài. Vui lòng nhập tối đa 1000 ký tự."}, 400)
+    if not engine.is_ready:
+        metrics.MODEL_UNAVAILABLE.inc(route=metrics.current_route())
+        reject_if_model_loading()
+        return None, ({"error": "Model or tokenizer not loaded. Please restart the application."}, 500)
+    return text, None
 
-        try:
-            save_feedback_to_db(text, results, current_user.id)
+def store_prediction(text, results, user_id, score, version=None):
+    """Lưu kết quả /predict (lỗi DB chỉ được đếm, không làm hỏng response); trả về True nếu đã ghi"""
+    try:
+        save_feedback_to_db(text, results, user_id, score, version)
+        with metrics.time_stage('db_commit'):
             db.session.commit()
+        return True
+    except Exception:
+        db.session.rollback()
+        metrics.DB_ERRORS.inc(route=metrics.current_route())
+        return False
+
+def predict_response(results):
+    return {
+        "results": results,
+        "has_multiple_topics": len(results) > 1
+    }
+
+@app.route("/predict", methods=["POST"])
+@login_required
+def predict():
+    try:
+        text, error = validate_predict_request(request.get_json())
+        if error:
+            return jsonify(error[0]), error[1]
+
+        deadline = admission.deadline_for(admission.INTERACTIVE, request.headers)
+        results, score = analyze_feedback(text, with_scores=True, deadline=deadline)
+
+        if store_prediction(text, results, current_user.id, score):
             backup_database()
-        except Exception:
-            pass
 
-        return jsonify({
-            "results": results,
-            "has_multiple_topics": len(results) > 1
-        })
+        return jsonify(predict_response(results))
+    except admission.Rejected as e:
+        return rejected_response(e)
     except Exception as e:
         return jsonify({"error": f"Có lỗi xảy ra khi xử lý: {str(e)}"}), 500
 
@@ -489,33 +850,93 @@ def manual_restore():
     except Exception as e:
         return jsonify({"success": False, "message": f"Restore error: {str(e)}"}), 500
 
-with app.app_context():
-    db_manager.initialize_database_if_needed()
-    db.create_all()
-    db_manager.backup_database()
-    
+@app.route('/admin/models', methods=['GET'])
+@admin_required
+def list_models():
+    return jsonify(model_manager.describe())
+
+@app.route('/admin/models', methods=['POST'])
+@admin_required
+def register_model():
+    """Đăng ký checkpoint mới: upload file 'checkpoint' hoặc tải 'revision' từ Hugging Face Hub"""
     try:
-        db.session.execute(db.text("SELECT is_admin FROM users LIMIT 1"))
-    except Exception:
+        version = request.form.get('version') or None
+        if 'checkpoint' in request.files and request.files['checkpoint'].filename:
+            meta = model_registry.register(request.files['checkpoint'].stream, version=version)
+        elif request.form.get('revision'):
+            meta = model_registry.register_revision(request.form['revision'])
+        else:
+            return jsonify({"success": False, "message": "Cần file checkpoint hoặc revision"}), 400
+    except model_registry.ModelRegistryError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "message": f"Lỗi khi đăng ký model: {str(e)}"}), 500
+    return jsonify({"success": True, "model": meta})
+
+@app.route('/admin/models/<version>/activate', methods=['POST'])
+@admin_required
+def activate_model(version):
+    """Load + smoke test + đổi model trong nền; theo dõi trạng thái qua GET /admin/models"""
+    if INFERENCE_SOCKET:
+        return jsonify({"success": False,
+                        "message": "Model chạy trong inference_service.py: chọn version rồi khởi động lại service"}), 409
+    try:
+        if not model_manager.activate(version):
+            return jsonify({"success": False, "message": "Đang load một model khác"}), 409
+    except model_registry.ModelRegistryError as e:
+        return jsonify({"success": False, "message": str(e)}), 404
+    return jsonify({"success": True, "status": model_manager.status}), 202
+
+@app.route('/admin/models/<version>/shadow', methods=['POST'])
+@admin_required
+def shadow_model(version):
+    """Chạy version song song trên percent% lượt phân tích để so sánh (percent=0 để tắt)"""
+    if INFERENCE_SOCKET:
+        return jsonify({"success": False, "message": "Shadow chỉ hỗ trợ khi model chạy trong web worker"}), 409
+    try:
+        percent = float(request.form.get('percent', request.args.get('percent', 0)))
+        model_manager.start_shadow(version, percent)
+    except ValueError:
+        return jsonify({"success": False, "message": "percent phải là số"}), 400
+    except model_registry.ModelRegistryError as e:
+        return jsonify({"success": False, "message": str(e)}), 404
+    return jsonify({"success": True}), 202
+
+# Khởi tạo/restore DB và migration chạy lần lượt từng worker (worker đầu tiên
+# làm, các worker sau thấy đã xong); backup lúc khởi động chỉ một worker chạy
+with app.app_context():
+    with coordination.exclusive('startup'):
+        db_manager.initialize_database_if_needed()
+        db.create_all()
+        
         try:
-            db.session.execute(db.text("ALTER TABLE users ADD COLUMN is_admin BOOLEAN DEFAULT 0"))
-            db.session.commit()
+            db.session.execute(db.text("SELECT is_admin FROM users LIMIT 1"))
+        except Exception:
+            try:
+                db.session.execute(db.text("ALTER TABLE users ADD COLUMN is_admin BOOLEAN DEFAULT 0"))
+                db.session.commit()
+            except Exception:
+                pass
+        
+        upgrade_schema()
+        search_index.ensure_search_index()
+        trends.ensure_trend_buckets()
+        
+        try:
+            total_users = User.query.count()
+            admin_user = User.query.filter_by(username='admin').first()
+            if not admin_user and total_users == 0:
+                admin_user = User(username='admin', is_admin=True)
+                admin_user.set_password('123456')
+                db.session.add(admin_user)
+                db.session.commit()
+            elif admin_user and not admin_user.is_admin:
+                admin_user.is_admin = True
+                db.session.commit()
         except Exception:
             pass
-    
-    try:
-        total_users = User.query.count()
-        admin_user = User.query.filter_by(username='admin').first()
-        if not admin_user and total_users == 0:
-            admin_user = User(username='admin', is_admin=True)
-            admin_user.set_password('123456')
-            db.session.add(admin_user)
-            db.session.commit()
-        elif admin_user and not admin_user.is_admin:
-            admin_user.is_admin = True
-            db.session.commit()
-    except Exception:
-        pass
+        
+    coordination.run_once('startup_backup', coordination.STARTUP_BACKUP_TTL, backup_database)
 
 @app.route("/analyze-csv", methods=["POST"])
 @login_required
@@ -528,132 +949,218 @@ def analyze_csv():
         if file.filename == '':
             return jsonify({'error': 'Chưa chọn file'}), 400
         
-        if not file.filename.lower().endswith('.csv'):
-            return jsonify({'error': 'File phải có định dạng CSV'}), 400
+        if not csv_upload.allowed_filename(file.filename):
+            return jsonify({'error': 'File phải có định dạng CSV (.csv, .csv.gz hoặc .csv.zst)'}), 400
         
+        # Đọc dạng stream: giải nén + decode từng phần, không giữ cả file trong RAM
         try:
-            file_content = file.stream.read().decode("UTF8")
+            csv_input = csv.DictReader(csv_upload.open_text(file.stream))
+            feedback_column = csv_upload.find_feedback_column(csv_input.fieldnames)
+        except csv_upload.UploadError as e:
+            return jsonify({'error': e.message}), e.status
         except UnicodeDecodeError:
-            return jsonify({'error': 'File CSV phải được mã hóa UTF-8'}), 400
-        
-        try:
-            stream = io.StringIO(file_content, newline=None)
-            csv_input = csv.DictReader(stream)
-            
-            if not csv_input.fieldnames:
-                return jsonify({'error': 'File CSV không có header'}), 400
-            
-            feedback_column = None
-            available_columns = []
-            for col in csv_input.fieldnames:
-                available_columns.append(col)
-                if col.lower().strip() in ['feedback', 'text', 'content', 'comment']:
-                    feedback_column = col
-                    break
-            
-            if not feedback_column:
-                return jsonify({
-                    'error': f'Không tìm thấy cột chứa feedback. Các cột: {", ".join(available_columns)}'
-                }), 400
-            
-            rows = list(csv_input)
-            if not rows:
-                return jsonify({'error': 'File CSV không có dữ liệu'}), 400
+            return jsonify({'error': 'File CSV phải được mã hóa UTF-8 hoặc UTF-16'}), 400
         except csv.Error as e:
             return jsonify({'error': f'File CSV không đúng định dạng: {str(e)}'}), 400
         except Exception as e:
             return jsonify({'error': f'Lỗi khi đọc file CSV: {str(e)}'}), 400
         
         results = []
+        total_rows = 0
         processed_count = 0
         error_count = 0
+        # Dòng cuối cùng đã commit: client biết phải gửi lại từ đâu nếu upload dừng giữa chừng
+        saved_count = 0
+        last_saved_row = None
+        # Export CSV thường lặp lại một comment (y nguyên hoặc chỉ khác dấu câu,
+        # hoa/thường, có/không dấu): trong mỗi chunk, các text cùng khoá chuẩn hoá
+        # chỉ chạy model một lần (các khoá của chunk được gom thành batch). Kết quả
+        # phân tích bị bỏ sau khi chunk commit; cụm hiển thị (top_clusters,
+        # cluster_id) nằm trong UploadClusters có giới hạn, nên bộ nhớ không tăng
+        # theo kích thước file. NEAR_DUP_FUZZY gom thêm các câu gần giống để hiển
+        # thị nhưng không bao giờ dùng chung kết quả phân tích.
+        reject_if_model_loading()
+        import near_dup  # numpy chỉ cần cho route này
+        clusters = near_dup.UploadClusters()
+        collapsed = 0
         
-        for row_num, row in enumerate(rows, start=1):
-            feedback_text = row[feedback_column].strip()
-            
-            if not feedback_text:
-                error_count += 1
-                results.append({
-                    'row': row_num,
-                    'text': '',
-                    'error': 'Feedback trống'
-                })
-                continue
-            
-            try:
-                if tokenizer is None or model is None:
-                    results.append({
-                        "row": row_num,
-                        "feedback": feedback_text,
-                        "error": "Model or tokenizer not loaded"
-                    })
-                    continue
+        try:
+            for chunk_rows in csv_upload.iter_row_chunks(csv_input, feedback_column):
+                chunk_keys = {}
+                row_keys = []
+                for _, text in chunk_rows:
+                    if not text:
+                        row_keys.append(None)
+                        continue
+                    key = near_dup.analysis_key(text)
+                    # Text đầu tiên của mỗi khoá được đưa vào model
+                    chunk_keys.setdefault(key, text)
+                    row_keys.append((key, clusters.add(text, key)))
                 
-                row_topics = analyze_feedback(feedback_text)
+                analysis = {}
+                if engine.is_ready:
+                    pending = list(chunk_keys.items())
+                    # Text khác nhau (chỉ khác dấu câu, hoa/thường...) nhưng dùng chung kết quả
+                    collapsed += len({text for _, text in chunk_rows if text}) - len(pending)
+                    for start in range(0, len(pending), CSV_BATCH_SIZE):
+                        batch = pending[start:start + CSV_BATCH_SIZE]
+                        try:
+                            batch_results, batch_scores = analyze_upload_batch(
+                                [text for _, text in batch], request.headers, resume=saved_count > 0)
+                            for (key, _), topics, score in zip(batch, batch_results, batch_scores):
+                                analysis[key] = (topics, score)
+                        except admission.Rejected:
+                            raise
+                        except Exception as e:
+                            for key, _ in batch:
+                                analysis[key] = e
                 
-                try:
-                    save_feedback_to_db(feedback_text, row_topics, current_user.id)
-                    
-                    if row_topics:
-                        first = row_topics[0]
-                        first_topic = first['topic']
-                        first_sentiment = first['sentiment']
-                        first_sentiment_conf = first.get('sentiment_confidence', first['confidence'])
-                        first_topic_conf = first['confidence']
+                seen_keys = set()
+                for (row_num, feedback_text), row_key in zip(chunk_rows, row_keys):
+                    total_rows += 1
+                    row_result = _analyze_csv_row(row_num, feedback_text, row_key, analysis, seen_keys)
+                    if row_result.get('success'):
+                        processed_count += 1
                     else:
-                        first_topic = 'others'
-                        first_sentiment = 'neutral'
-                        first_sentiment_conf = 0.0
-                        first_topic_conf = 0.0
-                    
-                    results.append({
-                        'row': row_num,
-                        'text': feedback_text[:100] + '...' if len(feedback_text) > 100 else feedback_text,
-                        'sentiment': first_sentiment,
-                        'topic': first_topic,
-                        'sentiment_confidence': round(first_sentiment_conf * 100, 1),
-                        'topic_confidence': round(first_topic_conf * 100, 1),
-                        'success': True
-                    })
-                    processed_count += 1
-                except Exception as db_err:
-                    error_count += 1
-                    results.append({
-                        'row': row_num,
-                        'text': feedback_text[:100] + '...' if len(feedback_text) > 100 else feedback_text,
-                        'error': f'Lỗi lưu database: {str(db_err)}'
-                    })
+                        error_count += 1
+                    if len(results) < CSV_RESULT_PREVIEW:
+                        results.append(row_result)
+                        if 'cluster_id' in row_result:
+                            clusters.watch(row_result['cluster_id'])
                 
-            except Exception as e:
-                error_count += 1
-                results.append({
-                    'row': row_num,
-                    'text': feedback_text[:100] + '...' if len(feedback_text) > 100 else feedback_text,
-                    'error': f'Lỗi phân tích: {str(e)}'
-                })
-        
-        try:
-            db.session.commit()
-            backup_database()
-        except Exception as commit_error:
+                # Commit từng chunk: không giữ cả file trong session, không khoá ghi SQLite suốt lượt upload
+                try:
+                    with metrics.time_stage('db_commit'):
+                        db.session.commit()
+                except Exception as commit_error:
+                    db.session.rollback()
+                    return jsonify({'error': f'Lỗi khi lưu dữ liệu: {str(commit_error)}',
+                                    'processed_count': saved_count, 'last_saved_row': last_saved_row}), 500
+                saved_count = processed_count
+                last_saved_row = chunk_rows[-1][0]
+        except admission.Rejected as e:
+            db.session.rollback()
+            if saved_count == 0:
+                # Chưa lưu gì: client gửi lại cả file theo Retry-After
+                raise
+            # Đã lưu một phần: không gửi Retry-After (gửi lại cả file sẽ tạo bản trùng)
+            return jsonify({
+                'error': f'Hệ thống đang quá tải: đã lưu {saved_count} feedback (tới dòng {last_saved_row}), '
+                         f'các dòng sau chưa được xử lý. Vui lòng tải lên phần còn lại của file sau ít phút.',
+                'partial': True,
+                'processed_count': saved_count,
+                'last_saved_row': last_saved_row,
+            }), 503
+        except (csv_upload.UploadError, UnicodeDecodeError, csv.Error) as e:
             db.session.rollback()
-            return jsonify({'error': f'Lỗi khi lưu dữ liệu: {str(commit_error)}'}), 500
+            if isinstance(e, csv_upload.UploadError):
+                message, status = e.message, e.status
+            elif isinstance(e, UnicodeDecodeError):
+                message, status = 'File CSV phải được mã hóa UTF-8 hoặc UTF-16', 400
+            else:
+                message, status = f'File CSV không đúng định dạng: {str(e)}', 400
+            if saved_count:
+                message += f' (đã lưu {saved_count} feedback tới dòng {last_saved_row})'
+            return jsonify({'error': message, 'processed_count': saved_count,
+                            'last_saved_row': last_saved_row}), status
+        
+        if total_rows == 0:
+            return jsonify({'error': 'File CSV không có dữ liệu'}), 400
+        if engine.is_ready:
+            metrics.NEAR_DUP_COLLAPSED.inc(collapsed, route=metrics.current_route())
+        backup_database()
+        
+        for row_result in results:
+            if 'cluster_id' in row_result:
+                row_result['cluster_size'] = clusters.size(row_result['cluster_id'])
         
         return jsonify({
             'success': True,
-            'total_rows': len(results),
+            'total_rows': total_rows,
             'processed_count': processed_count,
             'error_count': error_count,
-            'results': results[:50],
-            'message': f'Đã xử lý {processed_count}/{len(results)} feedback thành công'
+            'cluster_count': clusters.count,
+            # "Bao nhiêu sinh viên nói điều này": các cụm có từ 2 dòng trở lên, lớn nhất trước
+            'top_clusters': clusters.top_clusters(),
+            'results': results,
+            'message': f'Đã xử lý {processed_count}/{total_rows} feedback thành công'
         })
         
+    except admission.Rejected as e:
+        return rejected_response(e)
     except Exception as e:
         db.session.rollback()
         return jsonify({
             'error': f'Có lỗi xảy ra khi xử lý file CSV: {str(e)}'
         }), 500
 
+def _analyze_csv_row(row_num, feedback_text, row_key, analysis, seen_keys):
+    """Lưu kết quả phân tích của một dòng CSV, trả về dòng kết quả cho client"""
+    if not feedback_text:
+        return {
+            'row': row_num,
+            'text': '',
+            'error': 'Feedback trống'
+        }
+    
+    short_text = feedback_text[:100] + '...' if len(feedback_text) > 100 else feedback_text
+    try:
+        if not engine.is_ready:
+            metrics.MODEL_UNAVAILABLE.inc(route=metrics.current_route())
+            return {
+                "row": row_num,
+                "feedback": feedback_text,
+                "error": "Model or tokenizer not loaded"
+            }
+        
+        key, cluster_id = row_key
+        if key in seen_keys:
+            metrics.CACHE_HITS.inc(route=metrics.current_route())
+        seen_keys.add(key)
+        cached = analysis[key]
+        if isinstance(cached, Exception):
+            raise cached
+        row_topics, row_score = cached
+        
+        try:
+            save_feedback_to_db(feedback_text, row_topics, current_user.id, row_score)
+        except Exception as db_err:
+            metrics.DB_ERRORS.inc(route=metrics.current_route())
+            return {
+                'row': row_num,
+                'text': short_text,
+                'error': f'Lỗi lưu database: {str(db_err)}'
+            }
+        
+        if row_topics:
+            first = row_topics[0]
+            first_topic = first['topic']
+            first_sentiment = first['sentiment']
+            first_sentiment_conf = first.get('sentiment_confidence', first['confidence'])
+            first_topic_conf = first['confidence']
+        else:
+            first_topic = 'others'
+            first_sentiment = 'neutral'
+            first_sentiment_conf = 0.0
+            first_topic_conf = 0.0
+        
+        return {
+            'row': row_num,
+            'text': short_text,
+            'sentiment': first_sentiment,
+            'topic': first_topic,
+            'sentiment_confidence': round(first_sentiment_conf * 100, 1),
+            'topic_confidence': round(first_topic_conf * 100, 1),
+            'cluster_id': cluster_id,
+            'success': True
+        }
+    except Exception as e:
+        return {
+            'row': row_num,
+            'text': short_text,
+            'error': f'Lỗi phân tích: {str(e)}'
+        }
+
 if __name__ == "__main__":
     debug = os.environ.get("DEBUG", "False").lower() == "true"
     app.run(host="0.0.0.0", port=7860, debug=debug)
\ No newline at end of file
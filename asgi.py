@@ -0,0 +1,322 @@
+"""ASGI entrypoint: /predict xử lý bất đồng bộ, các route khác vẫn là Flask (WSGI)
+
+Dưới gunicorn sync mỗi request /predict giữ một worker thread suốt lượt model,
+commit DB và upload backup. Ở chế độ ASGI:
+
+  - POST /predict được xử lý ngay trên event loop: xác thực session + kiểm tra
+    input + ghi DB chạy trong thread pool nhỏ (ASGI_DB_THREADS), text được đưa
+    vào InferenceBatcher; batcher gom các request đang chờ thành một lượt
+    analyze_many (tối đa ASGI_BATCH_SIZE text hoặc chờ ASGI_BATCH_WAIT_MS) và
+    chạy trong ASGI_INFERENCE_THREADS thread. Hàng nghìn kết nối chờ chỉ tốn
+    một coroutine mỗi kết nối, không tốn thread. Hàng đợi của batcher có giới
+    hạn và text quá deadline bị bỏ trước khi chạy (admission.py, 429/503).
+  - Backup sau mỗi lần ghi chạy nền (BackgroundBackup): không chặn response,
+    các yêu cầu backup dồn lại trong lúc đang backup được gộp thành một lần.
+  - Mọi route khác (template, CSV, admin...) và /predict khi chưa đăng nhập
+    hoặc có yêu cầu profile được chuyển nguyên cho Flask qua asgiref.WsgiToAsgi.
+
+Chạy:  uvicorn asgi:application --host 0.0.0.0 --port 7860
+hoặc:  gunicorn asgi:application -k uvicorn.workers.UvicornWorker -c gunicorn.conf.py
+Đặt INFERENCE_SOCKET + ASGI_INFERENCE_THREADS = số worker của inference_service.py
+để nhiều batch chạy song song.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import asyncio
+import threading
+import contextvars
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.wsgi import WsgiToAsgi
+from flask import request, session
+from flask_login import current_user
+
+import app as flask_module
+import admission
+import metrics
+
+ASGI_BATCH_SIZE = int(os.getenv('ASGI_BATCH_SIZE', '16'))
+ASGI_BATCH_WAIT_MS = float(os.getenv('ASGI_BATCH_WAIT_MS', '5'))
+ASGI_INFERENCE_THREADS = int(os.getenv('ASGI_INFERENCE_THREADS', '1'))
+ASGI_DB_THREADS = int(os.getenv('ASGI_DB_THREADS', '4'))
+MAX_PREDICT_BODY = 64 * 1024
+
+PREDICT_ROUTE = '/predict'
+
+
+def _analyze_batch(texts, deadline):
+    """analyze_feedback_batch ưu tiên INTERACTIVE, kèm model_version của engine đã chạy"""
+    results, scores = flask_module.analyze_feedback_batch(texts, True, admission.INTERACTIVE, deadline)
+    return results, scores, flask_module.served_model_version()
+
+
+def _run(executor, func, *args):
+    """run_in_executor giữ contextvars (route hiện tại cho metrics)"""
+    ctx = contextvars.copy_context()
+    return asyncio.get_running_loop().run_in_executor(executor, lambda: ctx.run(func, *args))
+
+
+class InferenceBatcher:
+    def __init__(self, analyze, max_batch: int = ASGI_BATCH_SIZE, max_wait_ms: float = ASGI_BATCH_WAIT_MS,
+                 threads: int = ASGI_INFERENCE_THREADS):
+        """Gom text từ nhiều request thành batch analyze_many chạy trong thread pool"""
+        self.analyze = analyze
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000.0
+        self._executor = ThreadPoolExecutor(max_workers=max(1, threads), thread_name_prefix='asgi-inference')
+        self._slots = asyncio.Semaphore(max(1, threads))
+        self._queue = None
+        self._task = None
+
+    async def submit(self, text: str, deadline: float):
+        """Trả về (results, score, model_version) của một text; raise admission.Rejected nếu hàng đợi đầy/quá deadline"""
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+        # ADMISSION_QUEUE_SIZE tính theo lượt chạy model, mỗi lượt ở đây là một batch
+        if self._queue.qsize() >= admission.ADMISSION_QUEUE_SIZE * self.max_batch:
+            raise admission.controller.reject(429, 'queue_full', admission.INTERACTIVE)
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, deadline, future))
+        return await future
+
+    async def _loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Bỏ các text đã quá deadline trong lúc chờ (client đã bỏ đi)
+            now = time.monotonic()
+            for _, deadline, future in batch:
+                if deadline <= now and not future.done():
+                    future.set_exception(admission.controller.reject(503, 'deadline', admission.INTERACTIVE))
+            batch = [item for item in batch if not item[2].done()]
+            if not batch:
+                continue
+            # Chỉ lấy batch tiếp theo khi còn thread trống, request mới tiếp tục dồn vào queue
+            await self._slots.acquire()
+            loop.create_task(self._dispatch(batch))
+
+    async def _dispatch(self, batch):
+        try:
+            texts = [text for text, _, _ in batch]
+            deadline = max(deadline for _, deadline, _ in batch)
+            results, scores, version = await _run(self._executor, self.analyze, texts, deadline)
+            for (_, _, future), result, score in zip(batch, results, scores):
+                if not future.done():
+                    future.set_result((result, score, version))
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self._slots.release()
+
+
+class BackgroundBackup:
+    def __init__(self, backup):
+        """Chạy backup trong thread riêng; yêu cầu đến khi đang backup được gộp vào một lần chạy tiếp theo"""
+        self._backup = backup
+        self._lock = threading.Lock()
+        self._running = False
+        self._pending = False
+
+    def request(self):
+        with self._lock:
+            if self._running:
+                self._pending = True
+                return
+            self._running = True
+        threading.Thread(target=self._worker, name='asgi-backup', daemon=True).start()
+
+    def _worker(self):
+        while True:
+            self._backup()
+            with self._lock:
+                if not self._pending:
+                    self._running = False
+                    return
+                self._pending = False
+
+
+def _build_environ(scope, body: bytes) -> dict:
+    """WSGI environ tối thiểu từ ASGI scope (để dựng request context Flask: cookie session, header)"""
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf8').decode('latin1'),
+        'PATH_INFO': scope['path'].encode('utf8').decode('latin1'),
+        'QUERY_STRING': scope['query_string'].decode('ascii'),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'SERVER_NAME': scope.get('server', ('localhost', 80))[0],
+        'SERVER_PORT': str(scope.get('server', ('localhost', 80))[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    headers = defaultdict(list)
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin1')
+        if name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        elif name == 'content-type':
+            key = 'CONTENT_TYPE'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        headers[key].append(value.decode('latin1'))
+    for key, values in headers.items():
+        environ[key] = ','.join(values)
+    return environ
+
+
+class Application:
+    def __init__(self, flask_app=flask_module.app):
+        self.flask_app = flask_app
+        self.wsgi = WsgiToAsgi(flask_app)
+        self.batcher = InferenceBatcher(_analyze_batch)
+        self.backup = BackgroundBackup(flask_module.backup_database)
+        self._db_executor = ThreadPoolExecutor(max_workers=max(1, ASGI_DB_THREADS), thread_name_prefix='asgi-db')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http' and scope['method'] == 'POST' and scope['path'] == PREDICT_ROUTE:
+            await self._predict(scope, receive, send)
+        else:
+            await self.wsgi(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _predict(self, scope, receive, send):
+        start = time.perf_counter()
+        metrics.set_route(PREDICT_ROUTE)
+        body = await self._read_body(receive)
+        if body is None:
+            await self._send(send, 413, {'error': 'Request quá lớn'})
+            return
+        environ = _build_environ(scope, body)
+
+        try:
+            prepared = await _run(self._db_executor, self._prepare, environ)
+        except admission.Rejected as e:
+            # Model còn đang load trong nền
+            await self._send(send, e.status, {'error': e.message, 'retry_after': e.retry_after},
+                             [(b'retry-after', str(e.retry_after).encode('ascii'))])
+            return
+        if prepared is None:
+            # Chưa đăng nhập, yêu cầu profile...: để Flask xử lý như route thường
+            await self.wsgi(scope, self._replay(body), send)
+            return
+        user_id, text, error, deadline = prepared
+        extra_headers = []
+        if error:
+            status, payload = error[1], error[0]
+        else:
+            try:
+                results, score, version = await self.batcher.submit(text, deadline)
+                if await _run(self._db_executor, self._store, environ, text, results, user_id, score, version):
+                    self.backup.request()
+                status, payload = 200, flask_module.predict_response(results)
+            except admission.Rejected as e:
+                status, payload = e.status, {'error': e.message, 'retry_after': e.retry_after}
+                extra_headers.append((b'retry-after', str(e.retry_after).encode('ascii')))
+            except Exception as e:
+                status, payload = 500, {"error": f"Có lỗi xảy ra khi xử lý: {str(e)}"}
+        headers = await _run(self._db_executor, self._session_headers, environ) + extra_headers
+        await self._send(send, status, payload, headers)
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - start, route=PREDICT_ROUTE, status=status)
+
+    def _prepare(self, environ):
+        """Trong request context Flask: trả về None nếu cần chuyển cho Flask, ngược lại (user_id, text, lỗi, deadline)"""
+        with self.flask_app.request_context(environ):
+            # Các hook before_request của Flask mà fast path bỏ qua
+            flask_module.reopen_database_after_restore()
+            flask_module.sync_model_version()
+            if not current_user.is_authenticated:
+                return None
+            if environ.get('HTTP_X_PROFILE') == '1' or 'profile=1' in environ.get('QUERY_STRING', ''):
+                return None
+            try:
+                data = json.loads(environ['wsgi.input'].getvalue() or b'null')
+            except ValueError:
+                data = None
+            text, error = flask_module.validate_predict_request(data if isinstance(data, dict) else None)
+            deadline = admission.deadline_for(admission.INTERACTIVE, request.headers)
+            return current_user.id, text, error, deadline
+
+    def _store(self, environ, text, results, user_id, score, version):
+        with self.flask_app.request_context(environ):
+            return flask_module.store_prediction(text, results, user_id, score, version)
+
+    def _session_headers(self, environ) -> list:
+        """Set-Cookie nếu Flask-Login đã cập nhật session trong lúc xác thực"""
+        with self.flask_app.request_context(environ):
+            if not current_user.is_authenticated or not session.modified:
+                return []
+            response = self.flask_app.response_class()
+            self.flask_app.session_interface.save_session(self.flask_app, session, response)
+            return [(k.lower().encode('latin1'), v.encode('latin1'))
+                    for k, v in response.headers.items() if k.lower() == 'set-cookie']
+
+    @staticmethod
+    async def _read_body(receive):
+        body = bytearray()
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if len(body) > MAX_PREDICT_BODY:
+                return None
+            if not message.get('more_body'):
+                return bytes(body)
+
+    @staticmethod
+    def _replay(body: bytes):
+        sent = False
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+            return {'type': 'http.disconnect'}
+        return receive
+
+    @staticmethod
+    async def _send(send, status: int, payload, headers=()):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'application/json'),
+                                (b'content-length', str(len(body)).encode('ascii')), *headers]})
+        await send({'type': 'http.response.body', 'body': body})
+
+
+application = Application()
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(application, host=os.getenv('HOST', '0.0.0.0'), port=int(os.getenv('PORT', '7860')))
@@ -0,0 +1 @@
+"""Benchmark offline cho inference và serving path"""
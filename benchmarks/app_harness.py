@@ -0,0 +1,37 @@
+"""Import app.py trong thư mục tạm với engine giả lập (không tải model, DB riêng)"""
+
+import os
+import sys
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_app(engine, workdir=None):
+    """Trả về module app đã import, dùng SQLite trong workdir và engine được truyền vào"""
+    workdir = workdir or tempfile.mkdtemp(prefix='feedback_bench_')
+    os.chdir(workdir)
+    os.environ['LOAD_MODEL'] = 'False'
+    os.environ.pop('HF_TOKEN', None)
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+
+    import app as app_module
+    app_module.engine = engine
+    app_module.app.config['WTF_CSRF_ENABLED'] = False
+    return app_module
+
+
+def create_user(app_module, username, password='benchmark', is_admin=False):
+    with app_module.app.app_context():
+        user = app_module.User.query.filter_by(username=username).first()
+        if user is None:
+            user = app_module.User(username=username, is_admin=is_admin)
+            user.set_password(password)
+            app_module.db.session.add(user)
+            app_module.db.session.commit()
+        return user.id
+
+
+def login(client, username, password='benchmark'):
+    return client.post('/login', data={'username': username, 'password': password})
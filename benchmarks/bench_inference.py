@@ -0,0 +1,222 @@
+"""Benchmark inference offline: latency analyze_feedback, rows/s /analyze-csv, chi phí từng stage
+
+Dùng model PhoBERT-shaped khởi tạo ngẫu nhiên (benchmarks/tiny_model.py) nên chạy
+được không cần mạng. Kết quả ghi ra JSON để so sánh giữa các lần chạy:
+
+    python -m benchmarks.bench_inference --size base --output before.json
+    python -m benchmarks.bench_inference --size base --output after.json --compare before.json
+"""
+
+import io
+import os
+import csv
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+from datetime import datetime
+
+import torch
+
+from benchmarks.tiny_model import build_engine, sample_feedback
+from model_config import (
+    ASPECTS_EN, ASPECT_REVERSE_MAPPING, _aspect_has_kw, _norm_match, _is_garbage, get_prompt
+)
+
+
+def percentiles(samples, qs=(50, 90, 95, 99)) -> dict:
+    """Tóm tắt list thời gian (giây) thành mean/percentile theo mili giây"""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    out = {'count': len(ordered), 'mean_ms': sum(ordered) / len(ordered) * 1000}
+    for q in qs:
+        idx = min(len(ordered) - 1, int(round(q / 100.0 * (len(ordered) - 1))))
+        out[f'p{q}_ms'] = ordered[idx] * 1000
+    out['max_ms'] = ordered[-1] * 1000
+    return out
+
+
+def bench_analyze(engine, texts, warmup=5) -> dict:
+    for text in texts[:warmup]:
+        engine.analyze(text)
+    latencies = []
+    for text in texts:
+        start = time.perf_counter()
+        engine.analyze(text)
+        latencies.append(time.perf_counter() - start)
+    return percentiles(latencies)
+
+
+def bench_stages(engine, texts) -> dict:
+    """Tách thời gian tokenization / forward / hậu xử lý cho từng feedback"""
+    tokenize, forward, post = [], [], []
+    for text in texts:
+        text = str(text).strip()
+        if _is_garbage(text):
+            continue
+        t0 = time.perf_counter()
+        features, has_keywords = engine.encode([text])
+        t1 = time.perf_counter()
+        probs = engine.forward(features)
+        t2 = time.perf_counter()
+        engine.decide(probs, has_keywords)
+        t3 = time.perf_counter()
+        tokenize.append(t1 - t0)
+        forward.append(t2 - t1)
+        post.append(t3 - t2)
+
+    total = sum(tokenize) + sum(forward) + sum(post)
+    return {
+        'tokenization': percentiles(tokenize),
+        'forward': percentiles(forward),
+        'post_processing': percentiles(post),
+        'share': {
+            'tokenization': sum(tokenize) / total if total else None,
+            'forward': sum(forward) / total if total else None,
+            'post_processing': sum(post) / total if total else None,
+        },
+    }
+
+
+def bench_keywords(texts, repeat=3) -> dict:
+    """Chi phí match keyword trong model_config (_norm_match, _aspect_has_kw, chọn subprompt)"""
+    norm, has_kw, prompt = [], [], []
+    for _ in range(repeat):
+        for text in texts:
+            t0 = time.perf_counter()
+            s_norm = _norm_match(text)
+            t1 = time.perf_counter()
+            for aspect_en in ASPECTS_EN:
+                _aspect_has_kw(ASPECT_REVERSE_MAPPING[aspect_en], s_norm)
+            t2 = time.perf_counter()
+            for aspect_en in ASPECTS_EN:
+                get_prompt(aspect_en, sentence=text, use_subprompt=True)
+            t3 = time.perf_counter()
+            norm.append(t1 - t0)
+            has_kw.append(t2 - t1)
+            prompt.append(t3 - t2)
+    return {
+        'norm_match': percentiles(norm),
+        'aspect_has_kw_x4': percentiles(has_kw),
+        'get_prompt_x4': percentiles(prompt),
+    }
+
+
+def bench_csv(engine, texts, repeat=1) -> dict:
+    """Đo rows/s của route /analyze-csv (parse CSV + inference + ghi DB) qua Flask test client"""
+    from benchmarks.app_harness import load_app, create_user, login
+
+    app_module = load_app(engine)
+    create_user(app_module, 'bench_csv')
+    client = app_module.app.test_client()
+    login(client, 'bench_csv')
+
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(['id', 'feedback'])
+    for i, text in enumerate(texts, start=1):
+        writer.writerow([i, text])
+    payload = buf.getvalue().encode('utf-8')
+
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        resp = client.post('/analyze-csv', data={'csvFile': (io.BytesIO(payload), 'bench.csv')},
+                           content_type='multipart/form-data')
+        durations.append(time.perf_counter() - start)
+        if resp.status_code != 200:
+            raise RuntimeError(f"/analyze-csv trả về {resp.status_code}: {resp.get_data(as_text=True)[:200]}")
+
+    best = min(durations)
+    return {'rows': len(texts), 'runs': repeat, 'best_s': best, 'rows_per_s': len(texts) / best}
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def compare(current: dict, baseline: dict):
+    """In chênh lệch các chỉ số chính so với một file JSON trước đó"""
+    rows = [
+        ('analyze p50 (ms)', ('analyze', 'p50_ms')),
+        ('analyze p95 (ms)', ('analyze', 'p95_ms')),
+        ('analyze p99 (ms)', ('analyze', 'p99_ms')),
+        ('tokenization mean (ms)', ('stages', 'tokenization', 'mean_ms')),
+        ('forward mean (ms)', ('stages', 'forward', 'mean_ms')),
+        ('post-processing mean (ms)', ('stages', 'post_processing', 'mean_ms')),
+        ('keyword x4 mean (ms)', ('keywords', 'aspect_has_kw_x4', 'mean_ms')),
+        ('csv rows/s', ('csv', 'rows_per_s')),
+    ]
+    print(f"\n{'metric':<28}{'baseline':>12}{'current':>12}{'delta':>10}")
+    for label, path in rows:
+        old, new = baseline, current
+        for key in path:
+            old = (old or {}).get(key)
+            new = (new or {}).get(key)
+        if old is None or new is None:
+            continue
+        delta = (new - old) / old * 100 if old else 0.0
+        print(f"{label:<28}{old:>12.3f}{new:>12.3f}{delta:>9.1f}%")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark inference offline")
+    parser.add_argument('--size', default='tiny', choices=['tiny', 'small', 'base'])
+    parser.add_argument('--n', type=int, default=200, help="Số feedback cho benchmark latency")
+    parser.add_argument('--csv-rows', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=None, help="torch.set_num_threads")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--skip-csv', action='store_true')
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--compare', default=None, help="File JSON của lần chạy trước")
+    args = parser.parse_args(argv)
+    # bench_csv chuyển cwd sang thư mục tạm, giữ đường dẫn tuyệt đối cho output
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = os.path.abspath(args.compare) if args.compare else None
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    engine = build_engine(args.size, seed=args.seed)
+    texts = sample_feedback(args.n, seed=args.seed)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'git_revision': _git_revision(),
+            'size': args.size,
+            'n': args.n,
+            'seed': args.seed,
+            'torch_version': torch.__version__,
+            'torch_threads': torch.get_num_threads(),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+    }
+    report['analyze'] = bench_analyze(engine, texts)
+    report['stages'] = bench_stages(engine, texts)
+    report['keywords'] = bench_keywords(texts)
+    if not args.skip_csv:
+        report['csv'] = bench_csv(engine, sample_feedback(args.csv_rows, seed=args.seed + 1))
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    if baseline:
+        with open(baseline, 'r', encoding='utf-8') as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
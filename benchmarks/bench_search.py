@@ -0,0 +1,108 @@
+"""Đo thời gian /api/search: FTS5 (search_index.search) so với LIKE trên N feedback giả lập
+
+Tạo DB SQLite tạm với N dòng feedbacks của --users sinh viên (text sinh từ
+tiny_model.sample_feedback + mã môn/phòng ngẫu nhiên để có cả từ hiếm), rồi đo
+p50/p95 của từng query ở hai phạm vi: admin (toàn bộ feedback) và sinh viên
+(lọc user_id, phạm vi của đa số request /api/search).
+
+    python -m benchmarks.bench_search --rows 300000
+"""
+
+import os
+import sys
+import time
+import random
+import tempfile
+import argparse
+import statistics
+from datetime import datetime, timedelta
+
+from models import db, Feedback, User
+from redecide import create_app
+import search_index
+from benchmarks.tiny_model import sample_feedback
+
+QUERIES = [
+    ("giang vien", {}),
+    ("Giảng viên nhiệt tình", {}),
+    ("wifi", {'topic': 'facility'}),
+    ("phong hoc", {'sentiment': 'negative'}),
+    ("IT12", {}),
+    ("de thi kho", {'topic': 'training_program', 'sentiment': 'negative'}),
+]
+
+
+def populate(rows: int, users: int = 300, seed: int = 0, chunk: int = 20000):
+    rng = random.Random(seed)
+    template = User(username='bench')
+    template.set_password('benchmark')
+    # Một hash bcrypt dùng chung: không tốn vài giây cho mỗi user giả lập
+    db.session.execute(db.insert(User), [{'username': f'bench{i}', 'password_hash': template.password_hash}
+                                         for i in range(max(1, users))])
+    db.session.commit()
+    user_ids = [row[0] for row in db.session.query(User.id).all()]
+
+    base_texts = sample_feedback(5000, seed=seed)
+    start = datetime.utcnow() - timedelta(days=365)
+    topics = ['lecturer', 'training_program', 'facility', 'others']
+    sentiments = ['positive', 'neutral', 'negative']
+    for offset in range(0, rows, chunk):
+        batch = []
+        for i in range(offset, min(rows, offset + chunk)):
+            text = f"{rng.choice(base_texts)} (môn IT{rng.randint(1, 400)}, phòng B{rng.randint(100, 999)})"
+            batch.append({
+                'text': text, 'topic': rng.choice(topics), 'sentiment': rng.choice(sentiments),
+                'sentiment_confidence': rng.random(), 'topic_confidence': rng.random(),
+                'user_id': rng.choice(user_ids), 'created_at': start + timedelta(minutes=i),
+            })
+        db.session.execute(db.insert(Feedback), batch)
+        db.session.commit()
+    return user_ids
+
+
+def _time(fn, repeat):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(0.95 * (len(samples) - 1))], result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark full-text search (FTS5 vs LIKE)")
+    parser.add_argument('--rows', type=int, default=300000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--users', type=int, default=300, help="Số sinh viên chia nhau các feedback")
+    parser.add_argument('--workdir', default=None)
+    args = parser.parse_args(argv)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='feedback_search_')
+    os.makedirs(workdir, exist_ok=True)
+    app = create_app(os.path.join(workdir, 'search_bench.db'))
+    with app.app_context():
+        t0 = time.perf_counter()
+        user_ids = populate(args.rows, args.users)
+        print(f"Ghi {args.rows} dòng của {len(user_ids)} user (kèm index FTS5 qua trigger): "
+              f"{time.perf_counter() - t0:.1f}s")
+
+        student = user_ids[len(user_ids) // 2]
+        print(f"{'query':<24}{'filter':<58}{'phạm vi':<10}{'kết quả':>9}{'fts p50':>10}{'fts p95':>10}{'like p50':>10}")
+        for query, filters in QUERIES:
+            for scope, user_id in (('admin', None), ('user', student)):
+                filters_scoped = dict(filters, user_id=user_id)
+                fts_p50, fts_p95, (_, total) = _time(lambda: search_index.search(query, **filters_scoped),
+                                                     args.repeat)
+                tokens = search_index.re.findall(r"\w+", search_index._norm_search(query))
+                clauses, params = search_index._filters(**filters_scoped)
+                like_p50, _, _ = _time(lambda: search_index._search_like(tokens, clauses, params, 20, 0),
+                                       max(1, args.repeat // 5))
+                print(f"{query:<24}{str(filters):<58}{scope:<10}{total:>9}"
+                      f"{fts_p50:>9.1f}ms{fts_p95:>8.1f}ms{like_p50:>8.1f}ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
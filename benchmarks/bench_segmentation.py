@@ -0,0 +1,64 @@
+"""So sánh chạy feedback dài nguyên khối với tách câu (segmentation.py)
+
+Ghép các feedback mẫu thành đoạn dài (--clauses mệnh đề/đoạn), rồi đo với cùng
+model giả lập: tổng số token đưa vào model, số cặp bị cắt ở MAX_LEN, số token
+trung bình mỗi sequence và thời gian analyze_many. Model giả lập nên chỉ số
+thời gian/token có ý nghĩa, nhãn thì không.
+
+    python -m benchmarks.bench_segmentation --docs 200 --clauses 12 --size small
+"""
+
+import sys
+import time
+import random
+import argparse
+
+import segmentation
+from model_config import MAX_LEN
+from benchmarks.tiny_model import build_engine, sample_feedback
+
+
+def make_paragraphs(docs: int, clauses: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    pool = sample_feedback(2000, seed=seed)
+    return [' '.join(rng.choice(pool).rstrip('.') + '.' for _ in range(clauses)) for _ in range(docs)]
+
+
+def measure(engine, texts: list, segment: bool) -> dict:
+    engine.segment = segment
+    pieces = segmentation.expand(texts)[0] if segment else texts
+    features, _ = engine.encode(pieces)
+    lengths = [len(ids) for ids in features['input_ids']]
+    start = time.perf_counter()
+    results = engine.analyze_many(texts)
+    elapsed = time.perf_counter() - start
+    return {
+        'sequences': len(lengths),
+        'tokens': sum(lengths),
+        'truncated': sum(1 for n in lengths if n >= MAX_LEN),
+        'avg_len': sum(lengths) / max(1, len(lengths)),
+        'seconds': elapsed,
+        'aspects': sum(len(r) for r in results),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark tách câu cho feedback dài")
+    parser.add_argument('--docs', type=int, default=200)
+    parser.add_argument('--clauses', type=int, default=12)
+    parser.add_argument('--size', default='small', choices=['tiny', 'small', 'base'])
+    args = parser.parse_args(argv)
+
+    engine = build_engine(args.size)
+    texts = make_paragraphs(args.docs, args.clauses)
+    print(f"{args.docs} đoạn, trung bình {sum(len(t.split()) for t in texts) / len(texts):.0f} từ")
+    print(f"{'chế độ':<12}{'sequence':>10}{'token':>10}{'bị cắt':>9}{'tb token':>10}{'thời gian':>11}{'aspect':>8}")
+    for label, segment in (('nguyên khối', False), ('tách câu', True)):
+        r = measure(engine, texts, segment)
+        print(f"{label:<12}{r['sequences']:>10}{r['tokens']:>10}{r['truncated']:>9}{r['avg_len']:>10.1f}"
+              f"{r['seconds']:>10.2f}s{r['aspects']:>8}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+"""Sweep số worker x số thread để chọn cấu hình TORCH_NUM_THREADS / số worker
+
+Mỗi cấu hình fork `workers` process, mỗi process đặt `threads` intra-op thread
+(qua runtime_config) rồi chạy analyze liên tục trong `--duration` giây, giống
+cảnh nhiều gunicorn worker cùng nhận /predict. In bảng throughput/latency và
+cấu hình đề xuất; ghi JSON nếu có --output.
+
+    python -m benchmarks.bench_threads --size base --duration 20 --output sweep.json
+"""
+
+import os
+import json
+import time
+import argparse
+import multiprocessing as mp
+
+import torch
+
+from benchmarks.tiny_model import build_engine, sample_feedback
+from runtime_config import configure_torch_threads
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(q / 100.0 * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+def _worker(engine, texts, slot, threads, affinity, duration, barrier, out_queue):
+    configure_torch_threads(worker_index=slot, label=f"bench-{slot}", config={
+        'num_threads': threads, 'num_interop_threads': 1, 'cpu_affinity': affinity,
+    })
+    for text in texts[:3]:
+        engine.analyze(text)
+
+    barrier.wait()
+    latencies = []
+    deadline = time.perf_counter() + duration
+    i = slot
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        engine.analyze(texts[i % len(texts)])
+        latencies.append(time.perf_counter() - start)
+        i += 1
+    out_queue.put(latencies)
+
+
+def run_config(engine, texts, workers, threads, duration, affinity=None) -> dict:
+    ctx = mp.get_context('fork')
+    barrier = ctx.Barrier(workers)
+    out_queue = ctx.Queue()
+    procs = [ctx.Process(target=_worker, args=(engine, texts, slot, threads, affinity,
+                                               duration, barrier, out_queue))
+             for slot in range(workers)]
+    for proc in procs:
+        proc.start()
+    latencies = []
+    for _ in procs:
+        latencies.extend(out_queue.get())
+    for proc in procs:
+        proc.join()
+
+    return {
+        'workers': workers,
+        'threads': threads,
+        'affinity': affinity,
+        'requests': len(latencies),
+        'throughput_rps': len(latencies) / duration,
+        'p50_ms': _percentile(latencies, 50) * 1000 if latencies else None,
+        'p95_ms': _percentile(latencies, 95) * 1000 if latencies else None,
+        'p99_ms': _percentile(latencies, 99) * 1000 if latencies else None,
+    }
+
+
+def recommend(results: list, latency_slack: float = 1.5) -> dict:
+    """Throughput cao nhất trong các cấu hình có p95 <= latency_slack x p95 tốt nhất"""
+    valid = [r for r in results if r['p95_ms'] is not None]
+    if not valid:
+        return {}
+    best_p95 = min(r['p95_ms'] for r in valid)
+    candidates = [r for r in valid if r['p95_ms'] <= best_p95 * latency_slack] or valid
+    return max(candidates, key=lambda r: r['throughput_rps'])
+
+
+def main(argv=None):
+    cores = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="Sweep worker x thread cho inference")
+    parser.add_argument('--size', default='tiny', choices=['tiny', 'small', 'base'])
+    parser.add_argument('--workers', default=None, help="Danh sách số worker, vd 1,2,4,8")
+    parser.add_argument('--threads', default=None, help="Danh sách số thread, vd 1,2,4")
+    parser.add_argument('--max-total', type=int, default=2 * cores,
+                        help="Bỏ qua cấu hình có workers x threads vượt ngưỡng này")
+    parser.add_argument('--affinity', default=None, help='"auto" để pin mỗi worker vào khối CPU riêng')
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args(argv)
+
+    default_grid = sorted({1, 2, 4, 8, cores})
+    workers_grid = [int(x) for x in args.workers.split(',')] if args.workers else default_grid
+    threads_grid = [int(x) for x in args.threads.split(',')] if args.threads else default_grid
+
+    # Process cha không được khởi tạo OpenMP pool trước khi fork
+    torch.set_num_threads(1)
+    engine = build_engine(args.size)
+    texts = sample_feedback(256, seed=7)
+
+    results = []
+    for workers in workers_grid:
+        for threads in threads_grid:
+            if workers * threads > args.max_total:
+                continue
+            result = run_config(engine, texts, workers, threads, args.duration, args.affinity)
+            results.append(result)
+            print(f"workers={workers:<3} threads={threads:<3} "
+                  f"{result['throughput_rps']:8.1f} req/s  "
+                  f"p50={result['p50_ms']:7.1f}ms  p95={result['p95_ms']:7.1f}ms", flush=True)
+
+    best = recommend(results)
+    if best:
+        print(f"\nĐề xuất: {best['workers']} worker x TORCH_NUM_THREADS={best['threads']} "
+              f"({best['throughput_rps']:.1f} req/s, p95={best['p95_ms']:.1f}ms) trên {cores} core")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'cpu_count': cores, 'size': args.size, 'duration': args.duration,
+                       'torch_version': torch.__version__, 'results': results,
+                       'recommended': best}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Kiểm tra /predict qua ASGI nhận model mới sau khi worker khác đổi version
+
+Giả lập một worker khác đăng ký + kích hoạt version mới (model_registry.set_active
+ghi ACTIVE và mark('model_swap')), rồi chỉ gửi request tới fast path /predict của
+asgi.py: worker này phải tự load version mới trong nền và các dòng feedback sau đó
+phải mang model_version mới. Thoát với mã 1 nếu engine không đổi hoặc version
+trên dòng mới vẫn là version cũ.
+
+    python -m benchmarks.check_asgi_model_swap
+"""
+
+import io
+import sys
+import time
+import asyncio
+import argparse
+
+from benchmarks.app_harness import load_app, create_user, login
+from benchmarks import tiny_model
+
+NEW_VERSION = 'asgi-swap-check'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--wait', type=float, default=30, help="Số giây tối đa chờ worker load version mới")
+    args = parser.parse_args(argv)
+
+    app_module = load_app(tiny_model.build_engine('tiny', seed=0))
+    create_user(app_module, 'asgi_user')
+    client = app_module.app.test_client()
+    login(client, 'asgi_user')
+    cookie = client.get_cookie('session').value
+
+    import httpx
+    import asgi
+    import model_registry
+
+    # Checkpoint thật cần kiến trúc PhoBERT base: load_engine trả về model tiny khác seed
+    candidate = tiny_model.build_engine('tiny', seed=1)
+    candidate.model_version = NEW_VERSION
+    model_registry.load_engine = lambda version, tokenizer=None, device=None: candidate
+    model_registry.register(io.BytesIO(b'tiny'), version=NEW_VERSION)
+    time.sleep(0.05)  # mtime của stamp model_swap phải mới hơn lúc ModelManager khởi tạo
+    model_registry.set_active(NEW_VERSION)  # "worker khác" promote
+
+    async def predict(http, text):
+        response = await http.post('/predict', json={'text': text})
+        return response.status_code
+
+    async def run():
+        transport = httpx.ASGITransport(app=asgi.application)
+        async with httpx.AsyncClient(transport=transport, base_url='http://asgi',
+                                     cookies={'session': cookie}) as http:
+            statuses = [await predict(http, 'Giảng viên giảng bài rất dễ hiểu')]
+            deadline = time.monotonic() + args.wait
+            while app_module.engine is not candidate and time.monotonic() < deadline:
+                await asyncio.sleep(0.1)
+            statuses.append(await predict(http, 'Phòng học nóng và không có điều hòa'))
+            return statuses
+
+    statuses = asyncio.run(run())
+    with app_module.app.app_context():
+        last = app_module.Feedback.query.order_by(app_module.Feedback.id.desc()).first()
+        last_version = last.model_version if last else None
+
+    swapped = app_module.engine is candidate
+    print(f"{'status /predict':<24}{statuses}")
+    print(f"{'trạng thái swap':<24}{app_module.model_manager.status['state']}")
+    print(f"{'engine đã đổi':<24}{swapped}")
+    print(f"{'version dòng mới nhất':<24}{last_version}  (kỳ vọng {NEW_VERSION})")
+    failed = statuses != [200, 200] or not swapped or last_version != NEW_VERSION
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+"""Kiểm tra /analyze-csv chỉ chạy model một lần cho mỗi khoá chuẩn hoá và đếm đúng feedback_near_dup_collapsed_total
+
+Upload CSV gồm các biến thể (hoa/thường, dấu câu) và bản lặp y nguyên của vài
+feedback với model tiny, rồi so sánh: số text đưa vào model = số khoá chuẩn hoá,
+counter tăng đúng bằng số text khác nhau trừ số khoá (bản lặp y nguyên không
+tính). Thoát với mã 1 nếu sai.
+
+    python -m benchmarks.check_csv_near_dup
+"""
+
+import io
+import csv
+import sys
+import argparse
+
+from benchmarks.app_harness import load_app, create_user, login
+from benchmarks import tiny_model
+
+
+def variants(text: str) -> list:
+    return [text, text.upper(), text + '!!', text + '.', text]
+
+
+def collapsed_total(metrics) -> float:
+    return sum(value for _, value in metrics.NEAR_DUP_COLLAPSED.snapshot())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--texts', type=int, default=40, help="Số feedback gốc (mỗi feedback có 4 biến thể + 1 bản lặp)")
+    args = parser.parse_args(argv)
+
+    engine = tiny_model.build_engine('tiny')
+    app_module = load_app(engine)
+    create_user(app_module, 'csv_user')
+    client = app_module.app.test_client()
+    login(client, 'csv_user')
+    client.get('/')
+
+    import near_dup
+    base = list(dict.fromkeys(tiny_model.sample_feedback(args.texts, seed=5)))
+    rows = [text for original in base for text in variants(original)]
+    expected_keys = len({near_dup.analysis_key(text) for text in rows})
+    expected_collapsed = len(set(rows)) - expected_keys
+
+    analyzed = []
+    analyze_many = engine.analyze_many
+
+    def counting_analyze_many(texts, *a, **kw):
+        analyzed.extend(texts)
+        return analyze_many(texts, *a, **kw)
+
+    engine.analyze_many = counting_analyze_many
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(['feedback'])
+    writer.writerows([text] for text in rows)
+
+    before = collapsed_total(app_module.metrics)
+    response = client.post('/analyze-csv', data={'csvFile': (io.BytesIO(buffer.getvalue().encode()), 'dup.csv')},
+                           content_type='multipart/form-data')
+    collapsed = collapsed_total(app_module.metrics) - before
+    data = response.get_json()
+
+    print(f"{'dòng':<28}{len(rows):>8}")
+    print(f"{'text khác nhau':<28}{len(set(rows)):>8}")
+    print(f"{'khoá chuẩn hoá':<28}{expected_keys:>8}")
+    print(f"{'text đưa vào model':<28}{len(analyzed):>8}")
+    print(f"{'near_dup_collapsed':<28}{collapsed:>8.0f}  (kỳ vọng {expected_collapsed})")
+
+    failed = (response.status_code != 200 or data.get('processed_count') != len(rows)
+              or len(analyzed) != expected_keys or collapsed != expected_collapsed)
+    if failed:
+        print(f"SAI: status {response.status_code}, processed {data.get('processed_count')}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
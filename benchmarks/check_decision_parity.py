@@ -0,0 +1,89 @@
+"""Kiểm tra decide_batch (vector hoá) cho kết quả giống hệt decide_reference (từng phần tử)
+
+Sinh ngẫu nhiên ma trận xác suất 4x4, có cả các giá trị nằm sát các ngưỡng
+(PRED_THRESHOLD, 0.85, 0.95, MIN_SENT_PROB, MIN_MARGIN) và tổ hợp keyword, rồi so
+sánh topic/sentiment/confidence/margin. Thoát với mã 1 nếu có khác biệt.
+
+    python -m benchmarks.check_decision_parity --n 20000
+"""
+
+import sys
+import time
+import argparse
+
+import torch
+
+from decision import decide_batch, decision_to_results, decide_reference
+from model_config import PRED_THRESHOLD, MIN_SENT_PROB, MIN_MARGIN
+
+
+def _edge_probs(n, generator):
+    """Xác suất có p_none nằm sát các ngưỡng và sentiment sát MIN_SENT_PROB / MIN_MARGIN"""
+    edges = torch.tensor([1 - PRED_THRESHOLD, 0.15, 0.05, 1 - (PRED_THRESHOLD + 0.05), 0.0, 1.0])
+    p_none = edges[torch.randint(len(edges), (n, 4), generator=generator)]
+    p_none = (p_none + (torch.rand(n, 4, generator=generator) - 0.5) * 0.04).clamp(0, 1)
+
+    top = MIN_SENT_PROB + (torch.rand(n, 4, generator=generator) - 0.5) * 0.1
+    second = top - MIN_MARGIN + (torch.rand(n, 4, generator=generator) - 0.5) * 0.06
+    third = (1 - top - second).clamp(min=0)
+    sent = torch.stack([top, second, third], dim=-1).clamp(min=0)
+    perm = torch.argsort(torch.rand(n, 4, 3, generator=generator), dim=-1)
+    sent = torch.gather(sent, -1, perm)
+    sent = sent / sent.sum(-1, keepdim=True).clamp(min=1e-8) * (1 - p_none).unsqueeze(-1)
+    return torch.cat([p_none.unsqueeze(-1), sent], dim=-1).float()
+
+
+def make_cases(n, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    half = n // 2
+    logits = torch.randn(n - half, 4, 4, generator=generator) * 3
+    random_probs = torch.softmax(logits, dim=-1)
+    probs = torch.cat([random_probs, _edge_probs(half, generator)], dim=0)
+    has_kw = torch.rand(n, 4, generator=generator) < 0.5
+    return probs, has_kw
+
+
+def _same(a, b, tol=1e-9):
+    if len(a) != len(b):
+        return False
+    for x, y in zip(a, b):
+        if x['topic'] != y['topic'] or x['sentiment'] != y['sentiment']:
+            return False
+        for key in ('confidence', 'sentiment_confidence', 'margin'):
+            if abs(x[key] - y[key]) > tol:
+                return False
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parity decide_batch vs decide_reference")
+    parser.add_argument('--n', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    probs, has_kw = make_cases(args.n, args.seed)
+
+    t0 = time.perf_counter()
+    reference = [decide_reference(probs[i], has_kw[i].tolist()) for i in range(args.n)]
+    t1 = time.perf_counter()
+    batched = decision_to_results(decide_batch(probs, has_kw))
+    t2 = time.perf_counter()
+
+    mismatches = [i for i in range(args.n) if not _same(reference[i], batched[i])]
+    kept = sum(len(r) for r in reference)
+    print(f"{args.n} feedback, {kept} aspect được giữ | reference {t1 - t0:.3f}s, "
+          f"vectorized {t2 - t1:.3f}s ({(t1 - t0) / max(t2 - t1, 1e-9):.0f}x)")
+    if mismatches:
+        i = mismatches[0]
+        print(f"KHÁC BIỆT ở {len(mismatches)} feedback, ví dụ #{i}:")
+        print("  probs     ", probs[i].tolist())
+        print("  has_kw    ", has_kw[i].tolist())
+        print("  reference ", reference[i])
+        print("  vectorized", batched[i])
+        return 1
+    print("Parity OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+"""Kiểm tra PhobertTokenizerFast cho input_ids giống hệt tokenizer slow của PhoBERT
+
+So sánh trên tokenizer_parity_corpus.txt (+ biến thể NFD, viết hoa) với mọi prompt
+aspect, thêm các feedback sinh ngẫu nhiên, rồi đo thời gian tokenize cùng một
+batch (prompt, feedback) bằng hai tokenizer. Thoát với mã 1 nếu có khác biệt.
+
+    python -m benchmarks.check_tokenizer_parity --repo Ptul2x5/Student_Feedback_Sentiment
+    python -m benchmarks.check_tokenizer_parity --vocab vocab.txt --merges bpe.codes
+"""
+
+import sys
+import time
+import argparse
+
+from fast_tokenizer import build_fast_tokenizer, load_parity_corpus, check_parity
+from inference import MODEL_REPO
+from model_config import ASPECT_PROMPTS, MAX_LEN
+from benchmarks.tiny_model import sample_feedback
+
+
+def _load_slow(args):
+    if args.vocab and args.merges:
+        from transformers import PhobertTokenizer
+        return PhobertTokenizer(args.vocab, args.merges)
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(args.repo, use_fast=False)
+
+
+def _time(tokenizer, prompts, texts, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        tokenizer(prompts, texts, truncation="only_second", max_length=MAX_LEN)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parity + tốc độ PhobertTokenizerFast vs PhobertTokenizer")
+    parser.add_argument('--repo', default=MODEL_REPO)
+    parser.add_argument('--vocab', help="vocab.txt của PhoBERT (dùng thay cho --repo)")
+    parser.add_argument('--merges', help="bpe.codes của PhoBERT (dùng thay cho --repo)")
+    parser.add_argument('--samples', type=int, default=500, help="Số feedback ngẫu nhiên thêm vào corpus")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    slow = _load_slow(args)
+    fast = build_fast_tokenizer(slow)
+    prompts = [p for sub in ASPECT_PROMPTS.values() for p in sub.values()]
+
+    texts = load_parity_corpus() + sample_feedback(args.samples, seed=0)
+    mismatches = check_parity(slow, fast, texts, prompts, MAX_LEN)
+    print(f"{len(texts)} feedback x {len(prompts)} prompt: {len(mismatches)} cặp khác biệt")
+
+    batch = sample_feedback(256, seed=1)
+    pair_prompts = [prompts[i % len(prompts)] for i in range(len(batch) * 4)]
+    pair_texts = [text for text in batch for _ in range(4)]
+    slow_s = _time(slow, pair_prompts, pair_texts, args.repeat)
+    fast_s = _time(fast, pair_prompts, pair_texts, args.repeat)
+    print(f"{len(pair_texts)} cặp: slow {slow_s:.3f}s, fast {fast_s:.3f}s ({slow_s / max(fast_s, 1e-9):.1f}x)")
+
+    if mismatches:
+        prompt, text = mismatches[0]
+        pair = (prompt, text) if prompt is not None else (text,)
+        print("Ví dụ khác biệt:", repr(text))
+        print("  slow", slow.convert_ids_to_tokens(slow(*pair)["input_ids"]))
+        print("  fast", fast.convert_ids_to_tokens(fast(*pair)["input_ids"]))
+        return 1
+    print("Parity OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
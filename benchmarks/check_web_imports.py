@@ -0,0 +1,68 @@
+"""Kiểm tra web tier khởi động không kéo theo torch/transformers
+
+Import app.py trong process con (thư mục tạm, DB mới) ở từng chế độ engine và
+in thời gian import + các module nặng đã bị import. Chế độ INFERENCE_SOCKET và
+LOAD_MODEL=False không được import module nặng nào (thoát với mã 1 nếu có); chế
+độ load model trong process chỉ đo thời gian tới lúc app sẵn sàng phục vụ trang
+(model tiếp tục load trong thread nền).
+
+    python -m benchmarks.check_web_imports
+"""
+
+import os
+import sys
+import json
+import tempfile
+import subprocess
+
+from benchmarks.app_harness import REPO_ROOT
+
+HEAVY_MODULES = ('torch', 'transformers', 'tokenizers', 'numpy', 'pyarrow', 'huggingface_hub')
+
+_PROBE = """
+import sys, time, json
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+import app
+elapsed = time.perf_counter() - start
+heavy = [m for m in {heavy!r} if m in sys.modules]
+print(json.dumps({{'seconds': elapsed, 'heavy': heavy}}))
+sys.stdout.flush()
+import os
+os._exit(0)
+"""
+
+MODES = {
+    'inference-service': {'INFERENCE_SOCKET': 'instance/inference.sock', 'LOAD_MODEL': 'True'},
+    'no-model': {'LOAD_MODEL': 'False'},
+    'in-process': {'LOAD_MODEL': 'True'},
+}
+
+
+def probe(env_overrides: dict) -> dict:
+    env = {k: v for k, v in os.environ.items() if k not in ('INFERENCE_SOCKET', 'HF_TOKEN')}
+    env.update(env_overrides)
+    code = _PROBE.format(root=REPO_ROOT, heavy=HEAVY_MODULES)
+    with tempfile.TemporaryDirectory(prefix='feedback_imports_') as workdir:
+        out = subprocess.run([sys.executable, '-c', code], cwd=workdir, env=env, capture_output=True, text=True,
+                             timeout=300)
+    lines = [line for line in out.stdout.splitlines() if line.startswith('{')]
+    if not lines:
+        raise RuntimeError(out.stderr[-2000:])
+    return json.loads(lines[-1])
+
+
+def main(argv=None):
+    failed = False
+    print(f"{'chế độ':<20}{'import app':>12}  module nặng")
+    for mode, env in MODES.items():
+        result = probe(env)
+        print(f"{mode:<20}{result['seconds']:>11.2f}s  {', '.join(result['heavy']) or '-'}")
+        # in-process: thread load model có thể đã kịp import torch, chỉ đo thời gian
+        if mode != 'in-process' and result['heavy']:
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
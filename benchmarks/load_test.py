@@ -0,0 +1,319 @@
+"""Load test offline: giả lập nhiều sinh viên dùng web app cùng lúc (tuần đánh giá)
+
+Chạy app trong process con (thư mục tạm, SQLite mới, model tiny_model thay cho
+PhoBERT), tạo sẵn --students tài khoản rồi mở --concurrency sinh viên ảo, mỗi
+sinh viên đăng nhập một lần và lặp lại các thao tác theo tỉ lệ --mix:
+
+  predict    POST /predict một câu feedback
+  history    GET /api/feedback-history (trang/bộ lọc ngẫu nhiên, gửi If-None-Match như trình duyệt)
+  stats      GET /my-statistics
+  csv        POST /analyze-csv một file --csv-rows dòng
+
+Kết quả theo từng route: số request, throughput, p50/p95/p99, tỉ lệ lỗi (status
+>= 400, lỗi kết nối), số request bị admission control từ chối (429/503) và số
+lỗi "database is locked" của SQLite.
+
+    python -m benchmarks.load_test --concurrency 32 --duration 30
+    python -m benchmarks.load_test --server asgi --mix predict=80,history=20 --output load.json
+    INFERENCE_CONCURRENCY=2 python -m benchmarks.load_test   # biến môi trường được chuyển cho server
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import socket
+import tempfile
+import argparse
+import threading
+import subprocess
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.cookiejar import CookieJar
+
+from benchmarks.app_harness import REPO_ROOT
+
+DEFAULT_MIX = 'predict=50,history=30,stats=15,csv=5'
+PASSWORD = 'loadtest'
+ROUTES = {
+    'login': '/login',
+    'predict': '/predict',
+    'history': '/api/feedback-history',
+    'stats': '/my-statistics',
+    'csv': '/analyze-csv',
+}
+
+
+# ===== Server (process con) =====
+
+def serve(args):
+    """Chạy app với model tiny trong process này cho tới khi bị dừng"""
+    import bcrypt
+    from benchmarks.app_harness import load_app
+    from benchmarks.tiny_model import build_engine
+
+    module = load_app(build_engine(args.size), workdir=args.workdir)
+    # Một lần hash cho mọi tài khoản (bcrypt ~0.2s/lần), đăng nhập vẫn phải check_password
+    password_hash = bcrypt.hashpw(PASSWORD.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    with module.app.app_context():
+        existing = {name for (name,) in module.db.session.query(module.User.username)}
+        rows = [{'username': f'student{i:04d}', 'password_hash': password_hash, 'is_admin': False}
+                for i in range(args.students) if f'student{i:04d}' not in existing]
+        if rows:
+            module.db.session.execute(module.db.insert(module.User), rows)
+            module.db.session.commit()
+
+    if args.server == 'asgi':
+        import uvicorn
+        import asgi
+        uvicorn.run(asgi.application, host='127.0.0.1', port=args.port, log_level='warning')
+    else:
+        from werkzeug.serving import make_server
+        make_server('127.0.0.1', args.port, module.app, threaded=True).serve_forever()
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(args, workdir: str):
+    port = _free_port()
+    log = open(os.path.join(workdir, 'server.log'), 'w')
+    cmd = [sys.executable, '-m', 'benchmarks.load_test', '--serve', str(port), '--workdir', workdir,
+           '--size', args.size, '--students', str(args.students), '--server', args.server]
+    process = subprocess.Popen(cmd, cwd=REPO_ROOT, stdout=log, stderr=subprocess.STDOUT)
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'Server dừng khi khởi động, xem {log.name}')
+        try:
+            with urllib.request.urlopen(f'{base_url}/api/health', timeout=2):
+                return process, base_url
+        except (urllib.error.URLError, ConnectionError, OSError):
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f'Server không sẵn sàng sau {args.startup_timeout}s, xem {log.name}')
+
+
+# ===== Sinh viên ảo =====
+
+class Stats:
+    def __init__(self):
+        """Kết quả request theo route (dùng chung giữa các thread)"""
+        self._lock = threading.Lock()
+        self.samples = {}
+
+    def record(self, route: str, seconds: float, status: int, locked: bool):
+        with self._lock:
+            self.samples.setdefault(route, []).append((seconds, status, locked))
+
+    def summary(self, elapsed: float) -> dict:
+        report = {}
+        with self._lock:
+            items = sorted(self.samples.items())
+        for route, samples in items:
+            latencies = sorted(s[0] * 1000 for s in samples)
+            statuses = [s[1] for s in samples]
+            report[route] = {
+                'requests': len(samples),
+                'throughput_rps': len(samples) / elapsed if elapsed else 0.0,
+                'p50_ms': _percentile(latencies, 0.50),
+                'p95_ms': _percentile(latencies, 0.95),
+                'p99_ms': _percentile(latencies, 0.99),
+                'max_ms': latencies[-1],
+                'error_rate': sum(1 for s in statuses if s == 0 or s >= 400) / len(samples),
+                'rejected': sum(1 for s in statuses if s in (429, 503)),
+                'locked': sum(1 for s in samples if s[2]),
+                'not_modified': sum(1 for s in statuses if s == 304),
+            }
+        return report
+
+
+def _percentile(sorted_values, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in ROUTES or name == 'login':
+            raise ValueError(f'Thao tác không hợp lệ trong --mix: {name}')
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def _multipart(field: str, filename: str, content: bytes):
+    boundary = uuid.uuid4().hex
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f'Content-Type: text/csv\r\n\r\n').encode('utf-8') + content + f'\r\n--{boundary}--\r\n'.encode('utf-8')
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+class Student:
+    def __init__(self, base_url: str, username: str, stats: Stats, texts: list, csv_body: bytes,
+                 rng: random.Random, timeout: float):
+        """Một sinh viên ảo với cookie session riêng"""
+        self.base_url = base_url
+        self.username = username
+        self.stats = stats
+        self.texts = texts
+        self.csv_body = csv_body
+        self.rng = rng
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+        self.etags = {}
+
+    def request(self, route: str, path: str, data: bytes = None, headers: dict = None):
+        req = urllib.request.Request(self.base_url + path, data=data, headers=headers or {})
+        start = time.perf_counter()
+        try:
+            with self.opener.open(req, timeout=self.timeout) as response:
+                status, body, response_headers = response.status, response.read(), response.headers
+        except urllib.error.HTTPError as e:
+            status, body, response_headers = e.code, e.read(), e.headers
+        except (urllib.error.URLError, OSError):
+            status, body, response_headers = 0, b'', {}
+        self.stats.record(route, time.perf_counter() - start, status, b'database is locked' in body)
+        return status, response_headers
+
+    def login(self):
+        data = urllib.parse.urlencode({'username': self.username, 'password': PASSWORD}).encode('utf-8')
+        self.request('login', ROUTES['login'], data,
+                     {'Content-Type': 'application/x-www-form-urlencoded'})
+        # Trang chủ sau redirect đã đọc flash message, các trang sau được cache/304 bình thường
+
+    def predict(self):
+        body = json.dumps({'text': self.rng.choice(self.texts)}).encode('utf-8')
+        self.request('predict', ROUTES['predict'], body, {'Content-Type': 'application/json'})
+
+    def history(self):
+        params = {'page': self.rng.choice([1, 1, 1, 2, 3]), 'per_page': 5,
+                  'time_filter': self.rng.choice(['all', 'all', 'today', 'week', 'month'])}
+        path = f"{ROUTES['history']}?{urllib.parse.urlencode(params)}"
+        self._conditional_get('history', path)
+
+    def stats_page(self):
+        self._conditional_get('stats', ROUTES['stats'])
+
+    def _conditional_get(self, route: str, path: str):
+        headers = {'If-None-Match': self.etags[path]} if path in self.etags else {}
+        status, response_headers = self.request(route, path, headers=headers)
+        etag = response_headers.get('ETag') if response_headers else None
+        if status == 200 and etag:
+            self.etags[path] = etag
+
+    def upload_csv(self):
+        body, content_type = _multipart('csvFile', 'hoc_ky.csv', self.csv_body)
+        self.request('csv', ROUTES['csv'], body, {'Content-Type': content_type})
+
+    def run(self, weights: dict, stop_at: float, think_ms: float):
+        actions = {'predict': self.predict, 'history': self.history, 'stats': self.stats_page,
+                   'csv': self.upload_csv}
+        names = list(weights)
+        weight_list = [weights[n] for n in names]
+        self.login()
+        while time.monotonic() < stop_at:
+            actions[self.rng.choices(names, weights=weight_list)[0]]()
+            if think_ms:
+                time.sleep(self.rng.expovariate(1000.0 / think_ms))
+
+
+def run_load(base_url: str, args) -> dict:
+    from benchmarks.tiny_model import sample_feedback
+
+    weights = parse_mix(args.mix)
+    texts = sample_feedback(500, seed=args.seed)
+    csv_texts = sample_feedback(args.csv_rows, seed=args.seed + 1)
+    out = io.StringIO()
+    out.write('feedback,mon_hoc\n')
+    for i, text in enumerate(csv_texts):
+        out.write('"{}",IT{}\n'.format(text.replace('"', '""'), i % 40))
+    csv_body = out.getvalue().encode('utf-8')
+
+    stats = Stats()
+    stop_at = time.monotonic() + args.duration
+    threads = []
+    started = time.perf_counter()
+    for i in range(args.concurrency):
+        student = Student(base_url, f'student{i % args.students:04d}', stats, texts, csv_body,
+                          random.Random(args.seed * 1000 + i), args.timeout)
+        thread = threading.Thread(target=student.run, args=(weights, stop_at, args.think_ms), daemon=True)
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return {'elapsed': elapsed, 'routes': stats.summary(elapsed)}
+
+
+def print_report(result: dict):
+    routes = result['routes']
+    print(f"{'route':<24}{'req':>7}{'req/s':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}"
+          f"{'lỗi %':>8}{'429/503':>9}{'locked':>8}{'304':>7}")
+    for route, r in routes.items():
+        print(f"{ROUTES[route]:<24}{r['requests']:>7}{r['throughput_rps']:>8.1f}"
+              f"{r['p50_ms']:>7.0f}ms{r['p95_ms']:>7.0f}ms{r['p99_ms']:>7.0f}ms{r['max_ms']:>7.0f}ms"
+              f"{r['error_rate'] * 100:>7.1f}%{r['rejected']:>9}{r['locked']:>8}{r['not_modified']:>7}")
+    total = sum(r['requests'] for r in routes.values())
+    print(f"\nTổng {total} request trong {result['elapsed']:.1f}s ({total / result['elapsed']:.1f} req/s)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test web app với model tiny và SQLite tạm")
+    parser.add_argument('--concurrency', type=int, default=16, help="Số sinh viên ảo chạy đồng thời")
+    parser.add_argument('--students', type=int, default=200, help="Số tài khoản tạo sẵn")
+    parser.add_argument('--duration', type=float, default=20.0)
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f"Tỉ lệ thao tác, mặc định {DEFAULT_MIX}")
+    parser.add_argument('--think-ms', type=float, default=0.0, help="Thời gian nghĩ trung bình giữa hai thao tác")
+    parser.add_argument('--csv-rows', type=int, default=200)
+    parser.add_argument('--server', default='wsgi', choices=['wsgi', 'asgi'])
+    parser.add_argument('--size', default='tiny', choices=['tiny', 'small', 'base'])
+    parser.add_argument('--timeout', type=float, default=60.0, help="Timeout mỗi request (giây)")
+    parser.add_argument('--startup-timeout', type=float, default=120.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workdir', default=None)
+    parser.add_argument('--output', default=None, help="Ghi kết quả JSON (so sánh giữa các lần chạy)")
+    parser.add_argument('--serve', type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.serve is not None:
+        args.port = args.serve
+        serve(args)
+        return 0
+
+    args.students = max(args.students, 1)
+    workdir = args.workdir or tempfile.mkdtemp(prefix='feedback_load_')
+    os.makedirs(workdir, exist_ok=True)
+    process, base_url = start_server(args, workdir)
+    try:
+        print(f"Server {args.server} ({args.size}) tại {base_url}, {args.concurrency} sinh viên ảo, "
+              f"{args.duration:.0f}s, mix {args.mix}", flush=True)
+        result = run_load(base_url, args)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+    print_report(result)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'server': args.server, 'size': args.size, 'concurrency': args.concurrency,
+                       'duration': args.duration, 'mix': args.mix, **result}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
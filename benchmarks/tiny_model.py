@@ -0,0 +1,98 @@
+"""Model PhoBERT-shaped khởi tạo ngẫu nhiên + tokenizer BPE nhỏ để benchmark offline
+
+Không cần mạng: tokenizer được train tại chỗ trên prompts + feedback mẫu, backbone
+RoBERTa khởi tạo ngẫu nhiên với kiến trúc giống PhoBERT (size="base") hoặc thu nhỏ
+(size="tiny"). Kết quả dự đoán vô nghĩa nhưng chi phí tính toán đúng hình dạng.
+"""
+
+import random
+import torch
+from tokenizers import Tokenizer, models, pre_tokenizers, trainers, processors
+from transformers import PreTrainedTokenizerFast, RobertaConfig
+
+from PhoBERTPairABSA import PhoBERTPairABSA
+from inference import InferenceEngine
+from model_config import ASPECT_PROMPTS, MAX_LEN, NUM_CLASSES, DROPOUT
+
+SIZES = {
+    'tiny': dict(hidden_size=64, num_hidden_layers=2, num_attention_heads=2, intermediate_size=128),
+    'small': dict(hidden_size=256, num_hidden_layers=4, num_attention_heads=4, intermediate_size=1024),
+    'base': dict(hidden_size=768, num_hidden_layers=12, num_attention_heads=12, intermediate_size=3072),
+}
+
+_SUBJECTS = [
+    "Giảng viên", "Thầy", "Cô giáo", "Chương trình học", "Môn học này", "Lịch học",
+    "Phòng học", "Wifi trường", "Thư viện", "Nhà vệ sinh", "Học phí", "Ký túc xá",
+    "Cổng đào tạo", "Máy chiếu", "Đề cương", "Văn phòng một cửa",
+]
+_PREDICATES = [
+    "giảng bài rất dễ hiểu", "đi dạy trễ thường xuyên", "rất nhiệt tình hỗ trợ sinh viên",
+    "quá tải và hay bị treo", "nóng và không có điều hòa", "cập nhật kiến thức thực tế",
+    "tăng quá nhanh so với chất lượng", "sạch sẽ và yên tĩnh", "chấm điểm không công bằng",
+    "xếp lịch dồn dập vào cuối kỳ", "hoạt động ổn định", "thiếu tài liệu tham khảo",
+    "bình thường, không có gì đặc biệt", "phản hồi email rất chậm",
+]
+_CONNECTORS = [", nhưng ", " và ", ". Tuy nhiên ", ", còn "]
+
+
+def sample_feedback(n: int, seed: int = 0) -> list:
+    """Sinh n feedback tiếng Việt giả lập (1-3 mệnh đề, có lặp lại như dữ liệu thật)"""
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(n):
+        clauses = [f"{rng.choice(_SUBJECTS)} {rng.choice(_PREDICATES)}"
+                   for _ in range(rng.choice([1, 1, 2, 3]))]
+        text = clauses[0]
+        for clause in clauses[1:]:
+            connector = rng.choice(_CONNECTORS)
+            if connector.startswith('.'):
+                clause = clause[0].upper() + clause[1:]
+            else:
+                clause = clause[0].lower() + clause[1:]
+            text += connector + clause
+        texts.append(text)
+    return texts
+
+
+def build_tokenizer(vocab_size: int = 4000) -> PreTrainedTokenizerFast:
+    """Train tokenizer BPE nhỏ với special tokens cùng id như PhoBERT"""
+    corpus = [p for prompts in ASPECT_PROMPTS.values() for p in prompts.values()]
+    corpus += sample_feedback(500, seed=1)
+
+    tok = Tokenizer(models.BPE(unk_token="<unk>"))
+    tok.pre_tokenizer = pre_tokenizers.WhitespaceSplit()
+    trainer = trainers.BpeTrainer(vocab_size=vocab_size, show_progress=False,
+                                  special_tokens=["<s>", "<pad>", "</s>", "<unk>"])
+    tok.train_from_iterator(corpus, trainer=trainer)
+    tok.post_processor = processors.TemplateProcessing(
+        single="<s> $A </s>",
+        pair="<s> $A </s> </s> $B </s>",
+        special_tokens=[("<s>", 0), ("</s>", 2)],
+    )
+    return PreTrainedTokenizerFast(
+        tokenizer_object=tok, bos_token="<s>", eos_token="</s>", unk_token="<unk>",
+        pad_token="<pad>", model_max_length=MAX_LEN,
+    )
+
+
+def build_model(size: str = 'tiny', vocab_size: int = 4000, seed: int = 0) -> PhoBERTPairABSA:
+    torch.manual_seed(seed)
+    config = RobertaConfig(
+        vocab_size=vocab_size, max_position_embeddings=MAX_LEN + 2, type_vocab_size=1,
+        pad_token_id=1, bos_token_id=0, eos_token_id=2, layer_norm_eps=1e-5,
+        # Init range lớn + head "nhọn" để output phụ thuộc input và các nhánh
+        # threshold/margin của hậu xử lý thực sự được chạy
+        initializer_range=0.5, **SIZES[size]
+    )
+    model = PhoBERTPairABSA(num_cls=NUM_CLASSES, dropout=DROPOUT, config=config)
+    head = model.classifier[-1]
+    torch.nn.init.normal_(head.weight, std=4.0 / head.in_features ** 0.5)
+    model.eval()
+    return model
+
+
+def build_engine(size: str = 'tiny', seed: int = 0) -> InferenceEngine:
+    """InferenceEngine dùng tokenizer + model giả lập (chạy CPU)"""
+    tokenizer = build_tokenizer()
+    model = build_model(size, vocab_size=len(tokenizer), seed=seed)
+    return InferenceEngine(tokenizer, model, torch.device('cpu'))
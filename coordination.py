@@ -0,0 +1,110 @@
+"""Phối hợp giữa các process (gunicorn worker) bằng file lock trong instance/
+
+Mỗi worker import app.py nên trước đây đều tự chạy scheduler backup mỗi giờ,
+backup lúc khởi động và lúc thoát: N worker = N lần dump + upload cùng lúc.
+Module này cho phép:
+
+  - Leader: một process giữ lock scheduler.lock suốt đời (flock tự nhả khi
+    process chết), chỉ leader chạy backup theo lịch và backup lúc thoát; các
+    worker khác thử lấy lại lock ở mỗi vòng scheduler nên leader chết thì có
+    worker khác thay.
+  - exclusive(): lock độc quyền ngắn hạn (khởi tạo DB/migration, backup).
+  - run_once(): chạy một việc nếu chưa process nào chạy trong ttl giây gần đây
+    (backup lúc khởi động: worker boot cùng lúc chỉ backup một lần).
+  - mark()/last_marked(): báo cho các process khác một sự kiện (vd. database
+    vừa được restore, cần mở lại kết nối).
+
+Không có fcntl (Windows) thì mọi process tự làm như cũ.
+"""
+
+import os
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+LOCK_DIR = os.path.join(os.getcwd(), 'instance')
+# Trong khoảng này (giây) chỉ một process backup lúc khởi động
+STARTUP_BACKUP_TTL = int(os.getenv('STARTUP_BACKUP_TTL', '900'))
+
+
+def _path(name: str, suffix: str = 'lock') -> str:
+    os.makedirs(LOCK_DIR, exist_ok=True)
+    return os.path.join(LOCK_DIR, f'{name}.{suffix}')
+
+
+@contextmanager
+def exclusive(name: str, blocking: bool = True):
+    """Lock độc quyền giữa các process; yield False nếu blocking=False và process khác đang giữ"""
+    if fcntl is None:
+        yield True
+        return
+    with open(_path(name), 'a+') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def mark(name: str):
+    """Ghi nhận sự kiện `name` vừa xảy ra (các process khác đọc bằng last_marked)"""
+    with open(_path(name, 'stamp'), 'w') as f:
+        f.write(str(os.getpid()))
+
+
+def last_marked(name: str) -> float:
+    """Thời điểm mark(name) gần nhất (0 nếu chưa có)"""
+    try:
+        return os.path.getmtime(_path(name, 'stamp'))
+    except OSError:
+        return 0.0
+
+
+def run_once(name: str, ttl: float, func):
+    """Chạy func() nếu chưa process nào chạy việc `name` trong ttl giây; trả về (đã chạy, kết quả)"""
+    with exclusive(name):
+        if time.time() - last_marked(name) < ttl:
+            return False, None
+        result = func()
+        mark(name)
+        return True, result
+
+
+class Leader:
+    def __init__(self, name: str = 'scheduler'):
+        """Lock leader giữ suốt đời process"""
+        self.name = name
+        self._file = None
+        self._pid = None
+
+    @property
+    def is_leader(self) -> bool:
+        # Process con sau fork kế thừa file descriptor nhưng không phải leader
+        return self._pid == os.getpid()
+
+    def try_acquire(self) -> bool:
+        if self.is_leader:
+            return True
+        if fcntl is None:
+            self._pid = os.getpid()
+            return True
+        f = open(_path(self.name), 'a+')
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            return False
+        f.seek(0)
+        f.truncate()
+        f.write(str(os.getpid()))
+        f.flush()
+        self._file, self._pid = f, os.getpid()
+        return True
@@ -0,0 +1,160 @@
+"""Đọc file CSV upload dạng stream: nén gzip/zstd, UTF-8 (có/không BOM) hoặc UTF-16
+
+/analyze-csv trước đây đọc cả file vào bộ nhớ, decode một lần (chỉ UTF-8) rồi
+list() toàn bộ dòng: file export cả học kỳ 100MB+ chiếm vài lần kích thước của
+nó trong RAM và upload chậm vì không nén được. Ở đây:
+
+  - Werkzeug đã spool phần multipart lớn ra file tạm; stream không seek được
+    (hiếm) cũng được spool ra đĩa trước khi đọc (SpooledTemporaryFile).
+  - Nhận dạng nén theo magic bytes (không theo đuôi file): gzip dùng thư viện
+    chuẩn, zstd dùng compression.zstd (Python 3.14+) hoặc gói zstandard nếu có
+    cài. Giải nén từng khối khi csv đọc tới, tổng dung lượng sau giải nén bị
+    giới hạn bởi CSV_MAX_BYTES (chống file nén "bom").
+  - Encoding đoán từ vài byte đầu: BOM UTF-8/UTF-16, hoặc UTF-16 không BOM qua
+    byte 0 xen kẽ; còn lại là UTF-8. TextIOWrapper decode tăng dần.
+  - iter_row_chunks() trả các dòng theo từng chunk CSV_ROWS_PER_CHUNK để route
+    phân tích + ghi database từng phần thay vì giữ cả file.
+"""
+
+import io
+import os
+import gzip
+import shutil
+import tempfile
+
+CSV_MAX_BYTES = int(os.getenv('CSV_MAX_BYTES', str(1024 * 1024 * 1024)))
+CSV_ROWS_PER_CHUNK = int(os.getenv('CSV_ROWS_PER_CHUNK', '2000'))
+# Phần upload giữ trong RAM trước khi spool ra đĩa (stream không seek được)
+CSV_SPOOL_BYTES = 4 * 1024 * 1024
+
+ALLOWED_SUFFIXES = ('.csv', '.csv.gz', '.gz', '.csv.zst', '.zst')
+FEEDBACK_COLUMNS = ('feedback', 'text', 'content', 'comment')
+
+_GZIP_MAGIC = b'\x1f\x8b'
+_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+class UploadError(Exception):
+    def __init__(self, message: str, status: int = 400):
+        """File upload không đọc được; message hiển thị cho người dùng"""
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def allowed_filename(filename: str) -> bool:
+    return filename.lower().endswith(ALLOWED_SUFFIXES)
+
+
+def _zstd_reader(fileobj):
+    try:
+        from compression import zstd
+        return zstd.ZstdFile(fileobj, mode='rb')
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        raise UploadError('Server chưa hỗ trợ file nén .zst (cần cài gói zstandard), hãy dùng .csv hoặc .csv.gz', 415)
+    return zstandard.ZstdDecompressor().stream_reader(fileobj)
+
+
+class _LimitedReader(io.RawIOBase):
+    def __init__(self, stream, limit: int, compressed: bool):
+        """Đọc từ stream (đã giải nén), lỗi nếu vượt limit byte"""
+        self.stream = stream
+        self.limit = limit
+        self.compressed = compressed
+        self.total = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        try:
+            data = self.stream.read(len(buffer))
+        except Exception as e:
+            if not self.compressed:
+                raise
+            raise UploadError(f'File nén bị lỗi hoặc không đầy đủ: {str(e)}')
+        n = len(data)
+        self.total += n
+        if self.total > self.limit:
+            raise UploadError(f'File sau khi giải nén vượt quá {self.limit // (1024 * 1024)}MB', 413)
+        buffer[:n] = data
+        return n
+
+
+def _seekable(fileobj):
+    try:
+        if fileobj.seekable():
+            return fileobj
+    except Exception:
+        pass
+    spooled = tempfile.SpooledTemporaryFile(max_size=CSV_SPOOL_BYTES)
+    shutil.copyfileobj(fileobj, spooled)
+    spooled.seek(0)
+    return spooled
+
+
+def open_binary(fileobj, limit: int = None):
+    """Stream byte đã giải nén (nếu file nén) của file upload"""
+    limit = limit or CSV_MAX_BYTES
+    fileobj = _seekable(fileobj)
+    start = fileobj.tell()
+    magic = fileobj.read(len(_ZSTD_MAGIC))
+    fileobj.seek(start)
+    if magic.startswith(_GZIP_MAGIC):
+        stream, compressed = gzip.GzipFile(fileobj=fileobj, mode='rb'), True
+    elif magic == _ZSTD_MAGIC:
+        stream, compressed = _zstd_reader(fileobj), True
+    else:
+        stream, compressed = fileobj, False
+    return io.BufferedReader(_LimitedReader(stream, limit, compressed), buffer_size=64 * 1024)
+
+
+def detect_encoding(head: bytes) -> str:
+    """Encoding theo BOM hoặc mẫu byte 0 của UTF-16 không BOM; mặc định UTF-8"""
+    if head.startswith(b'\xef\xbb\xbf'):
+        return 'utf-8-sig'
+    if head.startswith((b'\xff\xfe', b'\xfe\xff')):
+        return 'utf-16'  # codec tự đọc BOM để biết thứ tự byte
+    sample = head[:64]
+    if len(sample) >= 4:
+        half = len(sample) // 2
+        # Text tiếng Việt/ASCII ở UTF-16: byte cao của đa số ký tự là 0
+        if sample[1::2].count(0) > half * 0.6 and sample[0::2].count(0) == 0:
+            return 'utf-16-le'
+        if sample[0::2].count(0) > half * 0.6 and sample[1::2].count(0) == 0:
+            return 'utf-16-be'
+    return 'utf-8'
+
+
+def open_text(fileobj, limit: int = None):
+    """Stream text (decode tăng dần) của file upload, dùng cho csv.reader"""
+    binary = open_binary(fileobj, limit)
+    encoding = detect_encoding(binary.peek(64)[:64])
+    return io.TextIOWrapper(binary, encoding=encoding, newline='')
+
+
+def find_feedback_column(fieldnames):
+    """Tên cột chứa feedback trong header"""
+    if not fieldnames:
+        raise UploadError('File CSV không có header')
+    for col in fieldnames:
+        if col is not None and col.lower().strip() in FEEDBACK_COLUMNS:
+            return col
+    raise UploadError(f'Không tìm thấy cột chứa feedback. Các cột: {", ".join(c for c in fieldnames if c)}')
+
+
+def iter_row_chunks(reader, column: str, chunk_size: int = None):
+    """Các chunk [(số thứ tự dòng, text đã strip)] từ csv.DictReader"""
+    chunk_size = chunk_size or CSV_ROWS_PER_CHUNK
+    chunk = []
+    for row_num, row in enumerate(reader, start=1):
+        chunk.append((row_num, (row.get(column) or '').strip()))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
@@ -0,0 +1,126 @@
+"""Phiên bản dữ liệu cho HTTP cache (ETag/304) của trang thống kê và lịch sử
+
+/my-statistics, /admin/database và /api/feedback-history trước đây query lại
+và render lại toàn bộ ở mỗi lần tải trang/đổi bộ lọc, dù dữ liệu không đổi.
+Bảng data_versions giữ một bộ đếm cho mỗi phạm vi:
+
+  - 'global': mọi thay đổi feedbacks/users (trang admin).
+  - 'user:<id>': feedback của một user (thống kê, lịch sử của user đó).
+
+Bộ đếm được tăng trong cùng transaction với lượt ghi: listener after_flush
+bắt Feedback/User được thêm/xoá qua ORM; code ghi bằng Core (insert/delete
+hàng loạt trong rescore.py, redecide.py) gọi bump() trước khi commit. Bộ đếm
+nằm trong database nên mọi worker thấy cùng một giá trị.
+
+Route tính ETag từ các bộ đếm (read(): một query theo khoá chính), trả 304
+nếu trùng If-None-Match, và RenderCache giữ body đã render theo ETag nên lần
+tải lại khi dữ liệu chưa đổi không query bảng feedbacks cũng không render
+template.
+"""
+
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+from models import Feedback, User
+
+RENDER_CACHE_SIZE = int(os.getenv('RENDER_CACHE_SIZE', '256'))
+
+GLOBAL = 'global'
+
+_UPSERT = text(
+    "INSERT INTO data_versions (scope, version, updated_at) VALUES (:scope, 1, :now) "
+    "ON CONFLICT(scope) DO UPDATE SET version = version + 1, updated_at = :now")
+
+
+def user_scope(user_id) -> str:
+    return f'user:{user_id}'
+
+
+def _scopes_for(user_ids) -> list:
+    return [GLOBAL] + sorted({user_scope(uid) for uid in user_ids if uid is not None})
+
+
+def bump(session, user_ids=()):
+    """Tăng bộ đếm global và của các user_ids (gọi trong transaction đang ghi, trước commit)"""
+    now = datetime.utcnow()
+    session.connection().execute(_UPSERT, [{'scope': scope, 'now': now} for scope in _scopes_for(user_ids)])
+
+
+@event.listens_for(Session, 'after_flush')
+def _bump_on_flush(session, flush_context):
+    changed, user_ids = False, set()
+    for obj in list(session.new) + list(session.deleted):
+        if isinstance(obj, Feedback):
+            changed = True
+            user_ids.add(obj.user_id)
+        elif isinstance(obj, User):
+            changed = True
+    if changed:
+        bump(session, user_ids)
+
+
+class Versions:
+    def __init__(self, values: dict, updated_at=None):
+        """Bộ đếm của các scope đã đọc (scope chưa có dòng nào = 0)"""
+        self.values = values
+        self.updated_at = updated_at
+
+    def token(self) -> str:
+        return ','.join(f'{scope}={version}' for scope, version in sorted(self.values.items()))
+
+
+def read(session, scopes) -> Versions:
+    """Đọc bộ đếm của các scope bằng một query"""
+    scopes = list(scopes)
+    params = {f's{i}': scope for i, scope in enumerate(scopes)}
+    placeholders = ', '.join(f':{name}' for name in params)
+    rows = session.execute(
+        text(f"SELECT scope, version, updated_at FROM data_versions WHERE scope IN ({placeholders})"), params).all()
+    values = {scope: 0 for scope in scopes}
+    updated = []
+    for scope, version, updated_at in rows:
+        values[scope] = version
+        if updated_at is not None:
+            updated.append(updated_at if isinstance(updated_at, datetime) else datetime.fromisoformat(str(updated_at)))
+    return Versions(values, max(updated) if updated else None)
+
+
+def make_etag(*parts) -> str:
+    return hashlib.sha1('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()[:24]
+
+
+class RenderCache:
+    def __init__(self, max_size: int = RENDER_CACHE_SIZE):
+        """LRU body đã render theo ETag (ETag đã gồm tên trang, user, tham số và phiên bản dữ liệu)"""
+        self.max_size = max(0, max_size)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, etag: str):
+        with self._lock:
+            entry = self._entries.get(etag)
+            if entry is not None:
+                self._entries.move_to_end(etag)
+            return entry
+
+    def put(self, etag: str, body: bytes, mimetype: str):
+        if self.max_size == 0:
+            return
+        with self._lock:
+            self._entries[etag] = (body, mimetype)
+            self._entries.move_to_end(etag)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+render_cache = RenderCache()
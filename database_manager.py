@@ -1,12 +1,97 @@
 import os
 import shutil
 import json
+import base64
 from datetime import datetime
 from typing import Optional
-from huggingface_hub import HfApi, login
 import sqlite3
 import tempfile
 
+import coordination
+
+# Số dòng mỗi lần executemany khi restore
+RESTORE_BATCH_ROWS = 5000
+_READ_CHUNK = 1 << 20
+
+
+def _b64decode(value):
+    return base64.b64decode(value) if isinstance(value, str) else value
+
+
+class _JsonStream:
+    def __init__(self, f):
+        """Đọc file JSON từng phần: mỗi giá trị nhỏ (một dòng, list cột) được raw_decode
+        riêng, object/array lớn được duyệt qua iter_object/iter_array"""
+        self._f = f
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+    
+    def _fill(self) -> bool:
+        chunk = self._f.read(_READ_CHUNK)
+        if not chunk:
+            self._eof = True
+            return False
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+        return True
+    
+    def _peek(self) -> str:
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in ' \t\r\n':
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ''
+    
+    def _next(self, allowed: str) -> str:
+        char = self._peek()
+        if not char or char not in allowed:
+            raise ValueError(f"File backup JSON không hợp lệ: cần một trong '{allowed}', gặp '{char}'")
+        self._pos += 1
+        return char
+    
+    def value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # Số nằm cuối buffer có thể còn chữ số ở chunk sau
+            if end == len(self._buf) and not self._eof and self._fill():
+                continue
+            self._pos = end
+            return value
+    
+    def iter_object(self):
+        """Yield từng key; caller phải đọc value của key đó trước khi lấy key tiếp theo"""
+        self._next('{')
+        if self._peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            key = self.value()
+            self._next(':')
+            yield key
+            if self._next(',}') == '}':
+                return
+    
+    def iter_array(self):
+        self._next('[')
+        if self._peek() == ']':
+            self._pos += 1
+            return
+        while True:
+            yield self.value()
+            if self._next(',]') == ']':
+                return
+
+
 class DatabaseManager:
     def __init__(self, hf_token: Optional[str] = None, repo_id: Optional[str] = None):
         """Initialize Database Manager for Hugging Face Hub storage"""
@@ -17,15 +102,22 @@ class DatabaseManager:
         self.is_local = not self.hf_token
         
         os.makedirs(self.backup_dir, exist_ok=True)
-        
-        if self.hf_token:
-            try:
-                login(token=self.hf_token)
-                self.api = HfApi()
-            except Exception:
-                self.api = None
-        else:
-            self.api = None
+        self._api = None
+        self._api_loaded = False
+    
+    @property
+    def api(self):
+        """HfApi, đăng nhập ở lần dùng đầu tiên (import huggingface_hub chậm, không làm lúc khởi động)"""
+        if not self._api_loaded:
+            self._api_loaded = True
+            if self.hf_token:
+                try:
+                    from huggingface_hub import HfApi, login
+                    login(token=self.hf_token)
+                    self._api = HfApi()
+                except Exception:
+                    self._api = None
+        return self._api
     
     def sqlite_to_json(self, db_path: str) -> dict:
         """Convert SQLite database to JSON format"""
@@ -36,6 +128,13 @@ class DatabaseManager:
             cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
             tables = cursor.fetchall()
             
+            # Bảng ảo (FTS5 search index) và các bảng shadow của nó được dựng lại từ
+            # feedbacks khi app khởi động, không cần backup
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND sql LIKE 'CREATE VIRTUAL TABLE%';")
+            virtual_tables = [row[0] for row in cursor.fetchall()]
+            tables = [t for t in tables
+                      if not any(t[0] == v or t[0].startswith(f"{v}_") for v in virtual_tables)]
+            
             data = {}
             
             for table in tables:
@@ -51,18 +150,24 @@ class DatabaseManager:
                 rows = cursor.fetchall()
                 
                 table_data = []
+                blob_columns = set()
                 for row in rows:
                     row_dict = {}
                     for i, value in enumerate(row):
                         if columns[i] == 'is_admin':
                             value = bool(value) if value is not None else False
+                        elif isinstance(value, bytes):
+                            # JSON không chứa được bytes (vd. feedback_scores.probs)
+                            value = base64.b64encode(value).decode('ascii')
+                            blob_columns.add(columns[i])
                         row_dict[columns[i]] = value
                     table_data.append(row_dict)
                 
-                data[table_name] = {
-                    'columns': columns,
-                    'data': table_data
-                }
+                data[table_name] = {'columns': columns}
+                if blob_columns:
+                    # Ghi trước 'data' để restore dạng stream biết cột nào cần giải base64
+                    data[table_name]['blob_columns'] = sorted(blob_columns)
+                data[table_name]['data'] = table_data
             
             try:
                 cursor.execute("SELECT * FROM sqlite_sequence")
@@ -86,74 +191,142 @@ class DatabaseManager:
         except Exception:
             return {}
     
-    def json_to_sqlite(self, json_data: dict, db_path: str):
-        """Convert JSON data back to SQLite database"""
+    def restore_from_file(self, backup_path: str, db_path: str) -> dict:
+        """Dựng database từ file backup JSON mà không load cả file vào bộ nhớ
+
+        Đọc từng dòng bằng _JsonStream, ghi theo batch vào file tạm cạnh db_path,
+        kiểm tra số dòng từng bảng + quick_check rồi os.replace vào db_path (DB đang
+        chạy vẫn dùng được tới lúc thay). Trả về số dòng từng bảng; lỗi thì raise và
+        giữ nguyên DB cũ.
+        """
+        db_dir = os.path.dirname(db_path) or '.'
+        os.makedirs(db_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='.restore_', suffix='.db', dir=db_dir)
+        os.close(fd)
         try:
-            if os.path.exists(db_path):
-                os.remove(db_path)
-            
-            os.makedirs(os.path.dirname(db_path), exist_ok=True)
-            
-            conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
+            conn = sqlite3.connect(tmp_path)
+            # File tạm: không cần journal, độ bền được đảm bảo bằng fsync trước khi thay
+            conn.execute("PRAGMA journal_mode=OFF")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.create_function('b64decode', 1, _b64decode, deterministic=True)
             
-            for table_name, table_info in json_data.items():
-                if table_name in ['sqlite_sequence', 'sqlite_master']:
-                    continue
-                    
-                columns = table_info['columns']
-                data = table_info['data']
-                
-                if not columns:
-                    continue
-                
-                column_defs = []
-                for col in columns:
-                    if col == 'id':
-                        column_defs.append(f"{col} INTEGER PRIMARY KEY AUTOINCREMENT")
-                    elif col == 'is_admin':
-                        column_defs.append(f"{col} BOOLEAN DEFAULT 0")
+            counts, sequence = {}, []
+            with open(backup_path, 'r', encoding='utf-8') as f:
+                stream = _JsonStream(f)
+                for table_name in stream.iter_object():
+                    if table_name == 'sqlite_sequence':
+                        sequence = stream.value().get('data', [])
+                    elif table_name == 'sqlite_master':
+                        stream.value()
                     else:
-                        column_defs.append(f"{col} TEXT")
-                
-                create_sql = f"CREATE TABLE IF NOT EXISTS {table_name} ({', '.join(column_defs)})"
-                cursor.execute(create_sql)
-                
-                if data:
-                    placeholders = ', '.join(['?' for _ in columns])
-                    insert_sql = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders})"
-                    
-                    for row in data:
-                        values = []
-                        for col in columns:
-                            value = row.get(col)
-                            if col == 'is_admin':
-                                if isinstance(value, bool):
-                                    values.append(int(value))
-                                elif isinstance(value, str):
-                                    values.append(1 if value.lower() in ['true', '1'] else 0)
-                                else:
-                                    values.append(int(value) if value else 0)
-                            else:
-                                values.append(value)
-                        cursor.execute(insert_sql, values)
-            
-            if 'sqlite_sequence' in json_data:
-                sequence_data = json_data['sqlite_sequence']['data']
-                for seq_row in sequence_data:
-                    table_name = seq_row.get('name')
-                    seq_value = seq_row.get('seq')
-                    if table_name and seq_value:
-                        cursor.execute(f"INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", 
-                                     (table_name, seq_value))
+                        counts[table_name] = self._restore_table(conn, stream, table_name)
             
+            for seq_row in sequence:
+                if seq_row.get('name') and seq_row.get('seq'):
+                    # Chèn dòng có id vào bảng AUTOINCREMENT đã tự tạo dòng sqlite_sequence
+                    updated = conn.execute("UPDATE sqlite_sequence SET seq = max(seq, ?) WHERE name = ?",
+                                           (seq_row['seq'], seq_row['name'])).rowcount
+                    if not updated:
+                        conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)",
+                                     (seq_row['name'], seq_row['seq']))
             conn.commit()
+            
+            for table_name, expected in counts.items():
+                actual = conn.execute(f"SELECT count(*) FROM {table_name}").fetchone()[0]
+                if actual != expected:
+                    raise ValueError(f"Bảng {table_name}: {actual} dòng, backup có {expected}")
+            if conn.execute("PRAGMA quick_check").fetchone()[0] != 'ok':
+                raise ValueError("Database restore không hợp lệ (quick_check)")
             conn.close()
-        except Exception:
-            pass
+            
+            with open(tmp_path, 'rb') as f:
+                os.fsync(f.fileno())
+            os.replace(tmp_path, db_path)
+            return counts
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    
+    def _restore_table(self, conn, stream, table_name: str) -> int:
+        """Đọc một bảng từ stream và ghi vào conn theo batch RESTORE_BATCH_ROWS dòng"""
+        columns, blob_columns, late_blob_columns = None, set(), set()
+        insert_sql, count = None, 0
+        
+        def create_table():
+            column_defs = []
+            for col in columns:
+                if col == 'id':
+                    column_defs.append(f"{col} INTEGER PRIMARY KEY AUTOINCREMENT")
+                elif col == 'is_admin':
+                    column_defs.append(f"{col} BOOLEAN DEFAULT 0")
+                elif col in blob_columns:
+                    column_defs.append(f"{col} BLOB")
+                else:
+                    column_defs.append(f"{col} TEXT")
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {table_name} ({', '.join(column_defs)})")
+            placeholders = ', '.join(['?' for _ in columns])
+            return f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders})"
+        
+        for key in stream.iter_object():
+            if key == 'columns':
+                columns = stream.value()
+            elif key == 'blob_columns':
+                names = set(stream.value())
+                # Backup cũ ghi blob_columns sau data: các dòng đã ghi còn ở dạng base64
+                if insert_sql is not None:
+                    late_blob_columns = names
+                else:
+                    blob_columns = names
+            elif key == 'data':
+                if not columns:
+                    stream.value()
+                    continue
+                insert_sql = insert_sql or create_table()
+                batch = []
+                for row in stream.iter_array():
+                    batch.append(self._row_values(row, columns, blob_columns))
+                    if len(batch) >= RESTORE_BATCH_ROWS:
+                        conn.executemany(insert_sql, batch)
+                        count += len(batch)
+                        batch = []
+                if batch:
+                    conn.executemany(insert_sql, batch)
+                    count += len(batch)
+            else:
+                stream.value()
+        
+        if columns and insert_sql is None:
+            create_table()
+        for col in late_blob_columns:
+            conn.execute(f"UPDATE {table_name} SET {col} = b64decode({col})")
+        conn.commit()
+        return count
+    
+    @staticmethod
+    def _row_values(row: dict, columns: list, blob_columns: set) -> list:
+        values = []
+        for col in columns:
+            value = row.get(col)
+            if col == 'is_admin':
+                if isinstance(value, bool):
+                    values.append(int(value))
+                elif isinstance(value, str):
+                    values.append(1 if value.lower() in ['true', '1'] else 0)
+                else:
+                    values.append(int(value) if value else 0)
+            elif col in blob_columns and isinstance(value, str):
+                values.append(base64.b64decode(value))
+            else:
+                values.append(value)
+        return values
     
     def backup_database(self, force: bool = False) -> bool:
         """Backup database to Hugging Face Hub"""
+        # Nhiều process (gunicorn worker, rescore.py...) backup lần lượt, không dump/upload chồng nhau
+        with coordination.exclusive('backup'):
+            return self._backup_database(force)
+
+    def _backup_database(self, force: bool = False) -> bool:
         if self.is_local:
             return True
             
@@ -196,25 +369,23 @@ class DatabaseManager:
         if not self.api:
             return False
         
+        temp_dir = tempfile.mkdtemp()
         try:
-            temp_dir = tempfile.mkdtemp()
-            temp_file = os.path.join(temp_dir, 'feedback_backup.json')
-            
-            self.api.hf_hub_download(
+            temp_file = self.api.hf_hub_download(
                 repo_id=self.repo_id,
                 filename='feedback_backup.json',
                 local_dir=temp_dir,
                 repo_type="dataset"
             )
             
-            with open(temp_file, 'r', encoding='utf-8') as f:
-                json_data = json.load(f)
-            
-            self.json_to_sqlite(json_data, self.db_path)
-            shutil.rmtree(temp_dir)
+            # Không backup trong lúc đang thay file database
+            with coordination.exclusive('backup'):
+                self.restore_from_file(temp_file, self.db_path)
             return True
         except Exception:
             return False
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
     
     def check_database_exists(self) -> bool:
         """Check if database file exists locally"""
@@ -0,0 +1,165 @@
+"""Bước quyết định aspect/sentiment từ ma trận xác suất của model
+
+decide_batch xử lý cùng lúc N feedback: probs có shape (N, 4 aspect, 4 class),
+has_kw có shape (N, 4). Mọi luật (keyword boost, threshold, loại bỏ khi có aspect
+rất chắc chắn, MIN_SENT_PROB, MIN_MARGIN) được tính bằng phép toán tensor, chỉ
+chuyển sang Python list một lần ở cuối để dựng kết quả.
+
+decide_reference là cài đặt gốc từng phần tử (trước khi vector hoá), giữ lại để
+kiểm tra parity: python -m benchmarks.check_decision_parity
+"""
+
+import torch
+from model_config import (
+    ASPECTS_EN, LABEL_MAP, PRED_THRESHOLD, MIN_SENT_PROB, MIN_MARGIN
+)
+
+KW_BOOST = 0.02
+NO_KW_THRESHOLD = 0.85
+HIGH_CONF_THRESHOLD = 0.95
+
+
+def default_thresholds() -> dict:
+    return {
+        'pred_threshold': PRED_THRESHOLD,
+        'min_sent_prob': MIN_SENT_PROB,
+        'min_margin': MIN_MARGIN,
+        'kw_boost': KW_BOOST,
+        'no_kw_threshold': NO_KW_THRESHOLD,
+        'high_conf_threshold': HIGH_CONF_THRESHOLD,
+    }
+
+
+def decide_batch(probs, has_kw, pred_threshold=PRED_THRESHOLD, min_sent_prob=MIN_SENT_PROB,
+                 min_margin=MIN_MARGIN, kw_boost=KW_BOOST, no_kw_threshold=NO_KW_THRESHOLD,
+                 high_conf_threshold=HIGH_CONF_THRESHOLD) -> dict:
+    """Tính mask giữ lại + sentiment cho tensor probs (N, A, C) và has_kw (N, A)"""
+    has_kw = torch.as_tensor(has_kw, dtype=torch.bool, device=probs.device)
+    tau_len = float(pred_threshold)
+
+    conf = 1.0 - probs[..., 0]
+    conf = torch.where(has_kw, torch.clamp(conf + kw_boost, max=1.0), conf)
+
+    # Bước 1: có keyword cần >= threshold, không có keyword cần >= no_kw_threshold
+    keep = torch.where(has_kw, conf >= tau_len, conf >= no_kw_threshold)
+
+    # Bước 2-3: nếu có aspect rất chắc chắn, bỏ các aspect không keyword còn lại,
+    # rồi cho phép thêm aspect có keyword với ngưỡng điều chỉnh
+    high = keep & (conf >= high_conf_threshold)
+    any_high = high.any(dim=-1, keepdim=True)
+    tau_len_adjusted = tau_len - 0.05
+    pruned = (keep & (has_kw | high)) | (has_kw & (conf >= tau_len_adjusted + 0.10))
+    keep = torch.where(any_high, pruned, keep)
+
+    # Sentiment: so sánh trên float64 giống phép tính float Python của bản gốc
+    sent_probs = probs[..., 1:]
+    top_idx = torch.argmax(sent_probs, dim=-1)
+    top2 = torch.topk(sent_probs, k=2, dim=-1).values.double()
+    top_p = top2[..., 0]
+    margin = top_p - top2[..., 1]
+    min_margin_adj = torch.where(has_kw,
+                                 torch.full_like(margin, min_margin - 0.02),
+                                 torch.full_like(margin, min_margin))
+    final = keep & (top_p >= min_sent_prob) & (margin >= min_margin_adj)
+
+    return {
+        'keep': final,
+        'confidence': conf,
+        'sentiment_idx': top_idx + 1,
+        'sentiment_confidence': top_p,
+        'margin': margin,
+    }
+
+
+def decision_to_results(decision: dict) -> list:
+    """Chuyển output của decide_batch thành list kết quả (mỗi feedback một list dict)"""
+    keep = decision['keep'].tolist()
+    conf = decision['confidence'].tolist()
+    sent_idx = decision['sentiment_idx'].tolist()
+    sent_conf = decision['sentiment_confidence'].tolist()
+    margin = decision['margin'].tolist()
+
+    batch = []
+    for n, row in enumerate(keep):
+        results = [{
+            "topic": ASPECTS_EN[i],
+            "sentiment": LABEL_MAP[sent_idx[n][i]],
+            "confidence": conf[n][i],
+            "sentiment_confidence": sent_conf[n][i],
+            "margin": margin[n][i],
+        } for i, kept in enumerate(row) if kept]
+        results.sort(key=lambda x: x["confidence"], reverse=True)
+        batch.append(results)
+    return batch
+
+
+def decide(probs, has_keywords, **thresholds) -> list:
+    """Quyết định cho một feedback: probs (A, C), has_keywords list A phần tử"""
+    decision = decide_batch(probs.unsqueeze(0), [list(has_keywords)], **thresholds)
+    return decision_to_results(decision)[0]
+
+
+def decide_reference(probs, has_keywords):
+    """Cài đặt từng phần tử gốc (chỉ dùng để kiểm tra parity với decide_batch)"""
+    tau_len = float(PRED_THRESHOLD)
+
+    p_none = probs[:, 0]
+    conf_not_none = 1.0 - p_none
+
+    conf_not_none_boosted = conf_not_none.clone()
+    for i, has_kw in enumerate(has_keywords):
+        if has_kw:
+            conf_not_none_boosted[i] = min(1.0, conf_not_none_boosted[i] + KW_BOOST)
+
+    keep_indices = []
+    for i in range(len(ASPECTS_EN)):
+        if has_keywords[i]:
+            if conf_not_none_boosted[i] >= tau_len:
+                keep_indices.append(i)
+        else:
+            if conf_not_none_boosted[i] >= 0.85:
+                keep_indices.append(i)
+
+    high_confidence_indices = [i for i in keep_indices if conf_not_none_boosted[i] >= 0.95]
+
+    if len(high_confidence_indices) > 0:
+        keep_indices = [i for i in keep_indices if has_keywords[i] or i in high_confidence_indices]
+
+        if len(keep_indices) < len(ASPECTS_EN):
+            tau_len_adjusted = tau_len - 0.05
+            for i in range(len(ASPECTS_EN)):
+                if i not in keep_indices:
+                    if has_keywords[i] and conf_not_none_boosted[i] >= tau_len_adjusted + 0.10:
+                        keep_indices.append(i)
+
+    if not keep_indices:
+        return []
+
+    results = []
+    for i in sorted(keep_indices, key=lambda j: float(conf_not_none_boosted[j]), reverse=True):
+        sent_probs = probs[i, 1:].clone()
+        top_idx = int(torch.argmax(sent_probs).item())
+        top_p = float(sent_probs[top_idx].item())
+
+        sent_probs[top_idx] = -1.0
+        second_p = float(sent_probs.max().item())
+        margin = top_p - second_p
+
+        min_margin_adj = MIN_MARGIN
+        if has_keywords[i]:
+            min_margin_adj = MIN_MARGIN - 0.02
+
+        if top_p < MIN_SENT_PROB or margin < min_margin_adj:
+            continue
+
+        sentiment_str = LABEL_MAP[top_idx + 1]
+        results.append({
+            "topic": ASPECTS_EN[i],
+            "sentiment": sentiment_str,
+            "confidence": float(conf_not_none_boosted[i].item()),
+            "sentiment_confidence": top_p,
+            "margin": margin
+        })
+
+    results.sort(key=lambda x: x["confidence"], reverse=True)
+    return results
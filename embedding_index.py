@@ -0,0 +1,324 @@
+"""Index embedding của feedback để tìm "các feedback tương tự" không cần chạy lại model
+
+Mỗi lần phân tích, PhoBERTPairABSA đã tính vector [CLS] cho từng cặp (prompt
+aspect, feedback); InferenceEngine lấy trung bình 4 aspect (và các mảnh nếu tách
+câu), chuẩn hoá L2 và trả về kèm score dưới dạng blob float16. Vector được ghi
+nối tiếp vào file trong instance/embeddings/<model_version>/:
+
+  vectors.f16   ma trận float16 (N, hidden), mở bằng np.memmap
+  rows.bin      (feedback_scores.id, user_id) int64 của từng dòng, cùng thứ tự
+  meta.json     hidden size
+
+Ghi: save_feedback_to_db gọi stage() (chỉ khi có ít nhất một aspect, vì kết
+quả tìm kiếm trỏ tới dòng feedbacks); id của feedback_scores có sau flush, file
+chỉ được ghi sau khi transaction commit (rollback thì bỏ). Các worker ghi lần
+lượt qua coordination.exclusive; người đọc lấy số dòng theo kích thước file
+nên không bao giờ thấy dòng ghi dở. Mỗi model_version một thư mục vì vector của
+hai model khác nhau không so sánh được.
+
+Tìm kiếm: tích vô hướng chính xác (cosine, vector đã chuẩn hoá) trên memmap theo
+từng khối EMBEDDING_SEARCH_CHUNK dòng đổi sang float32, argpartition lấy top-k.
+Vài trăm nghìn dòng x 768 chiều mất cỡ vài chục ms, không query bảng feedbacks.
+
+Feedback cũ (trước khi có index) hoặc sau khi restore database:
+
+    python embedding_index.py --backfill
+    python embedding_index.py --backfill --socket instance/inference.sock
+"""
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import coordination
+
+EMBEDDING_DIR = os.path.join(os.getcwd(), 'instance', 'embeddings')
+EMBEDDING_SEARCH_CHUNK = int(os.getenv('EMBEDDING_SEARCH_CHUNK', '65536'))
+BACKFILL_CHUNK = 256
+
+_ROW_BYTES = 16  # (score_id, user_id) int64
+_PENDING_KEY = 'embedding_pending'
+_STAGED_KEY = 'embedding_staged'
+
+
+class EmbeddingIndexError(RuntimeError):
+    pass
+
+
+def _safe_version(version) -> str:
+    return ''.join(c if c.isalnum() or c in '-_.+' else '_' for c in str(version or 'unversioned'))
+
+
+def _version_dir(version) -> str:
+    return os.path.join(EMBEDDING_DIR, _safe_version(version))
+
+
+# ===== Ghi =====
+
+def stage(session, score_row, user_id, version, blob: bytes):
+    """Đăng ký vector của score_row (chưa flush) để ghi vào index khi session commit"""
+    session.info.setdefault(_PENDING_KEY, []).append((score_row, user_id, version, blob))
+
+
+def stage_ids(session, items):
+    """Như stage() cho các feedback_scores đã có id: items = [(score_id, user_id, version, blob)]"""
+    session.info.setdefault(_STAGED_KEY, []).extend(items)
+
+
+@event.listens_for(Session, 'after_flush')
+def _resolve_ids(session, flush_context):
+    pending = session.info.pop(_PENDING_KEY, None)
+    if pending:
+        stage_ids(session, [(row.id, user_id, version, blob) for row, user_id, version, blob in pending
+                            if row.id is not None])
+
+
+@event.listens_for(Session, 'after_commit')
+def _append_committed(session):
+    staged = session.info.pop(_STAGED_KEY, None)
+    session.info.pop(_PENDING_KEY, None)
+    if not staged:
+        return
+    by_version = {}
+    for score_id, user_id, version, blob in staged:
+        by_version.setdefault(version, []).append((score_id, user_id, blob))
+    for version, items in by_version.items():
+        try:
+            append(version, items)
+        except Exception:
+            # Index chỉ là dữ liệu phụ: lỗi ghi không làm hỏng request (backfill bổ sung sau)
+            pass
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_staged(session, previous_transaction):
+    session.info.pop(_STAGED_KEY, None)
+    session.info.pop(_PENDING_KEY, None)
+
+
+def append(version, items):
+    """Ghi nối tiếp [(score_id, user_id, blob float16)] vào index của version"""
+    import numpy as np
+
+    if not items:
+        return 0
+    dim = len(items[0][2]) // 2
+    directory = _version_dir(version)
+    with coordination.exclusive('embeddings'):
+        os.makedirs(directory, exist_ok=True)
+        meta_path = os.path.join(directory, 'meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding='utf-8') as f:
+                if json.load(f)['dim'] != dim:
+                    raise EmbeddingIndexError(f'Index {version} có số chiều khác {dim}')
+        else:
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                json.dump({'dim': dim, 'model_version': version}, f)
+        vectors_path = os.path.join(directory, 'vectors.f16')
+        rows_path = os.path.join(directory, 'rows.bin')
+        # Dòng ghi dở (process chết giữa chừng) bị cắt trước khi ghi tiếp để hai file luôn khớp
+        count = min(_file_rows(vectors_path, dim * 2), _file_rows(rows_path, _ROW_BYTES))
+        for path, row_bytes in ((vectors_path, dim * 2), (rows_path, _ROW_BYTES)):
+            if os.path.exists(path) and os.path.getsize(path) != count * row_bytes:
+                os.truncate(path, count * row_bytes)
+        # vectors trước, rows sau: người đọc chỉ lấy các dòng đã có ở cả hai file
+        with open(vectors_path, 'ab') as f:
+            f.write(b''.join(blob for _, _, blob in items))
+        rows = np.array([(score_id, user_id) for score_id, user_id, _ in items], dtype='<i8')
+        with open(rows_path, 'ab') as f:
+            f.write(rows.tobytes())
+    return len(items)
+
+
+def _file_rows(path: str, row_bytes: int) -> int:
+    try:
+        return os.path.getsize(path) // row_bytes
+    except OSError:
+        return 0
+
+
+def reset():
+    """Xoá toàn bộ index (database vừa được restore: id feedback_scores không còn khớp)"""
+    with coordination.exclusive('embeddings'):
+        shutil.rmtree(EMBEDDING_DIR, ignore_errors=True)
+
+
+def indexed_score_ids(version) -> set:
+    return {int(score_id) for score_id in EmbeddingIndex(version).rows()[0]}
+
+
+# ===== Đọc =====
+
+def vector_from_blob(blob: bytes):
+    """Blob float16 (score[2] của engine) -> vector float32"""
+    import numpy as np
+    return np.frombuffer(blob, dtype=np.float16).astype(np.float32)
+
+
+class EmbeddingIndex:
+    def __init__(self, version):
+        """Index của một model_version, mở lại memmap khi file lớn lên (worker khác vừa ghi)"""
+        self.version = version
+        self.directory = _version_dir(version)
+        self._lock = threading.Lock()
+        self._cache = None  # ((số dòng, inode), (số dòng, vectors memmap, score_ids, user_ids))
+
+    def _load(self):
+        import numpy as np
+
+        meta_path = os.path.join(self.directory, 'meta.json')
+        if not os.path.exists(meta_path):
+            return 0, None, np.empty(0, dtype='<i8'), np.empty(0, dtype='<i8')
+        with open(meta_path, encoding='utf-8') as f:
+            dim = json.load(f)['dim']
+        vectors_path = os.path.join(self.directory, 'vectors.f16')
+        rows_path = os.path.join(self.directory, 'rows.bin')
+        count = min(_file_rows(vectors_path, dim * 2), _file_rows(rows_path, _ROW_BYTES))
+        if count == 0:
+            return 0, None, np.empty(0, dtype='<i8'), np.empty(0, dtype='<i8')
+        # inode đổi: index bị xoá và tạo lại (restore) dù số dòng có thể trùng
+        key = (count, os.stat(vectors_path).st_ino)
+        with self._lock:
+            if self._cache is not None and self._cache[0] == key:
+                return self._cache[1]
+            vectors = np.memmap(vectors_path, dtype=np.float16, mode='r', shape=(count, dim))
+            rows = np.fromfile(rows_path, dtype='<i8', count=count * 2).reshape(count, 2)
+            loaded = (count, vectors, rows[:, 0].copy(), rows[:, 1].copy())
+            self._cache = (key, loaded)
+            return loaded
+
+    def __len__(self):
+        return self._load()[0]
+
+    def rows(self):
+        """(score_ids, user_ids) theo thứ tự dòng"""
+        _, _, score_ids, user_ids = self._load()
+        return score_ids, user_ids
+
+    def vector_of(self, score_id: int):
+        """Vector float32 của feedback_scores.id (None nếu chưa có trong index)"""
+        import numpy as np
+
+        _, vectors, score_ids, _ = self._load()
+        matches = np.flatnonzero(score_ids == score_id)
+        if len(matches) == 0:
+            return None
+        return np.asarray(vectors[matches[-1]], dtype=np.float32)
+
+    def search(self, query, k: int = 10, user_id: int = None, exclude_score_id: int = None):
+        """[(score_id, cosine)] của k vector gần query nhất (lọc theo user_id nếu có)"""
+        import numpy as np
+
+        count, vectors, score_ids, user_ids = self._load()
+        if count == 0 or k <= 0:
+            return []
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        norm = float(np.linalg.norm(query))
+        if norm == 0:
+            return []
+        query = query / norm
+
+        best_scores = np.empty(0, dtype=np.float32)
+        best_rows = np.empty(0, dtype=np.int64)
+        for start in range(0, count, EMBEDDING_SEARCH_CHUNK):
+            end = min(count, start + EMBEDDING_SEARCH_CHUNK)
+            scores = np.asarray(vectors[start:end], dtype=np.float32) @ query
+            mask = np.ones(end - start, dtype=bool)
+            if user_id is not None:
+                mask &= user_ids[start:end] == user_id
+            if exclude_score_id is not None:
+                mask &= score_ids[start:end] != exclude_score_id
+            scores[~mask] = -np.inf
+            take = min(k, end - start)
+            top = np.argpartition(-scores, take - 1)[:take]
+            best_scores = np.concatenate([best_scores, scores[top]])
+            best_rows = np.concatenate([best_rows, top + start])
+            if len(best_scores) > k:
+                keep = np.argpartition(-best_scores, k - 1)[:k]
+                best_scores, best_rows = best_scores[keep], best_rows[keep]
+
+        order = np.argsort(-best_scores, kind='stable')
+        return [(int(score_ids[row]), float(score)) for row, score in zip(best_rows[order], best_scores[order])
+                if np.isfinite(score)]
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(version) -> EmbeddingIndex:
+    """EmbeddingIndex dùng chung trong process cho model_version"""
+    with _indexes_lock:
+        index = _indexes.get(version)
+        if index is None:
+            index = _indexes[version] = EmbeddingIndex(version)
+        return index
+
+
+# ===== Backfill =====
+
+def backfill(engine, chunk_size: int = BACKFILL_CHUNK) -> int:
+    """Chạy model cho các feedback_scores chưa có trong index của model hiện tại (cần app context)"""
+    from models import db, Feedback, FeedbackScore
+
+    version = engine.model_version
+    done = indexed_score_ids(version)
+    total = 0
+    after_id = 0
+    while True:
+        rows = (db.session.query(FeedbackScore.id, FeedbackScore.text, FeedbackScore.user_id)
+                .filter(FeedbackScore.id > after_id).order_by(FeedbackScore.id).limit(chunk_size).all())
+        if not rows:
+            return total
+        after_id = rows[-1].id
+        # Score không có aspect nào được giữ thì không có feedback để trả về, không cần vector
+        with_feedback = {score_id for score_id, in db.session.query(Feedback.score_id).filter(
+            Feedback.score_id.in_([row.id for row in rows])).distinct()}
+        rows = [row for row in rows if row.id not in done and row.id in with_feedback]
+        if not rows:
+            continue
+        _, scores = engine.analyze_many([row.text for row in rows], with_scores=True)
+        items = [(row.id, row.user_id, score[2]) for row, score in zip(rows, scores)
+                 if score is not None and len(score) > 2 and score[2] is not None]
+        total += append(version, items)
+        print(f"Đã index {total} feedback (tới id {after_id})", flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bổ sung embedding cho feedback chưa có trong index")
+    parser.add_argument('--backfill', action='store_true', help="Chạy model cho các feedback_scores chưa có vector")
+    parser.add_argument('--reset', action='store_true', help="Xoá index hiện có trước khi backfill")
+    parser.add_argument('--socket', default=None, help="Dùng inference service đang chạy thay vì load model")
+    parser.add_argument('--chunk-size', type=int, default=BACKFILL_CHUNK)
+    args = parser.parse_args(argv)
+
+    if args.reset:
+        reset()
+    if not args.backfill:
+        return 0
+
+    from redecide import create_app
+    if args.socket:
+        from inference_service import InferenceClient
+        engine = InferenceClient(args.socket)
+    else:
+        import model_registry
+        engine = model_registry.load_active_engine()
+    if not engine.is_ready:
+        print("Model chưa load được", file=sys.stderr)
+        return 1
+    app = create_app()
+    with app.app_context():
+        total = backfill(engine, args.chunk_size)
+    print(f"Xong: {total} feedback được thêm vào index {engine.model_version}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,221 @@
+"""Tokenizer PhoBERT chạy bằng thư viện `tokenizers` (Rust) thay cho BPE thuần Python
+
+PhoBERT chỉ có tokenizer "slow" (fastBPE: vocab.txt + bpe.codes, token chưa hết
+từ mang hậu tố "@@"). build_fast_tokenizer chuyển đúng vocab/merges của tokenizer
+slow đã load sang một BPE model của `tokenizers`:
+
+  - tách từ theo regex \\S+\\n? giống PhobertTokenizer._tokenize
+  - symbol cuối từ mang "</w>" (token "x" của PhoBERT), symbol giữa từ là "x@@"
+  - symbol sinh ra từ merges nhưng không có trong vocab PhoBERT được đánh id tạm
+    (>= len(vocab)) rồi map về <unk> sau khi encode, giống tokenizer slow
+
+Trước khi dùng, load_tokenizer so sánh id của hai tokenizer trên
+tokenizer_parity_corpus.txt (có dấu, không dấu, hoa/thường, NFD, xuống dòng) và
+chỉ bật bản fast khi giống hệt. Kết quả được lưu trong instance/tokenizer_parity/
+theo hash của vocab/merges, corpus, prompt và code dựng bản fast: chỉ process
+đầu tiên sau khi một trong số đó đổi mới phải chạy kiểm tra (vài nghìn lượt
+encode bằng bản slow), các worker khởi động sau đọc lại kết quả.
+"""
+
+import os
+import re
+import json
+import hashlib
+import unicodedata
+from typing import Optional
+
+import tokenizers
+import transformers
+from tokenizers import Tokenizer, Regex, models, pre_tokenizers, processors
+from transformers import AutoTokenizer, PreTrainedTokenizerFast
+
+import coordination
+
+PARITY_CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tokenizer_parity_corpus.txt')
+PARITY_STAMP_DIR = os.path.join(os.getcwd(), 'instance', 'tokenizer_parity')
+
+# Khoảng trắng ngoài ASCII: regex \s của Python và của tokenizers có thể hiểu khác nhau
+_EXOTIC_WHITESPACE = r"[^\S \t\n\r\x0b\x0c]"
+
+
+class PhobertTokenizerFast(PreTrainedTokenizerFast):
+    """PreTrainedTokenizerFast + map id tạm về <unk>, fallback sang slow cho input đặc biệt"""
+
+    slow_tokenizer = None
+    phobert_vocab_size = None
+    _fallback_pattern = None
+
+    def _needs_slow(self, texts) -> bool:
+        if self._fallback_pattern is None:
+            specials = sorted(self.all_special_tokens, key=len, reverse=True)
+            self._fallback_pattern = re.compile(
+                "|".join([_EXOTIC_WHITESPACE] + [re.escape(token) for token in specials]))
+        search = self._fallback_pattern.search
+        return any(isinstance(text, str) and search(text) for text in texts)
+
+    def _remap_unknown(self, encoding):
+        input_ids = encoding.get("input_ids")
+        if input_ids is None:
+            return encoding
+        limit, unk = self.phobert_vocab_size, self.unk_token_id
+        if hasattr(input_ids, "masked_fill_"):
+            input_ids.masked_fill_(input_ids >= limit, unk)
+        elif input_ids and isinstance(input_ids[0], list):
+            encoding["input_ids"] = [[i if i < limit else unk for i in row] for row in input_ids]
+        else:
+            encoding["input_ids"] = [i if i < limit else unk for i in input_ids]
+        return encoding
+
+    def __call__(self, text=None, text_pair=None, **kwargs):
+        flat = []
+        for value in (text, text_pair):
+            if isinstance(value, (list, tuple)):
+                flat.extend(value)
+            elif value is not None:
+                flat.append(value)
+        if self.slow_tokenizer is not None and self._needs_slow(flat):
+            return self.slow_tokenizer(text, text_pair, **kwargs)
+        return self._remap_unknown(super().__call__(text, text_pair, **kwargs))
+
+
+def build_fast_tokenizer(slow) -> PhobertTokenizerFast:
+    """Chuyển PhobertTokenizer (slow) đã load sang PhobertTokenizerFast"""
+    encoder = slow.get_vocab()
+    phobert_vocab_size = max(encoder.values()) + 1
+    special_tokens = set(slow.all_special_tokens)
+
+    vocab = {}
+    for token, idx in encoder.items():
+        if token in special_tokens:
+            vocab[token] = idx
+        elif token.endswith("@@"):
+            vocab[token[:-2]] = idx
+        else:
+            vocab[token + "</w>"] = idx
+
+    # bpe_ranks: trùng merge thì rank sau cùng thắng (dict(zip(...)) của bản slow)
+    merges = [pair for pair, _ in sorted(slow.bpe_ranks.items(), key=lambda item: item[1])]
+
+    next_id = max(phobert_vocab_size, max(vocab.values()) + 1)
+
+    def ensure(symbol):
+        nonlocal next_id
+        if symbol not in vocab:
+            vocab[symbol] = next_id
+            next_id += 1
+
+    chars = set()
+    for first, second in merges:
+        ensure(first)
+        ensure(second)
+        ensure(first + second)
+    for symbol in list(vocab):
+        if symbol in special_tokens:
+            continue
+        base = symbol[:-4] if symbol.endswith("</w>") else symbol
+        chars.update(base)
+    for ch in chars:
+        ensure(ch)
+        ensure(ch + "</w>")
+
+    tok = Tokenizer(models.BPE(vocab=vocab, merges=merges, unk_token=slow.unk_token,
+                               end_of_word_suffix="</w>"))
+    tok.pre_tokenizer = pre_tokenizers.Split(Regex(r"\S+\n?"), behavior="removed", invert=True)
+    tok.post_processor = processors.TemplateProcessing(
+        single=f"{slow.cls_token} $A {slow.sep_token}",
+        pair=f"{slow.cls_token} $A {slow.sep_token} {slow.sep_token} $B {slow.sep_token}",
+        special_tokens=[(slow.cls_token, slow.cls_token_id), (slow.sep_token, slow.sep_token_id)],
+    )
+    tok.add_special_tokens(sorted(special_tokens))
+
+    fast = PhobertTokenizerFast(
+        tokenizer_object=tok,
+        bos_token=slow.bos_token, eos_token=slow.eos_token, sep_token=slow.sep_token,
+        cls_token=slow.cls_token, unk_token=slow.unk_token, pad_token=slow.pad_token,
+        mask_token=slow.mask_token, model_max_length=slow.model_max_length,
+    )
+    fast.slow_tokenizer = slow
+    fast.phobert_vocab_size = phobert_vocab_size
+    return fast
+
+
+def load_parity_corpus(path: str = PARITY_CORPUS_PATH) -> list:
+    """Đọc corpus kiểm tra (mỗi dòng một feedback, "\\n" được hiểu là xuống dòng)"""
+    if not os.path.exists(path):
+        return []
+    texts = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if not line or line.startswith('#'):
+                continue
+            text = line.replace('\\n', '\n')
+            texts.append(text)
+            # Cùng câu ở dạng tổ hợp (NFD) và viết hoa toàn bộ
+            texts.append(unicodedata.normalize('NFD', text))
+            texts.append(text.upper())
+    return texts
+
+
+def check_parity(slow, fast, texts: list, prompts: list, max_length: int) -> list:
+    """So sánh input_ids của cặp (prompt, text); trả về danh sách (prompt, text) bị lệch"""
+    mismatches = []
+    for prompt in prompts:
+        kwargs = dict(truncation="only_second", max_length=max_length)
+        expected = slow([prompt] * len(texts), texts, **kwargs)["input_ids"]
+        actual = fast([prompt] * len(texts), texts, **kwargs)["input_ids"]
+        for text, a, b in zip(texts, expected, actual):
+            if list(a) != list(b):
+                mismatches.append((prompt, text))
+    for text in texts:
+        if list(slow(text)["input_ids"]) != list(fast(text)["input_ids"]):
+            mismatches.append((None, text))
+    return mismatches
+
+
+def parity_key(slow, texts: list, prompts: list, max_length: int) -> str:
+    """Hash của mọi thứ quyết định kết quả check_parity"""
+    h = hashlib.sha1()
+    h.update(json.dumps(sorted(slow.get_vocab().items()), ensure_ascii=False).encode('utf-8'))
+    h.update(json.dumps(sorted(slow.bpe_ranks.items(), key=lambda item: item[1]), ensure_ascii=False).encode('utf-8'))
+    h.update(json.dumps([texts, prompts, max_length, tokenizers.__version__, transformers.__version__],
+                        ensure_ascii=False).encode('utf-8'))
+    with open(os.path.abspath(__file__), 'rb') as f:
+        h.update(f.read())
+    return h.hexdigest()
+
+
+def cached_parity(slow, fast, texts: list, prompts: list, max_length: int) -> bool:
+    """check_parity chỉ chạy một lần cho mỗi parity_key; trả về True nếu hai tokenizer giống hệt"""
+    path = os.path.join(PARITY_STAMP_DIR, f'{parity_key(slow, texts, prompts, max_length)}.json')
+    # Worker khởi động cùng lúc: một process kiểm tra, các process khác chờ rồi đọc kết quả
+    with coordination.exclusive('tokenizer_parity'):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)['ok']
+        except (OSError, ValueError, KeyError):
+            pass
+        mismatches = check_parity(slow, fast, texts, prompts, max_length)
+        os.makedirs(PARITY_STAMP_DIR, exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'ok': not mismatches, 'mismatches': len(mismatches)}, f)
+        os.replace(tmp_path, path)
+        return not mismatches
+
+
+def load_tokenizer(repo: str, max_length: int, prompts: Optional[list] = None, revision: str = "main"):
+    """Load tokenizer slow, dựng bản fast và chỉ dùng bản fast khi parity đạt trên corpus"""
+    slow = AutoTokenizer.from_pretrained(repo, use_fast=False, revision=revision)
+    if os.getenv('FAST_TOKENIZER', 'True').lower() != 'true':
+        return slow
+    try:
+        fast = build_fast_tokenizer(slow)
+        texts = load_parity_corpus()
+        if texts and not cached_parity(slow, fast, texts, prompts or [""], max_length):
+            print("[tokenizer] Fast tokenizer lệch với bản slow trên parity corpus, dùng bản slow.", flush=True)
+            return slow
+        return fast
+    except Exception as e:
+        print(f"[tokenizer] Không dựng được fast tokenizer ({e}), dùng bản slow.", flush=True)
+        return slow
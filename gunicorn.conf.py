@@ -0,0 +1,8 @@
+"""Gunicorn config: gán index cho từng worker để runtime_config chia CPU affinity"""
+
+import os
+
+
+def post_fork(server, worker):
+    # worker.age tăng dần mỗi lần spawn; lấy modulo để worker mới thay vào slot cũ
+    os.environ['INFERENCE_WORKER_INDEX'] = str((worker.age - 1) % max(1, server.num_workers))
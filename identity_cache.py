@@ -0,0 +1,129 @@
+"""Cache user đã đăng nhập trong process: bỏ query users ở mỗi request @login_required
+
+Flask-Login gọi user_loader ở mọi request có session (mỗi /predict, mỗi trang
+lịch sử), trước đây là một lần User.query.get trên cùng file SQLite mà các lượt
+ghi feedback đang dùng. IdentityCache giữ bản chụp (CachedUser: id, username,
+is_admin, created_at) tối đa USER_CACHE_SIZE user, mỗi bản sống USER_CACHE_TTL
+giây. CachedUser không gắn với session SQLAlchemy nào nên dùng chung được giữa
+các thread; code chỉ cần current_user.id/username/is_admin như trước.
+
+Invalidate: mọi UPDATE/DELETE bảng users qua ORM (đổi quyền admin, đổi mật
+khẩu...) được ghi nhận lúc flush, và chỉ khi transaction commit mới xoá cache +
+coordination.mark('user_changes') (xoá lúc flush thì request khác vẫn đọc được
+bản cũ đã commit rồi cache lại; rollback thì không cần xoá). Các worker khác
+thấy dấu này ở lần tra tiếp theo (một lần stat file) và xoá cache của mình.
+Lượt load bắt đầu trước khi cache bị xoá không được ghi vào cache. Restore
+database cũng xoá cache. TTL giới hạn thời gian cũ tối đa cho các thay đổi
+không qua ORM.
+
+Metrics: feedback_identity_cache_lookups_total{result="hit"} là số query users
+đã tiết kiệm được.
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+
+from flask_login import UserMixin
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+import coordination
+import metrics
+from models import User
+
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '60'))
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '1024'))
+_CHANGED_KEY = 'identity_cache_users_changed'
+
+
+class CachedUser(UserMixin):
+    def __init__(self, id, username, is_admin, created_at=None):
+        """Bản chụp các cột của users cần cho request (không phải ORM object)"""
+        self.id = id
+        self.username = username
+        self.is_admin = bool(is_admin)
+        self.created_at = created_at
+
+    @classmethod
+    def from_model(cls, user) -> "CachedUser":
+        return cls(user.id, user.username, user.is_admin, user.created_at)
+
+    def __repr__(self):
+        return f'<User {self.username}>'
+
+
+class IdentityCache:
+    def __init__(self, ttl: float = USER_CACHE_TTL, max_size: int = USER_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max(1, max_size)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._seen = coordination.last_marked('user_changes')
+        # Tăng mỗi lần xoá cache: kết quả load bắt đầu trước đó có thể đã cũ
+        self._generation = 0
+
+    def get(self, user_id: int, load):
+        """CachedUser của user_id; hết hạn/chưa có thì gọi load(user_id) (trả về CachedUser hoặc None)"""
+        marked = coordination.last_marked('user_changes')
+        now = time.monotonic()
+        with self._lock:
+            if marked > self._seen:
+                self._entries.clear()
+                self._generation += 1
+                self._seen = marked
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                metrics.IDENTITY_CACHE_LOOKUPS.inc(result='hit')
+                return entry[1]
+            generation = self._generation
+
+        metrics.IDENTITY_CACHE_LOOKUPS.inc(result='miss')
+        user = load(user_id)
+        # User không tồn tại không được cache: đăng ký lại cùng id phải thấy ngay
+        if user is not None and self.ttl > 0:
+            with self._lock:
+                if generation != self._generation:
+                    return user
+                self._entries[user_id] = (now + self.ttl, user)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return user
+
+    def clear(self):
+        """Xoá cache của process này (vd. sau khi restore database)"""
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+    def invalidate(self):
+        """Xoá cache ở mọi worker (user vừa bị sửa/xoá)"""
+        self.clear()
+        coordination.mark('user_changes')
+
+
+cache = IdentityCache()
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _user_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is None:
+        cache.invalidate()
+        return
+    session.info[_CHANGED_KEY] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    if session.info.pop(_CHANGED_KEY, False):
+        cache.invalidate()
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_on_rollback(session, previous_transaction):
+    session.info.pop(_CHANGED_KEY, None)
@@ -0,0 +1,220 @@
+"""Inference engine cho PhoBERT Pair-ABSA (tokenizer + model + hậu xử lý)"""
+
+import os
+import json
+import hashlib
+import torch
+import metrics
+import segmentation
+from fast_tokenizer import load_tokenizer
+from PhoBERTPairABSA import PhoBERTPairABSA
+from decision import decide_batch, decision_to_results
+from score_store import pack_probs, pack_keyword_masks, pack_embeddings
+from model_config import (
+    get_prompt, ASPECTS_EN, MAX_LEN, ASPECT_PROMPTS, SUBTOPIC_KW,
+    _is_garbage, _aspect_has_kw, _norm_match, ASPECT_REVERSE_MAPPING,
+    BASE_MODEL, NUM_CLASSES, DROPOUT
+)
+
+MODEL_REPO = "Ptul2x5/Student_Feedback_Sentiment"
+# Revision (branch/tag/commit) của MODEL_REPO cần load
+MODEL_REVISION = os.getenv('MODEL_REVISION', 'main')
+# Số cặp (prompt, feedback) trong một lượt forward
+INFERENCE_BATCH_SIZE = int(os.getenv('INFERENCE_BATCH_SIZE', '32'))
+
+
+def model_version(revision: str = MODEL_REVISION) -> str:
+    """Phiên bản kết quả phân tích: revision model + fingerprint của ASPECT_PROMPTS/SUBTOPIC_KW
+
+    Đổi model, sửa prompt/keyword hoặc bật tách câu (SEGMENTATION) đều cho ra version
+    mới, rescore.py dựa vào đó để biết feedback nào cần chấm lại.
+    """
+    fingerprint = [ASPECT_PROMPTS, SUBTOPIC_KW, MAX_LEN]
+    if segmentation.SEGMENTATION_ENABLED:
+        fingerprint.append(segmentation.config())
+    config = json.dumps(fingerprint, sort_keys=True, default=sorted, ensure_ascii=False)
+    return f"{revision}+{hashlib.sha1(config.encode('utf-8')).hexdigest()[:10]}"
+
+
+def load_prompt_tokenizer(repo: str = MODEL_REPO, revision: str = MODEL_REVISION):
+    os.environ['HF_HUB_ENABLE_HF_TRANSFER'] = '0'
+    prompts = [p for sub in ASPECT_PROMPTS.values() for p in sub.values()]
+    return load_tokenizer(repo, MAX_LEN, prompts=prompts, revision=revision)
+
+
+def build_model(loaded, device):
+    """PhoBERTPairABSA ở chế độ eval từ state dict (hoặc checkpoint {"model_state": ...})"""
+    if isinstance(loaded, dict) and "model_state" in loaded:
+        state_dict = loaded["model_state"]
+    else:
+        state_dict = loaded
+    model = PhoBERTPairABSA(base_model=BASE_MODEL, num_cls=NUM_CLASSES, dropout=DROPOUT)
+    model.load_state_dict(state_dict, strict=False)
+    model.to(device)
+    model.eval()
+    return model
+
+
+def get_device():
+    return torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+
+class InferenceEngine:
+    def __init__(self, tokenizer=None, model=None, device=None, batch_size: int = INFERENCE_BATCH_SIZE,
+                 version: str = None, segment: bool = None):
+        """Giữ tokenizer + model đã load; có thể dùng chung giữa các thread/process"""
+        self.segment = segmentation.SEGMENTATION_ENABLED if segment is None else segment
+        self.tokenizer = tokenizer
+        self.model = model
+        self.device = device or get_device()
+        self.batch_size = max(1, batch_size)
+        self.model_version = version or model_version()
+
+    @classmethod
+    def from_pretrained(cls, repo: str = MODEL_REPO, device=None, revision: str = MODEL_REVISION) -> "InferenceEngine":
+        """Load tokenizer + checkpoint từ Hugging Face Hub (trả về engine rỗng nếu lỗi)"""
+        device = device or get_device()
+        version = model_version(revision)
+        try:
+            tokenizer = load_prompt_tokenizer(repo, revision)
+            model_url = f"https://huggingface.co/{repo}/resolve/{revision}/model.bin"
+            model = build_model(torch.hub.load_state_dict_from_url(model_url, map_location=device), device)
+        except Exception:
+            return cls(None, None, device, version=version)
+        return cls(tokenizer, model, device, version=version)
+
+    @classmethod
+    def from_checkpoint(cls, path: str, revision: str, tokenizer=None, device=None) -> "InferenceEngine":
+        """Load checkpoint local (model_registry.py); dùng lại tokenizer nếu được truyền vào
+
+        Khác from_pretrained: lỗi được raise ra để người gọi báo lý do.
+        """
+        device = device or get_device()
+        tokenizer = tokenizer or load_prompt_tokenizer(MODEL_REPO, MODEL_REVISION)
+        model = build_model(torch.load(path, map_location=device, weights_only=True), device)
+        return cls(tokenizer, model, device, version=model_version(revision))
+
+    @property
+    def is_ready(self) -> bool:
+        return self.tokenizer is not None and self.model is not None
+
+    def analyze(self, text, with_scores: bool = False):
+        """Phân tích feedback với model Pair-ABSA"""
+        if with_scores:
+            results, scores = self.analyze_many([text], with_scores=True)
+            return results[0], scores[0]
+        return self.analyze_many([text])[0]
+
+    def analyze_many(self, texts, with_scores: bool = False):
+        """Phân tích nhiều feedback trong một lượt batch, trả về list kết quả theo đúng thứ tự
+
+        with_scores=True trả thêm list score (blob xác suất float16, bitmask keyword,
+        blob embedding float16) cho từng feedback, None với feedback bị lọc (garbage)
+        hoặc khi model chưa load.
+        Khi bật tách câu, feedback dài được chạy theo từng mảnh rồi gộp (segmentation.py).
+        """
+        texts = [str(text).strip() for text in texts]
+        results = [[] for _ in texts]
+        scores = [None for _ in texts]
+        if not self.is_ready:
+            return (results, scores) if with_scores else results
+
+        valid = []
+        for i, text in enumerate(texts):
+            if _is_garbage(text):
+                metrics.GARBAGE_FILTERED.inc(route=metrics.current_route())
+            else:
+                valid.append(i)
+        if not valid:
+            return (results, scores) if with_scores else results
+
+        valid_texts = [texts[i] for i in valid]
+        owner = list(range(len(valid)))
+        if self.segment:
+            valid_texts, owner = segmentation.expand(valid_texts)
+        with metrics.time_stage('tokenization'):
+            features, has_keywords = self.encode(valid_texts)
+        with metrics.time_stage('forward'):
+            if with_scores:
+                probs, embeddings = self.forward(features, with_embeddings=True)
+            else:
+                probs = self.forward(features)
+        with metrics.time_stage('post_processing'):
+            probs, has_keywords = segmentation.merge_segment_probs(probs, has_keywords, owner, len(valid))
+            batch_results = self.decide(probs, has_keywords)
+            if with_scores:
+                embeddings = self.pool_embeddings(embeddings, owner, len(valid))
+                batch_scores = list(zip(pack_probs(probs), pack_keyword_masks(has_keywords),
+                                        pack_embeddings(embeddings)))
+
+        for n, i in enumerate(valid):
+            results[i] = batch_results[n]
+            if with_scores:
+                scores[i] = batch_scores[n]
+        return (results, scores) if with_scores else results
+
+    def encode(self, texts):
+        """Tokenize cặp (prompt, text) cho mọi (feedback, aspect) + đánh dấu aspect có keyword"""
+        prompts, pair_texts, has_keywords = [], [], []
+        for text in texts:
+            s_norm = _norm_match(text)
+            row_kw = []
+            for aspect_en in ASPECTS_EN:
+                aspect_vi = ASPECT_REVERSE_MAPPING.get(aspect_en, "khac")
+                prompts.append(get_prompt(aspect_en, sentence=text, use_subprompt=True))
+                pair_texts.append(text)
+                row_kw.append(_aspect_has_kw(aspect_vi, s_norm))
+            has_keywords.append(row_kw)
+
+        features = self.tokenizer(
+            prompts, pair_texts,
+            truncation="only_second",
+            max_length=MAX_LEN
+        )
+        return features, has_keywords
+
+    def forward(self, features, with_embeddings: bool = False):
+        """Chạy model theo batch (gom các cặp cùng độ dài), trả về probs (N, 4 aspect, 4 class)
+
+        with_embeddings=True trả thêm vector [CLS] của từng cặp: (probs, tensor (N, 4 aspect, hidden))
+        """
+        input_ids = features["input_ids"]
+        attention_mask = features["attention_mask"]
+        order = sorted(range(len(input_ids)), key=lambda k: len(input_ids[k]))
+
+        logits = [None] * len(input_ids)
+        cls_vectors = [None] * len(input_ids)
+        with torch.no_grad():
+            for start in range(0, len(order), self.batch_size):
+                chunk = order[start:start + self.batch_size]
+                padded = self.tokenizer.pad(
+                    {"input_ids": [input_ids[k] for k in chunk],
+                     "attention_mask": [attention_mask[k] for k in chunk]},
+                    return_tensors="pt"
+                ).to(self.device)
+                if with_embeddings:
+                    out, cls = self.model(padded["input_ids"], padded["attention_mask"], return_embedding=True)
+                    for k, row in zip(chunk, cls):
+                        cls_vectors[k] = row
+                else:
+                    out = self.model(padded["input_ids"], padded["attention_mask"])
+                for k, row in zip(chunk, out):
+                    logits[k] = row
+
+        logits_tensor = torch.stack(logits, dim=0).view(-1, len(ASPECTS_EN), NUM_CLASSES)
+        probs = torch.softmax(logits_tensor, dim=-1)
+        if with_embeddings:
+            return probs, torch.stack(cls_vectors, dim=0).view(len(probs), len(ASPECTS_EN), -1)
+        return probs
+
+    def pool_embeddings(self, cls_vectors, owner: list, count: int):
+        """(S mảnh, 4 aspect, hidden) -> (count, hidden): trung bình các aspect và các mảnh của mỗi feedback, chuẩn hoá L2"""
+        pooled = cls_vectors.float().mean(dim=1)
+        if len(owner) != count:
+            index = torch.as_tensor(owner, device=pooled.device)
+            pooled = torch.zeros((count, pooled.shape[1]), device=pooled.device).index_add_(0, index, pooled)
+        return torch.nn.functional.normalize(pooled, dim=-1)
+
+    def decide(self, probs, has_keywords):
+        """Áp dụng threshold/keyword/margin (vector hoá) lên probs (N, 4, 4)"""
+        return decision_to_results(decide_batch(probs, has_keywords))
@@ -0,0 +1,104 @@
+"""Engine cho web tier mà không import torch/transformers lúc import app.py
+
+app.py chỉ dùng giao diện chung của engine: is_ready, model_version,
+analyze/analyze_many. create_engine() chọn cách chạy model:
+
+  - INFERENCE_SOCKET: InferenceClient, model chạy trong inference_service.py,
+    web worker không bao giờ import torch.
+  - LOAD_MODEL=False: NullEngine (benchmark, bảo trì, backup), không có model.
+  - còn lại: LocalEngine, import inference + load model trong thread nền. Trang
+    web/DB phục vụ ngay khi worker khởi động; trong lúc model đang load,
+    /predict trả 503 kèm Retry-After thay vì chặn worker.
+
+Các module nặng (inference, model_registry, torch) chỉ được import trong
+thread load của LocalEngine.
+"""
+
+import threading
+
+from inference_service import InferenceClient
+from runtime_config import apply_cpu_affinity
+
+# Retry-After (giây) gợi ý cho client khi model đang load
+MODEL_LOADING_RETRY_AFTER = 10
+
+
+def _empty(texts, with_scores: bool):
+    results = [[] for _ in texts]
+    return (results, [None for _ in texts]) if with_scores else results
+
+
+class NullEngine:
+    """Không có model: mọi phân tích trả kết quả rỗng"""
+    is_ready = False
+    loading = False
+    model_version = None
+
+    def analyze(self, text, with_scores: bool = False):
+        return ([], None) if with_scores else []
+
+    def analyze_many(self, texts, with_scores: bool = False):
+        return _empty(list(texts), with_scores)
+
+
+class LocalEngine:
+    def __init__(self):
+        """Load model trong process này (thread nền); các thuộc tính khác chuyển tiếp tới InferenceEngine"""
+        self.engine = None
+        self.error = None
+        # Affinity đặt ở thread chính để mọi thread request tạo sau kế thừa
+        apply_cpu_affinity()
+        self._thread = threading.Thread(target=self._load, name='model-load', daemon=True)
+        self._thread.start()
+
+    def _load(self):
+        try:
+            import model_registry
+            from runtime_config import configure_torch_threads
+            configure_torch_threads(label="web")
+            # Version đang chọn trong registry local, chưa có thì từ Hugging Face Hub
+            self.engine = model_registry.load_active_engine()
+        except Exception as e:
+            self.error = str(e)
+
+    @property
+    def loading(self) -> bool:
+        return self._thread.is_alive()
+
+    def wait(self, timeout: float = None) -> bool:
+        """Chờ load xong (dùng cho script/CLI); trả về is_ready"""
+        self._thread.join(timeout)
+        return self.is_ready
+
+    @property
+    def is_ready(self) -> bool:
+        return self.engine is not None and self.engine.is_ready
+
+    @property
+    def model_version(self):
+        return self.engine.model_version if self.engine is not None else None
+
+    def analyze(self, text, with_scores: bool = False):
+        if self.engine is None:
+            return ([], None) if with_scores else []
+        return self.engine.analyze(text, with_scores=with_scores)
+
+    def analyze_many(self, texts, with_scores: bool = False):
+        if self.engine is None:
+            return _empty(list(texts), with_scores)
+        return self.engine.analyze_many(texts, with_scores=with_scores)
+
+    def __getattr__(self, name):
+        # tokenizer, model, device... (model_registry dùng lại tokenizer khi đổi model)
+        engine = self.__dict__.get('engine')
+        if engine is None:
+            raise AttributeError(name)
+        return getattr(engine, name)
+
+
+def create_engine(inference_socket: str = None, load_model: bool = True):
+    if inference_socket:
+        return InferenceClient(inference_socket)
+    if not load_model:
+        return NullEngine()
+    return LocalEngine()
@@ -0,0 +1,264 @@
+"""Local inference service: N worker process dùng chung model weights
+
+Process cha load model một lần rồi fork các worker; tensor weights được chia sẻ
+copy-on-write nên RAM không tăng theo số worker. Các worker cùng accept() trên
+một UNIX socket (kiểu pre-fork như gunicorn), kernel tự phân phối kết nối cho
+worker đang rảnh. Flask app gửi job qua InferenceClient và chờ kết quả.
+
+Chạy:  python inference_service.py --workers 4 --threads 2
+Rồi đặt INFERENCE_SOCKET=instance/inference.sock cho web app.
+"""
+
+import os
+import gc
+import sys
+import time
+import signal
+import socket
+import argparse
+import multiprocessing as mp
+from multiprocessing.connection import (Listener, Client, Connection, AuthenticationError, answer_challenge,
+                                        deliver_challenge)
+from typing import Optional
+import metrics
+from runtime_config import load_thread_config, configure_torch_threads
+
+DEFAULT_SOCKET = os.path.join(os.getcwd(), 'instance', 'inference.sock')
+DEFAULT_TIMEOUT = float(os.getenv('INFERENCE_TIMEOUT', '60'))
+# Kết quả ping được dùng lại trong khoảng này (is_ready được gọi mỗi request)
+READY_CACHE_SECONDS = float(os.getenv('INFERENCE_READY_CACHE', '2'))
+# Ping không chờ theo INFERENCE_TIMEOUT: mọi worker bận quá khoảng này thì coi là bận (vẫn sẵn sàng)
+PING_TIMEOUT = float(os.getenv('INFERENCE_PING_TIMEOUT', '1'))
+# Retry-After (giây) khi socket còn nhưng service không trả lời (đang khởi động lại/đã chết)
+UNAVAILABLE_RETRY_AFTER = 5
+
+
+def _authkey() -> bytes:
+    return os.getenv('INFERENCE_AUTHKEY', 'feedback-inference').encode('utf-8')
+
+
+class InferenceServiceError(RuntimeError):
+    """Lỗi khi gọi inference service (không kết nối được, timeout, lỗi worker)"""
+
+
+class InferenceUnavailable(InferenceServiceError):
+    """Không kết nối được service (socket cũ của service đã chết, service đang khởi động lại)"""
+
+
+class InferenceClient:
+    def __init__(self, address: str = DEFAULT_SOCKET, timeout: float = DEFAULT_TIMEOUT):
+        """Client gửi job tới inference service qua UNIX socket"""
+        self.address = address
+        self.timeout = timeout
+        self._model_version = None
+        self._ready = (0.0, False)  # (time.monotonic lúc kiểm tra, kết quả ping)
+
+    def _check(self) -> bool:
+        checked_at, ready = self._ready
+        if time.monotonic() - checked_at < READY_CACHE_SECONDS:
+            return ready
+        # Bận (None) không phải là không sẵn sàng: request sẽ xếp hàng như bình thường
+        ready = self.ping() is not False
+        self._ready = (time.monotonic(), ready)
+        return ready
+
+    @property
+    def is_ready(self) -> bool:
+        # File socket có thể còn sót lại khi service crash: phải ping được mới coi là sẵn sàng
+        return os.path.exists(self.address) and self._check()
+
+    @property
+    def unavailable(self) -> bool:
+        """Socket còn nhưng service không trả lời: route trả 503 + Retry-After thay vì lỗi model"""
+        return os.path.exists(self.address) and not self._check()
+
+    def _call(self, op: str, payload=None):
+        try:
+            conn = Client(self.address, family='AF_UNIX', authkey=_authkey())
+        except (OSError, EOFError) as e:
+            self._ready = (time.monotonic(), False)
+            raise InferenceUnavailable(f"Không kết nối được inference service: {e}")
+        try:
+            conn.send((op, payload))
+            if not conn.poll(self.timeout):
+                raise InferenceServiceError("Inference service timeout")
+            status, result = conn.recv()
+        except (OSError, EOFError) as e:
+            raise InferenceServiceError(f"Mất kết nối inference service: {e}")
+        finally:
+            conn.close()
+        if status != 'ok':
+            raise InferenceServiceError(result)
+        return result
+
+    def ping(self, timeout: float = PING_TIMEOUT):
+        """True: service trả lời; None: mọi worker đang bận (quá timeout); False: không kết nối được
+
+        Client() chờ handshake authkey không giới hạn (worker chỉ bắt tay khi accept),
+        nên ping tự kết nối và bắt tay với timeout riêng.
+        """
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(self.address)
+        except socket.timeout:
+            sock.close()
+            return None  # backlog đầy
+        except OSError:
+            sock.close()
+            return False
+        sock.setblocking(True)
+        conn = Connection(sock.detach())
+        try:
+            if not conn.poll(timeout):
+                return None
+            answer_challenge(conn, _authkey())
+            deliver_challenge(conn, _authkey())
+            conn.send(('ping', None))
+            if not conn.poll(timeout):
+                return None
+            status, result = conn.recv()
+            return status == 'ok' and bool(result)
+        except (OSError, EOFError, AuthenticationError):
+            return False
+        finally:
+            conn.close()
+
+    @property
+    def model_version(self):
+        """Version của model đang chạy trong service (None nếu chưa kết nối được)"""
+        if self._model_version is None:
+            try:
+                self._model_version = self._call('model_version')
+            except InferenceServiceError:
+                return None
+        return self._model_version
+
+    def analyze(self, text, with_scores: bool = False):
+        if with_scores:
+            results, scores = self.analyze_many([text], with_scores=True)
+            return results[0], scores[0]
+        return self.analyze_many([text])[0]
+
+    def analyze_many(self, texts, with_scores: bool = False):
+        op = 'analyze_many_scored' if with_scores else 'analyze_many'
+        with metrics.time_stage('inference_remote'):
+            return self._call(op, list(texts))
+
+
+def _handle(engine, op, payload):
+    if op == 'ping':
+        return engine.is_ready
+    if op == 'model_version':
+        return engine.model_version
+    if op == 'analyze_many':
+        return engine.analyze_many(payload)
+    if op == 'analyze_many_scored':
+        return engine.analyze_many(payload, with_scores=True)
+    raise ValueError(f"Unknown op: {op}")
+
+
+def _worker_main(listener, engine, thread_config: dict, slot: int):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    configure_torch_threads(worker_index=slot, config=thread_config, label=f"inference-worker-{slot}")
+
+    while True:
+        try:
+            conn = listener.accept()
+        except Exception:
+            # Client bỏ kết nối giữa chừng hoặc sai authkey
+            continue
+        try:
+            op, payload = conn.recv()
+            try:
+                conn.send(('ok', _handle(engine, op, payload)))
+            except Exception as e:
+                conn.send(('error', str(e)))
+        except Exception:
+            pass
+        finally:
+            conn.close()
+
+
+def serve(socket_path: str = DEFAULT_SOCKET, num_workers: int = 2, num_threads: Optional[int] = None,
+          engine=None):
+    """Load model, fork num_workers worker và giám sát (tự khởi động lại worker chết)"""
+    import torch
+    import model_registry
+
+    thread_config = load_thread_config()
+    if num_threads:
+        thread_config['num_threads'] = num_threads
+    if not thread_config['num_threads']:
+        # Mặc định chia đều core cho các worker để tránh oversubscription
+        thread_config['num_threads'] = max(1, (os.cpu_count() or 1) // max(1, num_workers))
+
+    # Không để process cha khởi tạo OpenMP thread pool trước khi fork
+    torch.set_num_threads(1)
+    engine = engine or model_registry.load_active_engine()
+    if not engine.is_ready:
+        print("Không load được model, dừng inference service.", file=sys.stderr)
+        return 1
+
+    os.makedirs(os.path.dirname(socket_path) or '.', exist_ok=True)
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    listener = Listener(socket_path, family='AF_UNIX', backlog=128, authkey=_authkey())
+
+    # Đưa các object đã tồn tại vào generation cố định để GC không chạm vào
+    # (và làm bẩn) các page dùng chung sau khi fork
+    gc.collect()
+    gc.freeze()
+
+    ctx = mp.get_context('fork')
+    workers = {}
+
+    def spawn(slot):
+        proc = ctx.Process(target=_worker_main, args=(listener, engine, thread_config, slot),
+                           name=f"inference-worker-{slot}", daemon=True)
+        proc.start()
+        workers[slot] = proc
+
+    for slot in range(num_workers):
+        spawn(slot)
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    print(f"Inference service: {num_workers} worker x {thread_config['num_threads']} thread trên {socket_path}")
+    try:
+        while not stopping:
+            for slot, proc in list(workers.items()):
+                if not proc.is_alive():
+                    spawn(slot)
+            time.sleep(1)
+    finally:
+        for proc in workers.values():
+            proc.terminate()
+        for proc in workers.values():
+            proc.join(timeout=5)
+        listener.close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+    return 0
+
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description="Local multi-process inference service")
+    parser.add_argument('--socket', default=os.getenv('INFERENCE_SOCKET', DEFAULT_SOCKET))
+    parser.add_argument('--workers', type=int, default=int(os.getenv('INFERENCE_WORKERS', '2')))
+    parser.add_argument('--threads', type=int, default=None,
+                        help="Số intra-op thread mỗi worker (mặc định: TORCH_NUM_THREADS hoặc số core / số worker)")
+    args = parser.parse_args(argv)
+    return serve(args.socket, args.workers, args.threads)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
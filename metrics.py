@@ -0,0 +1,387 @@
+"""Metrics nhẹ theo định dạng Prometheus (counter + histogram) cho web app và inference
+
+Không phụ thuộc thư viện ngoài. Mỗi process giữ registry riêng trong RAM; mỗi
+lần observe chỉ tốn một lần lấy lock + cập nhật vài số nguyên.
+Route hiện tại được lưu trong contextvar để các stage sâu bên trong
+(tokenization, forward...) tự gắn label route mà không cần truyền tham số.
+
+Nhiều process (gunicorn worker, worker của inference_service.py): mỗi process
+ghi snapshot registry của mình ra METRICS_DIR/<pid>.json (thread nền, tối đa
+mỗi METRICS_FLUSH_INTERVAL giây, chỉ khi có thay đổi). /metrics cộng dồn mọi
+file nên mỗi lần scrape thấy tổng của cả hệ thống dù worker nào trả lời; file
+của process đã chết được gộp vào archive.json để counter không bị giảm.
+METRICS_MULTIPROCESS=False: chỉ trả metrics của process trả lời như trước.
+"""
+
+import os
+import glob
+import json
+import time
+import atexit
+import bisect
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import coordination
+
+METRICS_MULTIPROCESS = os.getenv('METRICS_MULTIPROCESS', 'True').lower() == 'true'
+METRICS_DIR = os.getenv('METRICS_DIR')  # mặc định instance/metrics của thư mục làm việc lúc ghi lần đầu
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '1'))
+_ARCHIVE = 'archive.json'
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_current_route = ContextVar('metrics_route', default='none')
+
+
+def set_route(route: str):
+    """Gắn route cho request hiện tại; trả về token để reset_route ở teardown"""
+    return _current_route.set(route)
+
+
+def reset_route(token):
+    try:
+        _current_route.reset(token)
+    except ValueError:
+        # Token tạo ở context khác (teardown chạy ngoài context của before_request)
+        _current_route.set('none')
+
+
+def current_route() -> str:
+    return _current_route.get()
+
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, '')) for name in labelnames)
+
+
+def _format_labels(labelnames, key, extra=None):
+    pairs = list(zip(labelnames, key))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    body = ','.join(f'{name}="{_escape(value)}"' for name, value in pairs)
+    return '{' + body + '}'
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        _changed()
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(self.labelnames, labels), 0)
+
+    def reset(self):
+        with self._lock:
+            self._values = {}
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def merge(self, total: dict, snapshot: list):
+        """Cộng snapshot (của process khác) vào total {label key: value}"""
+        for key, value in snapshot:
+            key = tuple(key)
+            total[key] = total.get(key, 0) + value
+
+    def render(self, values: dict = None) -> list:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        if values is None:
+            with self._lock:
+                values = dict(self._values)
+        for key, value in sorted(values.items()):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(self.labelnames, labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # [count theo từng bucket (+Inf ở cuối), tổng, số lần]
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][idx] += 1
+            series[1] += value
+            series[2] += 1
+        _changed()
+
+    def reset(self):
+        with self._lock:
+            self._series = {}
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return [[list(key), list(s[0]), s[1], s[2]] for key, s in self._series.items()]
+
+    def merge(self, total: dict, snapshot: list):
+        """Cộng snapshot (của process khác) vào total {label key: [counts, tổng, số lần]}"""
+        for key, counts, value_sum, count in snapshot:
+            if len(counts) != len(self.buckets) + 1:
+                continue  # file của version cũ với bucket khác
+            series = total.setdefault(tuple(key), [[0] * (len(self.buckets) + 1), 0.0, 0])
+            series[0] = [a + b for a, b in zip(series[0], counts)]
+            series[1] += value_sum
+            series[2] += count
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self, series: dict = None) -> list:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        if series is None:
+            with self._lock:
+                series = {key: ([*s[0]], s[1], s[2]) for key, s in self._series.items()}
+        for key, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, ("le", le))} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {total}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {count}')
+        return lines
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _read_json(path: str):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path: str, data):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+class Registry:
+    def __init__(self, multiprocess: bool = False, directory: str = None):
+        self._metrics = []
+        self.multiprocess = multiprocess
+        self._directory = directory
+
+    @property
+    def directory(self) -> str:
+        if self._directory is None:
+            self._directory = os.path.join(os.getcwd(), 'instance', 'metrics')
+        return self._directory
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def reset(self):
+        for metric in self._metrics:
+            metric.reset()
+
+    def snapshot(self) -> dict:
+        return {metric.name: metric.snapshot() for metric in self._metrics}
+
+    def _pid_path(self, pid: int) -> str:
+        return os.path.join(self.directory, f'{pid}.json')
+
+    def flush(self):
+        """Ghi snapshot của process này ra file (các process khác đọc khi render)"""
+        os.makedirs(self.directory, exist_ok=True)
+        _write_json(self._pid_path(os.getpid()), self.snapshot())
+
+    def _merge_into(self, total: dict, data: dict):
+        for metric in self._metrics:
+            if data.get(metric.name):
+                metric.merge(total.setdefault(metric.name, {}), data[metric.name])
+
+    def _to_snapshot(self, total: dict) -> dict:
+        """Dạng đã cộng dồn -> dạng snapshot (để ghi archive)"""
+        data = {}
+        for metric in self._metrics:
+            values = total.get(metric.name, {})
+            if isinstance(metric, Histogram):
+                data[metric.name] = [[list(key), list(s[0]), s[1], s[2]] for key, s in values.items()]
+            else:
+                data[metric.name] = [[list(key), value] for key, value in values.items()]
+        return data
+
+    def _archive_locked(self, paths: list):
+        if not paths:
+            return
+        archive_path = os.path.join(self.directory, _ARCHIVE)
+        total = {}
+        self._merge_into(total, _read_json(archive_path) or {})
+        for path in paths:
+            self._merge_into(total, _read_json(path) or {})
+        _write_json(archive_path, self._to_snapshot(total))
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def archive(self, paths: list):
+        """Gộp file của các process đã chết vào archive.json rồi xoá"""
+        with coordination.exclusive('metrics'):
+            self._archive_locked(paths)
+
+    def collect(self) -> dict:
+        """{tên metric: giá trị đã cộng dồn} của mọi process (kể cả đã chết)"""
+        self.flush()
+        total = {}
+        # Giữ lock để không đọc trùng/thiếu file đang được process khác gộp vào archive
+        with coordination.exclusive('metrics'):
+            paths = glob.glob(os.path.join(self.directory, '[0-9]*.json'))
+            dead = [path for path in paths if not _pid_alive(int(os.path.basename(path)[:-5]))]
+            self._archive_locked(dead)
+            for path in [os.path.join(self.directory, _ARCHIVE)] + [p for p in paths if p not in dead]:
+                self._merge_into(total, _read_json(path) or {})
+        return total
+
+    def render(self) -> str:
+        total = self.collect() if self.multiprocess else None
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render(total.get(metric.name, {}) if total is not None else None))
+        return '\n'.join(lines) + '\n'
+
+
+class _Flusher:
+    def __init__(self, registry: Registry):
+        """Thread nền ghi snapshot mỗi METRICS_FLUSH_INTERVAL giây nếu có metric thay đổi"""
+        self.registry = registry
+        self.dirty = False
+        self.started = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self.started:
+                return
+            self.started = True
+            # File trùng pid còn lại của process cũ đã chết (pid bị dùng lại): gộp vào archive trước
+            own = self.registry._pid_path(os.getpid())
+            if os.path.exists(own):
+                self.registry.archive([own])
+            threading.Thread(target=self._run, name='metrics-flush', daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(METRICS_FLUSH_INTERVAL)
+            self.flush()
+
+    def flush(self):
+        if not self.dirty:
+            return
+        self.dirty = False
+        try:
+            self.registry.flush()
+        except OSError:
+            self.dirty = True
+
+    def after_fork(self):
+        # Process con không có thread flush của cha, và không được đếm lại số liệu của cha
+        self.started = False
+        self.dirty = False
+        self._lock = threading.Lock()
+        self.registry.reset()
+
+
+REGISTRY = Registry(METRICS_MULTIPROCESS, METRICS_DIR)
+_flusher = _Flusher(REGISTRY) if METRICS_MULTIPROCESS else None
+if _flusher is not None:
+    os.register_at_fork(after_in_child=_flusher.after_fork)
+    atexit.register(_flusher.flush)
+
+
+def _changed():
+    if _flusher is not None:
+        _flusher.dirty = True
+        if not _flusher.started:
+            _flusher.start()
+
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'feedback_request_duration_seconds', 'Thời gian xử lý request theo route', ('route', 'status')))
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'feedback_stage_duration_seconds',
+    'Thời gian từng stage (tokenization, forward, post_processing, db_commit, db_query, backup)',
+    ('route', 'stage')))
+CACHE_HITS = REGISTRY.register(Counter(
+    'feedback_cache_hits_total', 'Số feedback dùng lại kết quả phân tích thay vì chạy model', ('route',)))
+GARBAGE_FILTERED = REGISTRY.register(Counter(
+    'feedback_garbage_filtered_total', 'Số input bị _is_garbage loại trước khi chạy model', ('route',)))
+MODEL_UNAVAILABLE = REGISTRY.register(Counter(
+    'feedback_model_unavailable_total', 'Số request gặp lỗi model/tokenizer chưa load', ('route',)))
+DB_ERRORS = REGISTRY.register(Counter(
+    'feedback_db_errors_total', 'Số lỗi ghi database bị bỏ qua', ('route',)))
+NEAR_DUP_COLLAPSED = REGISTRY.register(Counter(
+    'feedback_near_dup_collapsed_total', 'Số text khác nhau dùng chung kết quả vì cùng khoá chuẩn hoá (không chạy model riêng)',
+    ('route',)))
+ADMISSION_REJECTED = REGISTRY.register(Counter(
+    'feedback_admission_rejected_total', 'Số lượt chạy model bị admission control từ chối (queue_full, deadline)',
+    ('route', 'reason')))
+ADMISSION_WAIT_SECONDS = REGISTRY.register(Histogram(
+    'feedback_admission_wait_seconds', 'Thời gian chờ trong hàng đợi admission trước khi chạy model',
+    ('route', 'priority')))
+IDENTITY_CACHE_LOOKUPS = REGISTRY.register(Counter(
+    'feedback_identity_cache_lookups_total',
+    'Số lần tra user đăng nhập qua identity cache (hit = một query bảng users được tiết kiệm)', ('result',)))
+SHADOW_COMPARED = REGISTRY.register(Counter(
+    'feedback_shadow_compared_total', 'Số feedback được chạy lại trên model shadow để so sánh', ('version',)))
+SHADOW_SKIPPED = REGISTRY.register(Counter(
+    'feedback_shadow_skipped_total', 'Số feedback không chạy shadow vì model đang bận (không có slot trống)',
+    ('version',)))
+SHADOW_DISAGREED = REGISTRY.register(Counter(
+    'feedback_shadow_disagreed_total', 'Số feedback model shadow cho kết quả khác model chính (topic, sentiment)',
+    ('version', 'kind')))
+HTTP_CACHE = REGISTRY.register(Counter(
+    'feedback_http_cache_total',
+    'Trang thống kê/lịch sử: not_modified = trả 304, hit = dùng body đã render, miss = query + render lại',
+    ('route', 'result')))
+
+
+def time_stage(stage: str):
+    """Context manager đo thời gian một stage, gắn label route hiện tại"""
+    return STAGE_SECONDS.time(route=current_route(), stage=stage)
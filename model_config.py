@@ -44,6 +44,10 @@ def _norm_match(s: str) -> str:
     s = unicodedata.normalize("NFD", s)
     return "".join(ch for ch in s if unicodedata.category(ch) != "Mn")
 
+def _norm_search(s: str) -> str:
+    """Chuẩn hoá cho full-text search: như _norm_match và coi "đ" là "d" (gõ không dấu)"""
+    return _norm_match(s).replace("đ", "d")
+
 def _no_diacritics_set(kws: set) -> set:
     """Build keyword set có & không dấu"""
     return kws | {_norm_match(k) for k in kws}
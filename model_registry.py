@@ -0,0 +1,366 @@
+"""Registry model local có version + đổi model không cần restart (hot-swap) + shadow scoring
+
+Checkpoint được lưu trong MODEL_REGISTRY_DIR (mặc định instance/models/):
+
+    instance/models/<version>/model.bin    state dict PhoBERTPairABSA
+    instance/models/<version>/meta.json    nguồn, sha256, thời điểm đăng ký, kết quả smoke test
+    instance/models/ACTIVE                 version đang dùng (không có: model từ Hugging Face Hub)
+
+Đổi model (ModelManager.activate): load checkpoint trong thread nền (dùng lại
+tokenizer của engine hiện tại), chạy smoke test trên SMOKE_SET, đạt thì gán
+engine mới cho app. Request đang chạy giữ tham chiếu tới engine cũ nên chạy
+xong trên model cũ; engine cũ được giải phóng khi không còn ai dùng. Trong lúc
+load, RAM chứa hai model.
+
+Worker đã đổi model ghi ACTIVE rồi coordination.mark('model_swap'); các worker
+khác thấy dấu này ở request kế tiếp (ModelManager.sync) và tự load version đó
+trong nền. Process khởi động sau dùng luôn version ACTIVE (load_active_engine).
+torch/inference chỉ được import khi thật sự load model, web tier import module
+này mà không kéo theo torch.
+
+Shadow scoring: một version khác chạy song song trên shadow_percent% lượt phân
+tích (thread nền, chỉ chạy khi admission control còn slot trống và không ai
+đang chờ; bận thì bỏ mẫu, không chiếm chỗ trong hàng đợi BULK của upload CSV),
+kết quả chỉ dùng để so với model chính (metrics + các mẫu khác nhau gần nhất).
+"""
+
+import os
+import re
+import json
+import random
+import hashlib
+import threading
+from collections import deque
+from datetime import datetime
+
+import admission
+import coordination
+import metrics
+
+MODEL_REGISTRY_DIR = os.getenv('MODEL_REGISTRY_DIR', os.path.join(os.getcwd(), 'instance', 'models'))
+# Tỉ lệ tối thiểu feedback trong SMOKE_SET mà model mới cho cùng topic + sentiment với model đang chạy
+MODEL_SMOKE_MIN_AGREEMENT = float(os.getenv('MODEL_SMOKE_MIN_AGREEMENT', '0.5'))
+# Số thread shadow tối đa đang chạy; vượt thì bỏ mẫu
+SHADOW_MAX_PENDING = 8
+
+SMOKE_SET = [
+    "Giảng viên dạy rất nhiệt tình và dễ hiểu",
+    "Thầy giảng bài quá nhanh, em không theo kịp",
+    "Cô luôn trả lời câu hỏi của sinh viên chu đáo",
+    "Chương trình học quá nặng, nhiều môn không cần thiết",
+    "Nội dung môn học thực tế và bổ ích",
+    "Lịch học thay đổi liên tục gây khó khăn",
+    "Phòng học nóng, máy chiếu thường xuyên bị hỏng",
+    "Thư viện rộng rãi, wifi ổn định",
+    "Căn tin sạch sẽ nhưng giá hơi cao",
+    "Thủ tục hành chính ở phòng đào tạo rất chậm",
+    "Mọi thứ đều ổn",
+    "Giảng viên nhiệt tình nhưng phòng học quá chật",
+]
+
+_VERSION_PATTERN = re.compile(r'^[A-Za-z0-9][A-Za-z0-9._-]{0,63}$')
+
+
+class ModelRegistryError(Exception):
+    """Lỗi đăng ký/load model (version sai, checkpoint hỏng, smoke test không đạt...)"""
+
+
+def _version_dir(version: str) -> str:
+    if not version or not _VERSION_PATTERN.match(version):
+        raise ModelRegistryError(f"Tên version không hợp lệ: {version!r}")
+    return os.path.join(MODEL_REGISTRY_DIR, version)
+
+
+def checkpoint_path(version: str) -> str:
+    return os.path.join(_version_dir(version), 'model.bin')
+
+
+def get(version: str):
+    """meta.json của version (None nếu chưa đăng ký)"""
+    try:
+        with open(os.path.join(_version_dir(version), 'meta.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError, ModelRegistryError):
+        return None
+
+
+def list_versions() -> list:
+    """Các version đã đăng ký, mới nhất trước"""
+    if not os.path.isdir(MODEL_REGISTRY_DIR):
+        return []
+    versions = [get(name) for name in os.listdir(MODEL_REGISTRY_DIR)
+                if os.path.isdir(os.path.join(MODEL_REGISTRY_DIR, name))]
+    return sorted((v for v in versions if v), key=lambda v: v.get('created_at', ''), reverse=True)
+
+
+def _write_meta(version: str, meta: dict):
+    path = os.path.join(_version_dir(version), 'meta.json')
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def register(fileobj, version: str = None, source: str = 'upload') -> dict:
+    """Lưu checkpoint (file-like) vào registry; version mặc định là 12 ký tự đầu sha256"""
+    os.makedirs(MODEL_REGISTRY_DIR, exist_ok=True)
+    tmp_path = os.path.join(MODEL_REGISTRY_DIR, f'.upload-{os.getpid()}-{threading.get_ident()}')
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_path, 'wb') as out:
+            while True:
+                chunk = fileobj.read(1024 * 1024)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                size += len(chunk)
+                out.write(chunk)
+        if not size:
+            raise ModelRegistryError("Checkpoint rỗng")
+        version = version or digest.hexdigest()[:12]
+        if get(version) is not None:
+            raise ModelRegistryError(f"Version {version} đã tồn tại")
+        os.makedirs(_version_dir(version), exist_ok=True)
+        os.replace(tmp_path, checkpoint_path(version))
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    meta = {'version': version, 'source': source, 'sha256': digest.hexdigest(), 'size': size,
+            'created_at': datetime.utcnow().isoformat(timespec='seconds'), 'smoke': None}
+    _write_meta(version, meta)
+    return meta
+
+
+def register_revision(revision: str, repo: str = None) -> dict:
+    """Tải model.bin của một revision trên Hugging Face Hub vào registry (version = tên revision)"""
+    import torch
+    from inference import MODEL_REPO
+    repo = repo or MODEL_REPO
+    _version_dir(revision)
+    os.makedirs(MODEL_REGISTRY_DIR, exist_ok=True)
+    tmp_path = os.path.join(MODEL_REGISTRY_DIR, f'.download-{os.getpid()}-{threading.get_ident()}')
+    try:
+        torch.hub.download_url_to_file(f"https://huggingface.co/{repo}/resolve/{revision}/model.bin",
+                                       tmp_path, progress=False)
+        with open(tmp_path, 'rb') as f:
+            return register(f, version=revision, source=f'{repo}@{revision}')
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def active_version():
+    """Version đang được chọn trong registry (None: dùng model từ Hugging Face Hub)"""
+    try:
+        with open(os.path.join(MODEL_REGISTRY_DIR, 'ACTIVE'), 'r', encoding='utf-8') as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def set_active(version: str):
+    """Chọn version cho mọi worker (ghi ACTIVE rồi báo các process khác)"""
+    path = os.path.join(MODEL_REGISTRY_DIR, 'ACTIVE')
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        f.write(version)
+    os.replace(path + '.tmp', path)
+    coordination.mark('model_swap')
+
+
+def load_engine(version: str, tokenizer=None, device=None):
+    from inference import InferenceEngine
+    path = checkpoint_path(version)
+    if not os.path.exists(path):
+        raise ModelRegistryError(f"Không tìm thấy checkpoint của version {version}")
+    return InferenceEngine.from_checkpoint(path, version, tokenizer=tokenizer, device=device)
+
+
+def load_active_engine(device=None):
+    """Engine cho process mới khởi động: version ACTIVE trong registry, không có thì Hugging Face Hub"""
+    from inference import InferenceEngine, MODEL_REPO, MODEL_REVISION
+    version = active_version()
+    if version:
+        try:
+            return load_engine(version, device=device)
+        except Exception:
+            pass
+    return InferenceEngine.from_pretrained(MODEL_REPO, device=device, revision=MODEL_REVISION)
+
+
+def _labels(results) -> dict:
+    return {r['topic']: r['sentiment'] for r in results}
+
+
+def compare(primary, candidate):
+    """None nếu hai kết quả giống nhau, ngược lại 'topic' hoặc 'sentiment' (khác ở đâu)"""
+    primary, candidate = _labels(primary), _labels(candidate)
+    if primary.keys() != candidate.keys():
+        return 'topic'
+    if primary != candidate:
+        return 'sentiment'
+    return None
+
+
+def smoke_test(candidate, reference=None) -> dict:
+    """Chạy SMOKE_SET: xác suất hợp lệ, có nhận ra aspect, đủ giống model đang chạy (nếu có)"""
+    import torch
+    from score_store import unpack_probs
+    errors = []
+    try:
+        results, scores = candidate.analyze_many(SMOKE_SET, with_scores=True)
+    except Exception as e:
+        return {'ok': False, 'agreement': None, 'errors': [f"Lỗi khi chạy model: {e}"]}
+    if any(score is None for score in scores):
+        errors.append("Có feedback không được chạy qua model")
+    else:
+        probs = unpack_probs([score[0] for score in scores])  # (probs, keyword_mask, embedding)
+        if not torch.isfinite(probs).all() or not torch.allclose(probs.sum(-1), torch.ones(()), atol=1e-2):
+            errors.append("Xác suất không hợp lệ (NaN/inf hoặc tổng khác 1)")
+    if not any(results):
+        errors.append("Model không nhận ra aspect nào trong SMOKE_SET")
+
+    agreement = None
+    if reference is not None and reference.is_ready:
+        expected = reference.analyze_many(SMOKE_SET)
+        agreement = sum(1 for a, b in zip(expected, results) if compare(a, b) is None) / len(SMOKE_SET)
+        if agreement < MODEL_SMOKE_MIN_AGREEMENT:
+            errors.append(f"Chỉ {agreement:.0%} kết quả giống model hiện tại "
+                          f"(tối thiểu {MODEL_SMOKE_MIN_AGREEMENT:.0%})")
+    return {'ok': not errors, 'agreement': agreement, 'errors': errors}
+
+
+class ModelManager:
+    def __init__(self, get_engine, set_engine):
+        """Đổi engine của app trong nền; get_engine/set_engine đọc/gán engine đang phục vụ"""
+        self._get_engine = get_engine
+        self._set_engine = set_engine
+        self._lock = threading.Lock()
+        self.version = active_version()
+        self.status = {'state': 'idle', 'version': None, 'error': None, 'smoke': None}
+        self._swap_seen = coordination.last_marked('model_swap')
+
+        self.shadow_engine = None
+        self.shadow_version = None
+        self.shadow_percent = 0.0
+        self._shadow_pending = 0
+        self.shadow_recent = deque(maxlen=20)
+
+    def activate(self, version: str, publish: bool = True) -> bool:
+        """Bắt đầu load + kiểm tra + đổi sang version (False nếu đang có lượt load khác)"""
+        if get(version) is None:
+            raise ModelRegistryError(f"Chưa đăng ký version {version}")
+        with self._lock:
+            if self.status['state'] in ('loading', 'validating'):
+                return False
+            self.status = {'state': 'loading', 'version': version, 'error': None, 'smoke': None}
+        threading.Thread(target=self._activate, args=(version, publish), name='model-swap', daemon=True).start()
+        return True
+
+    def _activate(self, version: str, publish: bool):
+        current = self._get_engine()
+        try:
+            candidate = load_engine(version, tokenizer=getattr(current, 'tokenizer', None))
+            self.status['state'] = 'validating'
+            # Worker nhận version từ worker khác: version đã qua smoke test, chỉ kiểm tra model chạy được
+            smoke = smoke_test(candidate, current if publish else None)
+            self.status['smoke'] = smoke
+            if not smoke['ok']:
+                raise ModelRegistryError('; '.join(smoke['errors']))
+        except Exception as e:
+            self.status.update(state='failed', error=str(e))
+            return
+        if publish:
+            meta = get(version)
+            meta['smoke'] = smoke
+            meta['activated_at'] = datetime.utcnow().isoformat(timespec='seconds')
+            _write_meta(version, meta)
+        self._set_engine(candidate)
+        self.version = version
+        self.status['state'] = 'active'
+        if publish:
+            set_active(version)
+            self._swap_seen = coordination.last_marked('model_swap')
+
+    def sync(self):
+        """Gọi đầu mỗi request: worker khác vừa đổi model thì load version đó trong nền"""
+        marked = coordination.last_marked('model_swap')
+        if marked <= self._swap_seen:
+            return
+        self._swap_seen = marked
+        version = active_version()
+        if version and version != self.version:
+            try:
+                self.activate(version, publish=False)
+            except ModelRegistryError:
+                pass
+
+    def start_shadow(self, version: str, percent: float):
+        """Load version làm shadow trong nền; percent <= 0 thì tắt shadow"""
+        if percent <= 0:
+            self.shadow_engine, self.shadow_version, self.shadow_percent = None, None, 0.0
+            return
+        if get(version) is None:
+            raise ModelRegistryError(f"Chưa đăng ký version {version}")
+
+        def load():
+            try:
+                engine = load_engine(version, tokenizer=getattr(self._get_engine(), 'tokenizer', None))
+            except Exception as e:
+                self.status.update(state='failed', version=version, error=f"Shadow: {e}")
+                return
+            self.shadow_recent.clear()
+            self.shadow_engine, self.shadow_version = engine, version
+            self.shadow_percent = min(100.0, float(percent))
+        threading.Thread(target=load, name='model-shadow', daemon=True).start()
+
+    def maybe_shadow(self, texts, results):
+        """Chọn ngẫu nhiên shadow_percent% feedback vừa phân tích để chạy lại trên model shadow"""
+        engine = self.shadow_engine
+        if engine is None:
+            return
+        picked = [(t, r) for t, r in zip(texts, results) if random.random() * 100 < self.shadow_percent]
+        if not picked:
+            return
+        with self._lock:
+            if self._shadow_pending >= SHADOW_MAX_PENDING:
+                return
+            self._shadow_pending += 1
+        threading.Thread(target=self._shadow, args=(engine, self.shadow_version, picked),
+                         name='model-shadow-score', daemon=True).start()
+
+    def _shadow(self, engine, version, picked):
+        try:
+            with admission.controller.try_admit(admission.BULK) as admitted:
+                if not admitted:
+                    metrics.SHADOW_SKIPPED.inc(len(picked), version=version)
+                    return
+                shadow_results = engine.analyze_many([t for t, _ in picked])
+            for (text, primary), shadow in zip(picked, shadow_results):
+                metrics.SHADOW_COMPARED.inc(version=version)
+                kind = compare(primary, shadow)
+                if kind:
+                    metrics.SHADOW_DISAGREED.inc(version=version, kind=kind)
+                    self.shadow_recent.append({'text': text, 'kind': kind, 'primary': _labels(primary),
+                                               'shadow': _labels(shadow)})
+        except Exception:
+            pass
+        finally:
+            with self._lock:
+                self._shadow_pending -= 1
+
+    def describe(self) -> dict:
+        engine = self._get_engine()
+        return {
+            'active': self.version,
+            'model_version': getattr(engine, 'model_version', None),
+            'status': self.status,
+            'versions': list_versions(),
+            'shadow': {
+                'version': self.shadow_version,
+                'percent': self.shadow_percent,
+                'compared': metrics.SHADOW_COMPARED.value(version=self.shadow_version),
+                'disagreed': {kind: metrics.SHADOW_DISAGREED.value(version=self.shadow_version, kind=kind)
+                              for kind in ('topic', 'sentiment')},
+                'recent_disagreements': list(self.shadow_recent),
+            },
+        }
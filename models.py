@@ -2,6 +2,7 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from datetime import datetime
 import bcrypt
+from model_config import _norm_search
 
 db = SQLAlchemy()
 
@@ -27,17 +28,84 @@ class User(UserMixin, db.Model):
     def __repr__(self):
         return f'<User {self.username}>'
 
+def _default_text_norm(context):
+    return _norm_search(context.get_current_parameters().get('text') or '')
+
 class Feedback(db.Model):
     __tablename__ = 'feedbacks'
     
     id = db.Column(db.Integer, primary_key=True)
     text = db.Column(db.Text, nullable=False)
+    text_norm = db.Column(db.Text, nullable=True, default=_default_text_norm)  # _norm_search(text), index FTS5
     sentiment = db.Column(db.String(20), nullable=False)
     topic = db.Column(db.String(50), nullable=False)
     sentiment_confidence = db.Column(db.Float, nullable=False)
     topic_confidence = db.Column(db.Float, nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    score_id = db.Column(db.Integer, db.ForeignKey('feedback_scores.id'), nullable=True, index=True)
+    model_version = db.Column(db.String(64), nullable=True)  # NULL: phân tích trước khi có version
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     def __repr__(self):
         return f'<Feedback {self.id}: {self.sentiment} - {self.topic}>'
+
+class FeedbackScore(db.Model):
+    """Xác suất thô của model cho một lần gửi feedback (kể cả khi không aspect nào được giữ)"""
+    __tablename__ = 'feedback_scores'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    text = db.Column(db.Text, nullable=False)
+    probs = db.Column(db.LargeBinary, nullable=False)  # float16 (4 aspect x 4 class), xem score_store.py
+    keyword_mask = db.Column(db.Integer, nullable=False, default=0)  # bit i: aspect i có keyword
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    model_version = db.Column(db.String(64), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    feedbacks = db.relationship('Feedback', backref='score', lazy=True)
+    
+    def __repr__(self):
+        return f'<FeedbackScore {self.id}>'
+
+class DataVersion(db.Model):
+    """Bộ đếm thay đổi dữ liệu theo phạm vi ('global', 'user:<id>'), xem data_versions.py"""
+    __tablename__ = 'data_versions'
+    
+    scope = db.Column(db.String(32), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<DataVersion {self.scope}={self.version}>'
+
+
+# Cột thêm sau khi DB đã tồn tại: db.create_all() không ALTER bảng cũ
+_ADDED_COLUMNS = [
+    ('feedbacks', 'score_id', "INTEGER REFERENCES feedback_scores(id)"),
+    ('feedbacks', 'model_version', "VARCHAR(64)"),
+    ('feedbacks', 'text_norm', "TEXT"),
+    ('feedback_scores', 'model_version', "VARCHAR(64)"),
+]
+
+def upgrade_schema():
+    """Thêm các cột mới vào bảng đã có (gọi sau db.create_all() trong app context)"""
+    try:
+        # Bảng mới (data_versions) chưa có trong file database cũ vừa restore
+        db.create_all()
+    except Exception:
+        db.session.rollback()
+    for table, column, ddl in _ADDED_COLUMNS:
+        try:
+            db.session.execute(db.text(f"SELECT {column} FROM {table} LIMIT 1"))
+        except Exception:
+            db.session.rollback()
+            try:
+                db.session.execute(db.text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+    try:
+        db.session.execute(db.text("CREATE INDEX IF NOT EXISTS ix_feedbacks_score_id ON feedbacks (score_id)"))
+        db.session.execute(db.text("CREATE INDEX IF NOT EXISTS ix_feedbacks_user_id ON feedbacks (user_id)"))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
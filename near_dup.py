@@ -0,0 +1,207 @@
+"""Gom feedback trùng nhau trước khi chạy model (khoá chuẩn hoá) và gom cụm gần trùng để hiển thị (MinHash + LSH)
+
+Chạy model: chỉ các text có cùng analysis_key() mới dùng chung kết quả. Khoá là
+text chuẩn hoá bằng _norm_search (lower, bỏ dấu, đ->d) và bỏ dấu câu, nên các
+biến thể chỉ khác hoa/thường, dấu câu hay có/không dấu được phân tích một lần.
+Text khác chữ không bao giờ nhận nhãn, xác suất hay embedding của text khác.
+
+Hiển thị ("bao nhiêu sinh viên nói điều này", NEAR_DUP_FUZZY): các biến thể còn
+lại (thêm/bớt vài chữ, gõ sai) được so bằng MinHash trên shingle 5 ký tự; LSH
+(BANDS band x ROWS hàng) chỉ so text mới với các đại diện cụm có chung ít nhất
+một band, nên chi phí gần như tuyến tính theo số text. Shingle ký tự không hiểu
+nghĩa: "phòng học sạch sẽ" và "phòng học bẩn" có Jaccard ~0.86, vì vậy cụm gần
+trùng chỉ dùng để gom nhóm hiển thị, không dùng để chia sẻ kết quả phân tích.
+Hai text có từ phủ định khác nhau ("không", "chưa"...) không bao giờ bị gom chung.
+
+Một lần upload CSV dùng UploadClusters: chỉ giữ một LRU giới hạn (digest khoá ->
+id cụm) và heap các cụm lớn nhất, nên bộ nhớ không tăng theo kích thước file.
+"""
+
+import os
+import re
+import zlib
+import heapq
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+from model_config import _norm_search
+
+# Dùng chung kết quả phân tích cho các text cùng khoá chuẩn hoá
+NEAR_DUP_ENABLED = os.getenv('NEAR_DUP', 'True').lower() == 'true'
+# Gom cụm gần trùng (MinHash) cho phần hiển thị top_clusters; mặc định cụm = khoá chuẩn hoá
+NEAR_DUP_FUZZY = os.getenv('NEAR_DUP_FUZZY', 'False').lower() == 'true'
+NEAR_DUP_THRESHOLD = float(os.getenv('NEAR_DUP_THRESHOLD', '0.8'))
+# Số cụm hiển thị tối đa giữ trong RAM cho một lượt upload CSV
+CLUSTER_CACHE_SIZE = int(os.getenv('CSV_CLUSTER_CACHE_SIZE', '20000'))
+SHINGLE_SIZE = 5
+BANDS = 16
+ROWS = 4
+NUM_PERM = BANDS * ROWS
+
+# Từ làm đảo nghĩa câu (đã chuẩn hoá bằng _norm_search)
+NEGATION_WORDS = frozenset({"khong", "ko", "k", "kg", "khg", "hok", "chua", "chang", "cha", "dung", "deo"})
+
+_PRIME = np.uint64(4294967311)  # số nguyên tố > 2^32
+_rng = np.random.default_rng(20240601)
+_A = _rng.integers(1, 2 ** 31, size=(NUM_PERM, 1), dtype=np.uint64)
+_B = _rng.integers(0, 2 ** 32, size=(NUM_PERM, 1), dtype=np.uint64)
+
+
+def normalize(text: str) -> str:
+    """Khoá so trùng: _norm_search + chỉ giữ các từ"""
+    return ' '.join(re.findall(r"\w+", _norm_search(str(text))))
+
+
+def analysis_key(text: str) -> str:
+    """Khoá để dùng chung kết quả phân tích (text nguyên bản nếu tắt NEAR_DUP)"""
+    return normalize(text) if NEAR_DUP_ENABLED else text
+
+
+def shingles(key: str) -> set:
+    if len(key) <= SHINGLE_SIZE:
+        return {key}
+    return {key[i:i + SHINGLE_SIZE] for i in range(len(key) - SHINGLE_SIZE + 1)}
+
+
+def minhash(key: str) -> np.ndarray:
+    """Chữ ký MinHash NUM_PERM phần tử của một khoá đã chuẩn hoá"""
+    hashes = np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingles(key)), dtype=np.uint64)
+    return ((_A * hashes + _B) % _PRIME).min(axis=1)
+
+
+def _negations(key: str) -> frozenset:
+    return frozenset(word for word in key.split() if word in NEGATION_WORDS)
+
+
+class NearDuplicateIndex:
+    def __init__(self, threshold: float = NEAR_DUP_THRESHOLD):
+        """Index tăng dần: add() lần lượt từng text, trả về id cụm của nó"""
+        self.threshold = threshold
+        self._exact = {}
+        self._buckets = [{} for _ in range(BANDS)]
+        # Chữ ký của các đại diện, cấp phát gấp đôi khi đầy để so sánh vector hoá
+        self._signatures = np.empty((64, NUM_PERM), dtype=np.uint64)
+        self._negations = []
+        self.representatives = []
+        self.sizes = []
+
+    def __len__(self):
+        return len(self.representatives)
+
+    def add(self, text: str) -> int:
+        key = normalize(text)
+        cluster_id = self._exact.get(key)
+        if cluster_id is None:
+            cluster_id = self._match_or_create(text, key)
+            self._exact[key] = cluster_id
+        self.sizes[cluster_id] += 1
+        return cluster_id
+
+    def _match_or_create(self, text: str, key: str) -> int:
+        signature = minhash(key)
+        negations = _negations(key)
+        raw = signature.tobytes()
+        band_size = ROWS * signature.itemsize
+        band_keys = [raw[b * band_size:(b + 1) * band_size] for b in range(BANDS)]
+
+        candidates = set()
+        for bucket, band_key in zip(self._buckets, band_keys):
+            candidates.update(bucket.get(band_key, ()))
+        candidates = [c for c in candidates if self._negations[c] == negations]
+
+        if candidates:
+            scores = (self._signatures[candidates] == signature).mean(axis=1)
+            best = int(scores.argmax())
+            if scores[best] >= self.threshold:
+                return candidates[best]
+
+        cluster_id = len(self.representatives)
+        if cluster_id == len(self._signatures):
+            self._signatures = np.concatenate([self._signatures, np.empty_like(self._signatures)])
+        self._signatures[cluster_id] = signature
+        self.representatives.append(text)
+        self.sizes.append(0)
+        self._negations.append(negations)
+        for bucket, band_key in zip(self._buckets, band_keys):
+            bucket.setdefault(band_key, []).append(cluster_id)
+        return cluster_id
+
+
+def cluster_texts(texts, threshold: float = NEAR_DUP_THRESHOLD):
+    """Gom list text; trả về (cluster_ids theo thứ tự texts, index)"""
+    index = NearDuplicateIndex(threshold)
+    return [index.add(text) for text in texts], index
+
+
+class UploadClusters:
+    def __init__(self, max_clusters: int = None, fuzzy: bool = None, top: int = 10):
+        """Cụm hiển thị của một lượt upload CSV, bộ nhớ không tăng theo kích thước file
+
+        Chỉ giữ max_clusters cụm dùng gần nhất (LRU theo digest của khoá chuẩn hoá,
+        hoặc một NearDuplicateIndex được làm mới khi đầy nếu fuzzy); cụm bị đẩy ra
+        chỉ còn lại nếu thuộc `top` cụm lớn nhất. Comment lặp lại sau khi cụm của nó
+        đã bị đẩy ra sẽ mở cụm mới.
+        """
+        self.max_clusters = max(1, max_clusters or CLUSTER_CACHE_SIZE)
+        self.fuzzy = NEAR_DUP_FUZZY if fuzzy is None else fuzzy
+        self.top = top
+        self.count = 0
+        self._live = OrderedDict()  # digest khoá (hoặc id trong index fuzzy) -> cluster id
+        self._info = {}  # cluster id -> [số dòng, text đầu tiên]
+        self._evicted_top = []  # heap (số dòng, cluster id, text) của các cụm đã bị đẩy ra
+        self._watched = {}  # cluster id -> số dòng cuối cùng (None: còn trong RAM)
+        self._index = NearDuplicateIndex() if self.fuzzy else None
+
+    def add(self, text: str, key: str) -> int:
+        """Thêm một dòng; trả về cluster id"""
+        if self._index is not None:
+            if len(self._index._exact) >= self.max_clusters:
+                self._evict_all()
+                self._index = NearDuplicateIndex(self._index.threshold)
+            slot = self._index.add(text)
+        else:
+            slot = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        cluster_id = self._live.get(slot)
+        if cluster_id is None:
+            cluster_id = self._live[slot] = self.count
+            self.count += 1
+            self._info[cluster_id] = [0, text]
+            if self._index is None and len(self._live) > self.max_clusters:
+                self._evict(self._live.popitem(last=False)[1])
+        else:
+            self._live.move_to_end(slot)
+        self._info[cluster_id][0] += 1
+        return cluster_id
+
+    def _evict(self, cluster_id: int):
+        size, text = self._info.pop(cluster_id)
+        if cluster_id in self._watched:
+            self._watched[cluster_id] = size
+        if size > 1:
+            item = (size, cluster_id, text)
+            if len(self._evicted_top) < self.top:
+                heapq.heappush(self._evicted_top, item)
+            else:
+                heapq.heappushpop(self._evicted_top, item)
+
+    def _evict_all(self):
+        for cluster_id in list(self._live.values()):
+            self._evict(cluster_id)
+        self._live.clear()
+
+    def watch(self, cluster_id: int):
+        """Giữ lại số dòng của cụm (các dòng trả về client) kể cả khi cụm bị đẩy ra"""
+        self._watched.setdefault(cluster_id, None)
+
+    def size(self, cluster_id: int) -> int:
+        info = self._info.get(cluster_id)
+        return info[0] if info is not None else self._watched.get(cluster_id) or 0
+
+    def top_clusters(self) -> list:
+        """Các cụm từ 2 dòng trở lên, lớn nhất trước"""
+        items = [(size, cid, text) for cid, (size, text) in self._info.items() if size > 1]
+        items += self._evicted_top
+        items.sort(key=lambda item: (-item[0], item[1]))
+        return [{'cluster_id': cid, 'text': text, 'size': size} for size, cid, text in items[:self.top]]
@@ -0,0 +1,160 @@
+"""Profile từng request (opt-in) cho đường inference và ghi database
+
+Bật bằng header `X-Profile: 1` hoặc query `?profile=1` (chỉ admin), hoặc lấy mẫu
+ngẫu nhiên theo PROFILE_SAMPLE_RATE (0.0 - 1.0). Mỗi profile gồm:
+  - cProfile của toàn request (analyze_feedback, save_feedback_to_db, commit...)
+  - bảng operator của PyTorch profiler (nếu torch có trong process)
+và được lưu trong instance/profiles/ (.prof để mở bằng snakeviz/pstats, .json
+để xem nhanh trên trang admin).
+"""
+
+import os
+import io
+import json
+import time
+import pstats
+import random
+import cProfile
+import threading
+from datetime import datetime
+from typing import Optional
+
+PROFILE_DIR = os.path.join(os.getcwd(), 'instance', 'profiles')
+PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', '50'))
+PROFILED_ROUTES = {'/predict', '/analyze-csv'}
+
+# Chỉ một profile tại một thời điểm: PyTorch profiler không chạy lồng nhau được
+# và cProfile chồng nhau làm sai số liệu
+_active = threading.Lock()
+
+
+def _sample_rate() -> float:
+    try:
+        return float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+    except ValueError:
+        return 0.0
+
+
+def should_profile(route: str, headers, args, is_admin: bool) -> bool:
+    if route not in PROFILED_ROUTES:
+        return False
+    if is_admin and (headers.get('X-Profile') == '1' or args.get('profile') == '1'):
+        return True
+    rate = _sample_rate()
+    return rate > 0 and random.random() < rate
+
+
+class RequestProfiler:
+    def __init__(self, route: str, trigger: str):
+        """Thu cProfile + PyTorch profiler cho một request"""
+        self.route = route
+        self.trigger = trigger
+        self.profile = cProfile.Profile()
+        self.torch_profiler = None
+        self.started_at = None
+        self.elapsed = None
+
+    @classmethod
+    def try_start(cls, route: str, trigger: str) -> Optional["RequestProfiler"]:
+        if not _active.acquire(blocking=False):
+            return None
+        profiler = cls(route, trigger)
+        try:
+            profiler._start()
+        except Exception:
+            _active.release()
+            return None
+        return profiler
+
+    def _start(self):
+        self.started_at = time.perf_counter()
+        try:
+            import sys
+            if 'torch' in sys.modules:
+                from torch.profiler import profile, ProfilerActivity
+                self.torch_profiler = profile(activities=[ProfilerActivity.CPU], record_shapes=True)
+                self.torch_profiler.__enter__()
+        except Exception:
+            self.torch_profiler = None
+        self.profile.enable()
+
+    def stop_and_save(self, status_code: int = 200, profile_dir: str = PROFILE_DIR) -> Optional[str]:
+        """Dừng profile, ghi file và trả về profile id"""
+        try:
+            self.profile.disable()
+            self.elapsed = time.perf_counter() - self.started_at
+
+            torch_table = None
+            if self.torch_profiler is not None:
+                try:
+                    self.torch_profiler.__exit__(None, None, None)
+                    torch_table = self.torch_profiler.key_averages().table(
+                        sort_by="self_cpu_time_total", row_limit=30)
+                except Exception:
+                    torch_table = None
+
+            os.makedirs(profile_dir, exist_ok=True)
+            route_slug = self.route.strip('/').replace('/', '_') or 'root'
+            profile_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{route_slug}"
+
+            self.profile.dump_stats(os.path.join(profile_dir, f"{profile_id}.prof"))
+            stats_buf = io.StringIO()
+            stats = pstats.Stats(self.profile, stream=stats_buf)
+            stats.sort_stats('cumulative').print_stats(40)
+
+            summary = {
+                'id': profile_id,
+                'route': self.route,
+                'trigger': self.trigger,
+                'status': status_code,
+                'duration_ms': round(self.elapsed * 1000, 2),
+                'created_at': datetime.now().isoformat(timespec='seconds'),
+                'python_stats': stats_buf.getvalue(),
+                'torch_ops': torch_table,
+            }
+            with open(os.path.join(profile_dir, f"{profile_id}.json"), 'w', encoding='utf-8') as f:
+                json.dump(summary, f, ensure_ascii=False)
+
+            _prune(profile_dir)
+            return profile_id
+        except Exception:
+            return None
+        finally:
+            _active.release()
+
+
+def _prune(profile_dir: str, keep: int = PROFILE_KEEP):
+    summaries = sorted(name for name in os.listdir(profile_dir) if name.endswith('.json'))
+    for name in summaries[:-keep] if keep > 0 else []:
+        base = name[:-len('.json')]
+        for ext in ('.json', '.prof'):
+            path = os.path.join(profile_dir, base + ext)
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def list_profiles(profile_dir: str = PROFILE_DIR) -> list:
+    """Danh sách profile mới nhất trước (không kèm nội dung stats)"""
+    if not os.path.isdir(profile_dir):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(profile_dir), reverse=True):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(profile_dir, name), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            data.pop('python_stats', None)
+            data.pop('torch_ops', None)
+            profiles.append(data)
+        except Exception:
+            continue
+    return profiles
+
+
+def load_profile(profile_id: str, profile_dir: str = PROFILE_DIR) -> Optional[dict]:
+    path = os.path.join(profile_dir, f"{os.path.basename(profile_id)}.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
@@ -0,0 +1,164 @@
+"""Áp dụng threshold mới lên xác suất đã lưu trong feedback_scores (không chạy lại model)
+
+Đọc feedback_scores theo từng chunk (keyset theo id), giải nén thành tensor
+(N, 4, 4) + mask keyword (N, 4) và chạy decide_batch cho cả chunk một lần.
+Mặc định chỉ in phân bố topic/sentiment trước và sau; --apply ghi lại các dòng
+feedbacks tương ứng (xoá dòng cũ của mỗi score rồi chèn kết quả mới).
+
+    python redecide.py --min-margin 0.12 --no-kw-threshold 0.9
+    python redecide.py --min-margin 0.12 --no-kw-threshold 0.9 --apply
+
+Feedback cũ (trước khi có feedback_scores) không có xác suất: chạy rescore.py để
+bổ sung.
+"""
+
+import os
+import sys
+import time
+import argparse
+from collections import Counter
+
+import torch
+from flask import Flask
+
+from models import db, Feedback, FeedbackScore, upgrade_schema
+from decision import decide_batch, decision_to_results, default_thresholds
+from model_config import ASPECTS_EN, LABEL_MAP
+from score_store import unpack_probs, unpack_keyword_masks
+import search_index
+import data_versions
+import trends
+
+DB_PATH = os.path.join(os.getcwd(), 'instance', 'feedback_analysis.db')
+CHUNK_SIZE = 20000
+
+
+def create_app(db_path: str = DB_PATH) -> Flask:
+    """Flask app tối thiểu chỉ để dùng models/db ngoài web app (không load model)"""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        upgrade_schema()
+        search_index.ensure_search_index()
+        trends.ensure_trend_buckets()
+    return app
+
+
+def iter_score_chunks(chunk_size: int = CHUNK_SIZE, after_id: int = 0):
+    """Duyệt feedback_scores theo id tăng dần, mỗi lần một chunk (id > id cuối chunk trước)"""
+    while True:
+        rows = (db.session.query(FeedbackScore.id, FeedbackScore.probs, FeedbackScore.keyword_mask,
+                                 FeedbackScore.text, FeedbackScore.user_id, FeedbackScore.created_at,
+                                 FeedbackScore.model_version)
+                .filter(FeedbackScore.id > after_id)
+                .order_by(FeedbackScore.id)
+                .limit(chunk_size)
+                .all())
+        if not rows:
+            return
+        yield rows
+        after_id = rows[-1].id
+
+
+def count_distribution(decision) -> Counter:
+    """Đếm (topic, sentiment) được giữ trong output của decide_batch (tính trên tensor)"""
+    num_sent = len(LABEL_MAP) - 1
+    keep = decision['keep']
+    aspect_idx = torch.arange(keep.shape[-1]).expand_as(keep)
+    flat = aspect_idx[keep] * num_sent + (decision['sentiment_idx'][keep] - 1)
+    counts = torch.bincount(flat, minlength=keep.shape[-1] * num_sent).tolist()
+    return Counter({(ASPECTS_EN[k // num_sent], LABEL_MAP[k % num_sent + 1]): c
+                    for k, c in enumerate(counts) if c})
+
+
+def current_distribution() -> Counter:
+    rows = (db.session.query(Feedback.topic, Feedback.sentiment, db.func.count(Feedback.id))
+            .filter(Feedback.score_id.isnot(None))
+            .group_by(Feedback.topic, Feedback.sentiment)
+            .all())
+    return Counter({(topic, sentiment): count for topic, sentiment, count in rows})
+
+
+def apply_chunk(rows, decision):
+    """Thay các dòng feedbacks của chunk bằng kết quả mới"""
+    score_ids = [row.id for row in rows]
+    Feedback.query.filter(Feedback.score_id.in_(score_ids)).delete(synchronize_session=False)
+    new_rows = []
+    for row, results in zip(rows, decision_to_results(decision)):
+        for result in results:
+            new_rows.append({
+                'text': row.text,
+                'sentiment': result['sentiment'],
+                'topic': result['topic'],
+                'sentiment_confidence': result['sentiment_confidence'],
+                'topic_confidence': result['confidence'],
+                'user_id': row.user_id,
+                'score_id': row.id,
+                'model_version': row.model_version,
+                'created_at': row.created_at,
+            })
+    if new_rows:
+        db.session.execute(db.insert(Feedback), new_rows)
+    if rows:
+        # Insert/delete bằng Core không qua listener after_flush: tự tăng phiên bản dữ liệu (ETag)
+        data_versions.bump(db.session, {row.user_id for row in rows})
+    db.session.commit()
+    return len(new_rows)
+
+
+def redecide(thresholds: dict, apply: bool = False, chunk_size: int = CHUNK_SIZE) -> dict:
+    before = current_distribution()
+    after = Counter()
+    total = with_results = written = 0
+    for rows in iter_score_chunks(chunk_size):
+        probs = unpack_probs([row.probs for row in rows])
+        has_kw = unpack_keyword_masks([row.keyword_mask for row in rows])
+        decision = decide_batch(probs, has_kw, **thresholds)
+        after.update(count_distribution(decision))
+        total += len(rows)
+        with_results += int(decision['keep'].any(dim=-1).sum())
+        if apply:
+            written += apply_chunk(rows, decision)
+    return {'total': total, 'with_results': with_results, 'written': written,
+            'before': before, 'after': after}
+
+
+def _print_report(report: dict, apply: bool):
+    print(f"{report['total']} feedback có xác suất, {report['with_results']} feedback có ít nhất một aspect")
+    print(f"{'topic':<18}{'sentiment':<12}{'trước':>10}{'sau':>10}")
+    for key in sorted(set(report['before']) | set(report['after'])):
+        print(f"{key[0]:<18}{key[1]:<12}{report['before'][key]:>10}{report['after'][key]:>10}")
+    if apply:
+        print(f"Đã ghi {report['written']} dòng feedbacks")
+    else:
+        print("Chưa ghi gì (thêm --apply để cập nhật bảng feedbacks)")
+
+
+def main(argv=None):
+    defaults = default_thresholds()
+    parser = argparse.ArgumentParser(description="Chạy lại bước quyết định với threshold mới trên xác suất đã lưu")
+    for name, value in defaults.items():
+        parser.add_argument('--' + name.replace('_', '-'), type=float, default=value)
+    parser.add_argument('--apply', action='store_true', help="Ghi kết quả mới vào bảng feedbacks")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--db', default=DB_PATH)
+    args = parser.parse_args(argv)
+
+    thresholds = {name: getattr(args, name) for name in defaults}
+    app = create_app(args.db)
+    with app.app_context():
+        start = time.perf_counter()
+        report = redecide(thresholds, apply=args.apply, chunk_size=args.chunk_size)
+        _print_report(report, args.apply)
+        print(f"Xong trong {time.perf_counter() - start:.2f}s")
+        if args.apply and report['total']:
+            from database_manager import db_manager
+            db_manager.backup_database(force=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,282 @@
+"""Chấm lại feedback đã lưu bằng model/config hiện tại (chạy offline, resume được)
+
+Dùng khi publish model mới lên MODEL_REPO (MODEL_REVISION) hoặc sửa
+ASPECT_PROMPTS/SUBTOPIC_KW: version mới (inference.model_version) khác version đã
+ghi trên từng dòng nên job biết cần chấm lại những gì. Hai giai đoạn:
+
+  1. legacy: feedbacks chưa có score_id (lưu trước khi có feedback_scores), gom các
+     dòng liên tiếp cùng user/text thành một lần gửi, tạo feedback_scores cho nó
+  2. scores: feedback_scores có model_version khác version hiện tại
+
+Mỗi giai đoạn đọc theo keyset (id > id cuối đã xử lý), chạy batch inference, thay
+các dòng feedbacks rồi commit từng chunk. Tiến độ lưu ở instance/rescore_checkpoint.json
+nên chạy lại lệnh sẽ tiếp tục từ chunk chưa xong. Giới hạn tài nguyên bằng --threads,
+--duty (tỉ lệ thời gian được chạy) và --max-rate (feedback/giây).
+
+    python rescore.py --threads 2 --duty 0.5
+    python rescore.py --socket instance/inference.sock   # dùng inference service đang chạy
+    python rescore.py --near-dup   # chỉ chạy model cho đại diện các text gần trùng
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+import torch
+
+from models import db, Feedback, FeedbackScore
+from redecide import create_app, DB_PATH
+from runtime_config import load_thread_config, configure_torch_threads
+from score_store import pack_probs
+import near_dup
+import data_versions
+import embedding_index
+
+CHECKPOINT_PATH = os.path.join(os.getcwd(), 'instance', 'rescore_checkpoint.json')
+CHUNK_SIZE = 256
+PHASES = ('legacy', 'scores')
+
+# Score cho text bị _is_garbage loại (model không chạy): mọi aspect đều "none"
+_NONE_PROBS = pack_probs(torch.nn.functional.one_hot(torch.zeros(1, 4, dtype=torch.long), 4).float())[0]
+
+
+def load_checkpoint(path: str, version: str) -> dict:
+    """Đọc checkpoint; checkpoint của version khác bị bỏ qua"""
+    state = {'model_version': version, 'legacy_last_id': 0, 'scores_last_id': 0}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            saved = json.load(f)
+        if saved.get('model_version') == version:
+            state.update(saved)
+    except (OSError, ValueError):
+        pass
+    return state
+
+
+def save_checkpoint(path: str, state: dict):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+class Throttle:
+    def __init__(self, duty: float = 1.0, max_rate: float = 0.0):
+        """duty: tỉ lệ thời gian được làm việc (0-1]; max_rate: feedback/giây (0 = không giới hạn)"""
+        self.duty = min(1.0, max(0.01, duty))
+        self.max_rate = max_rate
+
+    def pause(self, items: int, elapsed: float):
+        delay = elapsed * (1.0 / self.duty - 1.0)
+        if self.max_rate > 0:
+            delay = max(delay, items / self.max_rate - elapsed)
+        if delay > 0:
+            time.sleep(delay)
+
+
+def legacy_jobs(chunk_size: int, after_id: int):
+    """Lấy một chunk feedbacks chưa có score_id, gom thành các lần gửi
+
+    Một lần gửi = các dòng liên tiếp cùng user_id + text, mỗi topic tối đa một dòng
+    (save_feedback_to_db ghi đúng như vậy). Lần gửi cuối chunk có thể còn dòng ở
+    chunk sau nên được để lại cho lượt sau, trừ khi chunk chỉ có một lần gửi.
+    """
+    rows = (db.session.query(Feedback.id, Feedback.text, Feedback.user_id, Feedback.topic, Feedback.created_at)
+            .filter(Feedback.score_id.is_(None), Feedback.id > after_id)
+            .order_by(Feedback.id)
+            .limit(chunk_size)
+            .all())
+    jobs = []
+    for row in rows:
+        job = jobs[-1] if jobs else None
+        if job is None or job['user_id'] != row.user_id or job['text'] != row.text or row.topic in job['topics']:
+            job = {'score_id': None, 'text': row.text, 'user_id': row.user_id, 'created_at': row.created_at,
+                   'feedback_ids': [], 'topics': set()}
+            jobs.append(job)
+        job['feedback_ids'].append(row.id)
+        job['topics'].add(row.topic)
+    if len(rows) == chunk_size and len(jobs) > 1:
+        jobs.pop()
+    last_id = jobs[-1]['feedback_ids'][-1] if jobs else None
+    return jobs, last_id
+
+
+def stale_score_jobs(version: str, chunk_size: int, after_id: int):
+    """Lấy một chunk feedback_scores có model_version khác version hiện tại"""
+    rows = (db.session.query(FeedbackScore.id, FeedbackScore.text, FeedbackScore.user_id, FeedbackScore.created_at)
+            .filter(FeedbackScore.id > after_id,
+                    db.or_(FeedbackScore.model_version.is_(None), FeedbackScore.model_version != version))
+            .order_by(FeedbackScore.id)
+            .limit(chunk_size)
+            .all())
+    jobs = [{'score_id': row.id, 'text': row.text, 'user_id': row.user_id, 'created_at': row.created_at,
+             'feedback_ids': None} for row in rows]
+    return jobs, (rows[-1].id if rows else None)
+
+
+def rescore_jobs(engine, jobs: list, version: str, collapse_near_dup: bool = False) -> int:
+    """Chạy inference cho các lần gửi và thay feedback_scores + feedbacks tương ứng; trả về số dòng feedbacks mới
+
+    collapse_near_dup: chỉ chạy model một lần cho các text cùng khoá chuẩn hoá trong chunk
+    (chỉ khác hoa/thường, dấu câu, có/không dấu)
+    """
+    unique_texts = list(dict.fromkeys(job['text'] for job in jobs))
+    if collapse_near_dup:
+        keys = [near_dup.normalize(text) for text in unique_texts]
+        representatives = list(dict.fromkeys(keys))
+        key_texts = {}
+        for text, key in zip(unique_texts, keys):
+            key_texts.setdefault(key, text)
+        results, scores = engine.analyze_many([key_texts[key] for key in representatives], with_scores=True)
+        by_key = dict(zip(representatives, zip(results, scores)))
+        analysis = {text: by_key[key] for text, key in zip(unique_texts, keys)}
+    else:
+        results, scores = engine.analyze_many(unique_texts, with_scores=True)
+        analysis = {text: (res, score) for text, res, score in zip(unique_texts, results, scores)}
+
+    legacy_ids = [i for job in jobs if job['feedback_ids'] for i in job['feedback_ids']]
+    score_ids = [job['score_id'] for job in jobs if job['score_id'] is not None]
+    if legacy_ids:
+        Feedback.query.filter(Feedback.id.in_(legacy_ids)).delete(synchronize_session=False)
+    if score_ids:
+        Feedback.query.filter(Feedback.score_id.in_(score_ids)).delete(synchronize_session=False)
+
+    new_scores, updates = [], []
+    for job in jobs:
+        topics, score = analysis[job['text']]
+        probs_blob, keyword_mask = score[:2] if score is not None else (_NONE_PROBS, 0)
+        if job['score_id'] is None:
+            score_row = FeedbackScore(text=job['text'], probs=probs_blob, keyword_mask=keyword_mask,
+                                      user_id=job['user_id'], model_version=version, created_at=job['created_at'])
+            new_scores.append((job, score_row))
+        else:
+            updates.append({'id': job['score_id'], 'probs': probs_blob, 'keyword_mask': keyword_mask,
+                            'model_version': version})
+    if new_scores:
+        db.session.add_all([score_row for _, score_row in new_scores])
+        db.session.flush()
+        for job, score_row in new_scores:
+            job['score_id'] = score_row.id
+    if updates:
+        db.session.execute(db.update(FeedbackScore), updates)
+    # Vector của model mới được ghi vào embedding index khi chunk commit
+    embedding_index.stage_ids(db.session, [
+        (job['score_id'], job['user_id'], version, analysis[job['text']][1][2]) for job in jobs
+        if analysis[job['text']][0] and analysis[job['text']][1] is not None and len(analysis[job['text']][1]) > 2
+    ])
+
+    feedback_rows = []
+    for job in jobs:
+        for result in analysis[job['text']][0]:
+            feedback_rows.append({
+                'text': job['text'],
+                'sentiment': result['sentiment'],
+                'topic': result['topic'],
+                'sentiment_confidence': result.get('sentiment_confidence', result['confidence']),
+                'topic_confidence': result['confidence'],
+                'user_id': job['user_id'],
+                'score_id': job['score_id'],
+                'model_version': version,
+                'created_at': job['created_at'],
+            })
+    if feedback_rows:
+        db.session.execute(db.insert(Feedback), feedback_rows)
+    if jobs:
+        # Insert/delete bằng Core không qua listener after_flush: tự tăng phiên bản dữ liệu (ETag)
+        data_versions.bump(db.session, {job['user_id'] for job in jobs})
+    db.session.commit()
+    return len(feedback_rows)
+
+
+def count_pending(version: str) -> dict:
+    return {
+        'legacy': Feedback.query.filter(Feedback.score_id.is_(None)).count(),
+        'scores': FeedbackScore.query.filter(db.or_(FeedbackScore.model_version.is_(None),
+                                                    FeedbackScore.model_version != version)).count(),
+    }
+
+
+def run(engine, checkpoint_path: str = CHECKPOINT_PATH, chunk_size: int = CHUNK_SIZE,
+        throttle: Throttle = None, restart: bool = False, collapse_near_dup: bool = False) -> dict:
+    version = engine.model_version
+    state = {'model_version': version, 'legacy_last_id': 0, 'scores_last_id': 0} if restart \
+        else load_checkpoint(checkpoint_path, version)
+    throttle = throttle or Throttle()
+    pending = count_pending(version)
+    print(f"Version {version}: {pending['legacy']} dòng feedbacks cũ, {pending['scores']} lần gửi cần chấm lại")
+
+    stats = {'submissions': 0, 'feedback_rows': 0}
+    started = time.perf_counter()
+    for phase in PHASES:
+        key = f'{phase}_last_id'
+        while True:
+            chunk_start = time.perf_counter()
+            if phase == 'legacy':
+                jobs, last_id = legacy_jobs(chunk_size, state[key])
+            else:
+                jobs, last_id = stale_score_jobs(version, chunk_size, state[key])
+            if not jobs:
+                break
+            try:
+                stats['feedback_rows'] += rescore_jobs(engine, jobs, version, collapse_near_dup)
+            except Exception:
+                db.session.rollback()
+                raise
+            stats['submissions'] += len(jobs)
+            state[key] = last_id
+            save_checkpoint(checkpoint_path, state)
+
+            elapsed = time.perf_counter() - chunk_start
+            rate = stats['submissions'] / max(time.perf_counter() - started, 1e-9)
+            print(f"[{phase}] tới id {last_id}: {stats['submissions']} lần gửi, {rate:.1f}/s", flush=True)
+            throttle.pause(len(jobs), elapsed)
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Chấm lại feedback đã lưu bằng model/config hiện tại")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--socket', default=None, help="Dùng inference service thay vì load model trong process này")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--threads', type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="Số thread torch (mặc định nửa số core để chừa cho web app)")
+    parser.add_argument('--duty', type=float, default=1.0, help="Tỉ lệ thời gian được chạy, vd. 0.5 = nghỉ bằng thời gian làm")
+    parser.add_argument('--max-rate', type=float, default=0.0, help="Giới hạn số lần gửi/giây (0 = không giới hạn)")
+    parser.add_argument('--checkpoint', default=CHECKPOINT_PATH)
+    parser.add_argument('--restart', action='store_true', help="Bỏ qua checkpoint, quét lại từ đầu")
+    parser.add_argument('--near-dup', action='store_true',
+                        help="Chỉ chạy model một lần cho các text trong chunk chỉ khác hoa/thường, dấu câu, có/không dấu")
+    args = parser.parse_args(argv)
+
+    if args.socket:
+        from inference_service import InferenceClient
+        engine = InferenceClient(args.socket)
+        if engine.model_version is None:
+            print("Không kết nối được inference service.", file=sys.stderr)
+            return 1
+    else:
+        import model_registry
+        config = load_thread_config()
+        config['num_threads'] = args.threads
+        configure_torch_threads(config=config, label="rescore")
+        engine = model_registry.load_active_engine()
+        if not engine.is_ready:
+            print("Không load được model.", file=sys.stderr)
+            return 1
+
+    app = create_app(args.db)
+    with app.app_context():
+        stats = run(engine, args.checkpoint, args.chunk_size, Throttle(args.duty, args.max_rate), args.restart,
+                    args.near_dup)
+        print(f"Xong: {stats['submissions']} lần gửi, {stats['feedback_rows']} dòng feedbacks mới")
+        if stats['submissions']:
+            from database_manager import db_manager
+            db_manager.backup_database(force=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+"""Cấu hình thread/CPU affinity cho PyTorch trong mỗi worker
+
+Giá trị lấy theo thứ tự ưu tiên: biến môi trường > file JSON > mặc định.
+
+    TORCH_NUM_THREADS          số intra-op thread (mặc định: để PyTorch tự chọn)
+    TORCH_NUM_INTEROP_THREADS  số inter-op thread
+    TORCH_CPU_AFFINITY         "0-3,6" (danh sách CPU) hoặc "auto" (chia CPU theo worker index)
+    INFERENCE_CONFIG           đường dẫn file JSON (mặc định instance/inference_config.json)
+    INFERENCE_WORKER_INDEX     index của worker hiện tại (dùng cho affinity "auto")
+
+File JSON có cùng các key viết thường: {"num_threads": 2, "num_interop_threads": 1,
+"cpu_affinity": "auto"}.
+"""
+
+import os
+import json
+from typing import Optional
+
+DEFAULT_CONFIG_PATH = os.path.join(os.getcwd(), 'instance', 'inference_config.json')
+
+_ENV_KEYS = {
+    'num_threads': 'TORCH_NUM_THREADS',
+    'num_interop_threads': 'TORCH_NUM_INTEROP_THREADS',
+    'cpu_affinity': 'TORCH_CPU_AFFINITY',
+}
+
+
+def load_thread_config(path: Optional[str] = None) -> dict:
+    """Đọc cấu hình thread từ file JSON rồi ghi đè bằng biến môi trường"""
+    path = path or os.getenv('INFERENCE_CONFIG', DEFAULT_CONFIG_PATH)
+    config = {'num_threads': None, 'num_interop_threads': None, 'cpu_affinity': None}
+
+    if path and os.path.exists(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                file_config = json.load(f)
+            for key in config:
+                if file_config.get(key) is not None:
+                    config[key] = file_config[key]
+        except Exception:
+            pass
+
+    for key, env_key in _ENV_KEYS.items():
+        value = os.getenv(env_key)
+        if value:
+            config[key] = value
+
+    for key in ('num_threads', 'num_interop_threads'):
+        if config[key] is not None:
+            try:
+                config[key] = max(1, int(config[key]))
+            except (TypeError, ValueError):
+                config[key] = None
+    return config
+
+
+def parse_cpu_list(spec: str) -> list:
+    """Parse "0-3,6,8-9" thành [0, 1, 2, 3, 6, 8, 9]"""
+    cpus = []
+    for part in str(spec).split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            lo, hi = part.split('-', 1)
+            cpus.extend(range(int(lo), int(hi) + 1))
+        else:
+            cpus.append(int(part))
+    return sorted(set(cpus))
+
+
+def resolve_affinity(spec, worker_index: Optional[int], num_threads: Optional[int]) -> Optional[list]:
+    """Tính danh sách CPU cho worker; "auto" chia CPU khả dụng thành từng khối num_threads"""
+    if not spec or not hasattr(os, 'sched_getaffinity'):
+        return None
+    if str(spec).lower() != 'auto':
+        return parse_cpu_list(spec)
+    if worker_index is None:
+        return None
+
+    available = sorted(os.sched_getaffinity(0))
+    block = num_threads or 1
+    n_blocks = max(1, len(available) // block)
+    start = (worker_index % n_blocks) * block
+    return available[start:start + block]
+
+
+def _worker_index(worker_index: Optional[int] = None) -> Optional[int]:
+    if worker_index is None and os.getenv('INFERENCE_WORKER_INDEX'):
+        try:
+            return int(os.getenv('INFERENCE_WORKER_INDEX'))
+        except ValueError:
+            return None
+    return worker_index
+
+
+def apply_cpu_affinity(worker_index: Optional[int] = None, config: Optional[dict] = None) -> Optional[list]:
+    """Đặt CPU affinity (không cần import torch); áp dụng cho thread gọi và các thread tạo sau đó"""
+    config = config or load_thread_config()
+    cpus = resolve_affinity(config['cpu_affinity'], _worker_index(worker_index), config['num_threads'])
+    if cpus:
+        try:
+            os.sched_setaffinity(0, cpus)
+        except OSError:
+            cpus = None
+    return cpus
+
+
+def configure_torch_threads(worker_index: Optional[int] = None, config: Optional[dict] = None,
+                            label: str = "inference") -> dict:
+    """Áp dụng thread count + affinity cho process hiện tại và in ra giá trị hiệu lực"""
+    import torch
+
+    config = config or load_thread_config()
+    worker_index = _worker_index(worker_index)
+    apply_cpu_affinity(worker_index, config)
+
+    if config['num_threads']:
+        torch.set_num_threads(config['num_threads'])
+    if config['num_interop_threads']:
+        try:
+            torch.set_num_interop_threads(config['num_interop_threads'])
+        except RuntimeError:
+            # Chỉ gọi được trước khi có công việc inter-op nào chạy
+            pass
+
+    effective = {
+        'pid': os.getpid(),
+        'worker_index': worker_index,
+        'num_threads': torch.get_num_threads(),
+        'num_interop_threads': torch.get_num_interop_threads(),
+        'cpu_affinity': sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else None,
+    }
+    print(f"[{label}] torch threads: intra={effective['num_threads']} "
+          f"inter={effective['num_interop_threads']} "
+          f"affinity={effective['cpu_affinity']} worker={worker_index} pid={effective['pid']}",
+          flush=True)
+    return effective
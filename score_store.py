@@ -0,0 +1,52 @@
+"""Đóng gói xác suất thô (4 aspect x 4 class) + keyword của mỗi feedback để lưu DB
+
+Mỗi feedback lưu một blob float16 (4*4*2 = 32 byte) và một bitmask keyword
+(bit i = aspect ASPECTS_EN[i] có keyword). Khi đổi threshold, redecide.py giải
+nén cả lịch sử thành tensor (N, 4, 4) và chạy lại decide_batch mà không cần model.
+
+Lưu ý: float16 có sai số ~5e-4 quanh 1.0, nên feedback nằm sát ngưỡng có thể được
+quyết định khác một chút so với lúc chạy model (float32).
+"""
+
+import torch
+from model_config import ASPECTS_EN, NUM_CLASSES
+
+PROBS_DTYPE = torch.float16
+PROBS_SHAPE = (len(ASPECTS_EN), NUM_CLASSES)
+PROBS_NBYTES = PROBS_SHAPE[0] * PROBS_SHAPE[1] * 2
+
+
+def pack_probs(probs) -> list:
+    """Tensor (N, 4, 4) -> list N blob float16"""
+    raw = probs.detach().to('cpu', PROBS_DTYPE).contiguous().view(torch.uint8).view(len(probs), -1)
+    return [bytes(row) for row in raw.tolist()]
+
+
+def unpack_probs(blobs) -> torch.Tensor:
+    """list N blob -> tensor float32 (N, 4, 4)"""
+    if not blobs:
+        return torch.empty((0,) + PROBS_SHAPE)
+    buffer = bytearray(b''.join(blobs))
+    if len(buffer) != PROBS_NBYTES * len(blobs):
+        raise ValueError("Blob xác suất sai kích thước")
+    return torch.frombuffer(buffer, dtype=PROBS_DTYPE).view(-1, *PROBS_SHAPE).float()
+
+
+def pack_keyword_masks(has_keywords) -> list:
+    """list N x 4 bool -> list N int bitmask"""
+    return [sum(1 << i for i, has_kw in enumerate(row) if has_kw) for row in has_keywords]
+
+
+def unpack_keyword_masks(masks) -> torch.Tensor:
+    """list N int bitmask -> tensor bool (N, 4)"""
+    bits = torch.tensor([1 << i for i in range(len(ASPECTS_EN))])
+    return (torch.tensor(list(masks), dtype=torch.long).unsqueeze(-1) & bits) != 0
+
+
+EMBEDDING_DTYPE = torch.float16
+
+
+def pack_embeddings(embeddings) -> list:
+    """Tensor (N, H) đã chuẩn hoá L2 -> list N blob float16 (H*2 byte)"""
+    raw = embeddings.detach().to('cpu', EMBEDDING_DTYPE).contiguous().view(torch.uint8).view(len(embeddings), -1)
+    return [bytes(row) for row in raw.tolist()]
@@ -0,0 +1,237 @@
+"""Full-text search trên text feedback bằng SQLite FTS5
+
+Bảng FTS5 feedback_fts dùng external content trỏ vào feedbacks: cột text_norm
+(_norm_search(text): lower + bỏ dấu + đ->d, tự điền khi insert) cùng topic và
+sentiment, để lọc topic/sentiment bằng giao posting list ngay trong FTS thay vì
+join từng dòng. Trigger trên feedbacks giữ index đồng bộ với mọi đường ghi:
+save_feedback_to_db, redecide.py, rescore.py, xoá/ghi lại hàng loạt. Query cũng được chuẩn hoá bằng _norm_search nên
+"giang vien" và "Giảng viên" cho cùng kết quả; kết quả sắp theo bm25.
+
+Nếu SQLite không có FTS5, search() dùng LIKE trên text_norm (chậm hơn nhiều).
+"""
+
+import os
+import re
+from typing import Optional
+
+from models import db
+from model_config import _norm_search
+
+FTS_TABLE = 'feedback_fts'
+MAX_PER_PAGE = 100
+# Số kết quả mới nhất được xếp hạng bm25 khi query khớp quá nhiều dòng
+RANK_WINDOW = int(os.getenv('SEARCH_RANK_WINDOW', '5000'))
+
+_CREATE_FTS = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "text_norm, topic, sentiment, content='feedbacks', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 0')"
+)
+
+_TRIGGERS = [
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON feedbacks BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, text_norm, topic, sentiment)
+        VALUES (new.id, new.text_norm, new.topic, new.sentiment);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON feedbacks BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, text_norm, topic, sentiment)
+        VALUES ('delete', old.id, old.text_norm, old.topic, old.sentiment);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF text_norm, topic, sentiment ON feedbacks BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, text_norm, topic, sentiment)
+        VALUES ('delete', old.id, old.text_norm, old.topic, old.sentiment);
+        INSERT INTO {FTS_TABLE}(rowid, text_norm, topic, sentiment)
+        VALUES (new.id, new.text_norm, new.topic, new.sentiment);
+    END""",
+]
+
+_state = {'available': False}
+
+
+def backfill_text_norm(chunk_size: int = 5000) -> int:
+    """Điền text_norm cho các dòng cũ (trước khi có cột hoặc restore từ backup cũ)"""
+    total = 0
+    after_id = 0
+    while True:
+        rows = db.session.execute(db.text(
+            "SELECT id, text FROM feedbacks WHERE text_norm IS NULL AND id > :after ORDER BY id LIMIT :n"
+        ), {'after': after_id, 'n': chunk_size}).all()
+        if not rows:
+            return total
+        db.session.execute(db.text("UPDATE feedbacks SET text_norm = :norm WHERE id = :id"),
+                           [{'id': row.id, 'norm': _norm_search(row.text or '')} for row in rows])
+        db.session.commit()
+        total += len(rows)
+        after_id = rows[-1].id
+
+
+def ensure_search_index() -> bool:
+    """Tạo bảng FTS5 + trigger nếu chưa có (index toàn bộ feedbacks lần đầu); trả về FTS5 có dùng được không"""
+    try:
+        backfill_text_norm()
+        exists = db.session.execute(db.text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': FTS_TABLE}).first()
+        if not exists:
+            db.session.execute(db.text(_CREATE_FTS))
+            db.session.execute(db.text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+        for trigger in _TRIGGERS:
+            db.session.execute(db.text(trigger))
+        db.session.commit()
+        _state['available'] = True
+    except Exception:
+        db.session.rollback()
+        _state['available'] = False
+    return _state['available']
+
+
+def _quote(value: str) -> str:
+    return '"' + value.replace('"', '""') + '"'
+
+
+def build_match_query(query: str, topic=None, sentiment=None) -> Optional[str]:
+    """Chuẩn hoá query giống text_norm (_norm_search); mọi từ đều phải có, từ cuối match theo tiền tố"""
+    tokens = re.findall(r"\w+", _norm_search(query or ''))
+    if not tokens:
+        return None
+    terms = [_quote(token) for token in tokens]
+    terms[-1] += '*'
+    match = f"text_norm : ({' '.join(terms)})"
+    if topic:
+        match += f" AND topic : {_quote(topic)}"
+    if sentiment:
+        match += f" AND sentiment : {_quote(sentiment)}"
+    return match
+
+
+def _filters(topic=None, sentiment=None, start=None, end=None, user_id=None):
+    """Điều kiện SQL trên feedbacks f (dùng khi join hoặc fallback LIKE)"""
+    clauses, params = [], {}
+    if topic:
+        clauses.append("f.topic = :topic")
+        params['topic'] = topic
+    if sentiment:
+        clauses.append("f.sentiment = :sentiment")
+        params['sentiment'] = sentiment
+    if start is not None:
+        clauses.append("f.created_at >= :start")
+        params['start'] = start
+    if end is not None:
+        clauses.append("f.created_at <= :end")
+        params['end'] = end
+    if user_id is not None:
+        clauses.append("f.user_id = :user_id")
+        params['user_id'] = user_id
+    return clauses, params
+
+
+def _search_fts(match, clauses, params, limit, offset):
+    """Đếm + lấy một trang kết quả FTS5
+
+    bm25 phải tính cho mọi dòng match nên với từ rất phổ biến (hàng chục nghìn
+    dòng) chỉ xếp hạng trong RANK_WINDOW kết quả mới nhất (giới hạn bằng khoảng
+    rowid, FTS5 lọc ngay trong index); các trang sau đó tiếp tục theo thời gian.
+
+    Lọc theo user (sinh viên chỉ thấy feedback của mình): rowid phải nằm trong
+    danh sách id lấy qua ix_feedbacks_user_id thay vì join feedbacks cho mọi
+    dòng match. Dấu "+" ngăn SQLite đẩy điều kiện IN xuống FTS5 (FTS5 sẽ chạy
+    lại MATCH cho từng id, chậm hơn hàng trăm lần); khoảng id của user thì được
+    đẩy xuống để FTS5 bỏ qua phần index ngoài khoảng đó. Một user thường chỉ có
+    ít kết quả nên lấy luôn mọi kết quả kèm bm25 trong một lượt rồi sắp xếp,
+    thay vì đếm rồi duyệt FTS thêm lần nữa để xếp hạng.
+    """
+    params = dict(params, match=match)
+    if 'user_id' in params:
+        first_id, last_id = db.session.execute(db.text(
+            "SELECT min(id), max(id) FROM feedbacks WHERE user_id = :user_id"), params).one()
+        if first_id is None:
+            return [], 0
+        clauses = [clause for clause in clauses if clause != "f.user_id = :user_id"] + [
+            f"{FTS_TABLE}.rowid BETWEEN :first_id AND :last_id",
+            f"+{FTS_TABLE}.rowid IN (SELECT id FROM feedbacks WHERE user_id = :user_id)",
+        ]
+        params.update(first_id=first_id, last_id=last_id)
+    joined = any(clause.startswith('f.') for clause in clauses)
+    source = f"{FTS_TABLE} JOIN feedbacks f ON f.id = {FTS_TABLE}.rowid" if joined else FTS_TABLE
+    where = ' AND '.join([f"{FTS_TABLE} MATCH :match"] + clauses)
+
+    if 'user_id' in params:
+        ranked = db.session.execute(db.text(
+            f"SELECT {FTS_TABLE}.rowid, bm25({FTS_TABLE}, 1.0, 0.0, 0.0) AS rank FROM {source} WHERE {where} "
+            f"LIMIT :cap"), dict(params, cap=RANK_WINDOW + 1)).all()
+        if len(ranked) <= RANK_WINDOW:
+            ranked.sort(key=lambda hit: (hit[1], -hit[0]))
+            return _load_rows([hit[0] for hit in ranked[offset:offset + limit]]), len(ranked)
+
+    total = db.session.execute(db.text(f"SELECT count(*) FROM {source} WHERE {where}"), params).scalar()
+    boundary = None
+    if total > RANK_WINDOW:
+        boundary = db.session.execute(db.text(
+            f"SELECT {FTS_TABLE}.rowid FROM {source} WHERE {where} "
+            f"ORDER BY {FTS_TABLE}.rowid DESC LIMIT 1 OFFSET :window"), dict(params, window=RANK_WINDOW - 1)).scalar()
+
+    hits = []
+    ranked_count = min(total, RANK_WINDOW)
+    if offset < ranked_count:
+        window = f" AND {FTS_TABLE}.rowid >= :boundary" if boundary is not None else ""
+        hits += db.session.execute(db.text(
+            f"SELECT {FTS_TABLE}.rowid, bm25({FTS_TABLE}, 1.0, 0.0, 0.0) AS rank FROM {source} WHERE {where}{window} "
+            f"ORDER BY rank, {FTS_TABLE}.rowid DESC LIMIT :limit OFFSET :offset"),
+            dict(params, boundary=boundary, limit=limit, offset=offset)).all()
+    if len(hits) < limit and boundary is not None:
+        hits += db.session.execute(db.text(
+            f"SELECT {FTS_TABLE}.rowid, NULL AS rank FROM {source} WHERE {where} AND {FTS_TABLE}.rowid < :boundary "
+            f"ORDER BY {FTS_TABLE}.rowid DESC LIMIT :limit OFFSET :offset"),
+            dict(params, boundary=boundary, limit=limit - len(hits),
+                 offset=max(0, offset - ranked_count))).all()
+    return _load_rows([hit[0] for hit in hits]), total
+
+
+def _load_rows(ids: list) -> list:
+    """Các dòng feedbacks theo đúng thứ tự ids"""
+    if not ids:
+        return []
+    placeholders = ', '.join(f":id{i}" for i in range(len(ids)))
+    rows = db.session.execute(db.text(
+        f"SELECT f.id, f.text, f.sentiment, f.topic, f.sentiment_confidence, f.topic_confidence, "
+        f"f.user_id, f.created_at FROM feedbacks f WHERE f.id IN ({placeholders})"),
+        {f"id{i}": row_id for i, row_id in enumerate(ids)}).all()
+    by_id = {row.id: row for row in rows}
+    return [by_id[row_id] for row_id in ids if row_id in by_id]
+
+
+def _search_like(tokens, clauses, params, limit, offset):
+    like_clauses = []
+    params = dict(params, limit=limit, offset=offset)
+    for i, token in enumerate(tokens):
+        like_clauses.append(f"f.text_norm LIKE :tok{i}")
+        params[f'tok{i}'] = f"%{token}%"
+    where = ' AND '.join(like_clauses + clauses)
+    base = f"FROM feedbacks f WHERE {where}"
+    total = db.session.execute(db.text(f"SELECT count(*) {base}"), params).scalar()
+    rows = db.session.execute(db.text(
+        f"SELECT f.id, f.text, f.sentiment, f.topic, f.sentiment_confidence, f.topic_confidence, "
+        f"f.user_id, f.created_at {base} ORDER BY f.id DESC LIMIT :limit OFFSET :offset"), params).all()
+    return rows, total
+
+
+def search(query: str, topic=None, sentiment=None, start=None, end=None, user_id=None,
+           page: int = 1, per_page: int = 20):
+    """Tìm feedback theo text (+ lọc topic/sentiment/khoảng thời gian UTC/user); trả về (rows, total)"""
+    match = build_match_query(query, topic, sentiment)
+    if match is None:
+        return [], 0
+    per_page = max(1, min(per_page, MAX_PER_PAGE))
+    offset = (max(1, page) - 1) * per_page
+    # topic/sentiment đã nằm trong match, chỉ thời gian/user cần join feedbacks
+    clauses, params = _filters(start=start, end=end, user_id=user_id)
+
+    if _state['available'] or ensure_search_index():
+        try:
+            return _search_fts(match, clauses, params, per_page, offset)
+        except Exception:
+            # Bảng FTS mất sau khi restore database: tạo lại rồi thử lần nữa
+            db.session.rollback()
+            if ensure_search_index():
+                return _search_fts(match, clauses, params, per_page, offset)
+    clauses, params = _filters(topic, sentiment, start, end, user_id)
+    return _search_like(re.findall(r"\w+", _norm_search(query)), clauses, params, per_page, offset)
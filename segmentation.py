@@ -0,0 +1,124 @@
+"""Tách feedback dài thành các mệnh đề/câu ngắn trước khi chạy model
+
+Feedback được ghép với prompt và cắt ở MAX_LEN token (truncation="only_second"),
+nên ý ở cuối một đoạn dài bị mất, và chi phí attention tăng theo bình phương độ
+dài. Khi bật SEGMENTATION, feedback dài hơn SEGMENT_MAX_WORDS từ được tách theo
+dấu câu (. ! ? ; xuống dòng) và từ nối tương phản ("nhưng", "tuy nhiên"...), rồi
+các mệnh đề liên tiếp được gom lại thành mảnh tối đa SEGMENT_MAX_WORDS từ (mệnh đề
+quá dài được tách tiếp theo dấu phẩy rồi theo cửa sổ từ). Mỗi mảnh đều được ghép
+lại với prompt nên tổng số token tăng; đổi lại không còn sequence nào bị cắt và
+mỗi sequence ngắn hơn (python -m benchmarks.bench_segmentation).
+
+Các mảnh được chạy model như các feedback riêng (cùng batch), sau đó gộp lại
+thành một ma trận (4 aspect, 4 class) cho feedback gốc bằng merge_segment_probs:
+với mỗi aspect lấy nguyên hàng xác suất của mảnh có p_none thấp nhất (mảnh nói
+về aspect đó rõ nhất), keyword của aspect có nếu có trong bất kỳ mảnh nào.
+"""
+
+import os
+import re
+import unicodedata
+
+import torch
+
+SEGMENTATION_ENABLED = os.getenv('SEGMENTATION', 'False').lower() == 'true'
+# Mệnh đề ngắn hơn số từ này luôn đi cùng mảnh đứng trước
+SEGMENT_MERGE_WORDS = 4
+# Số từ tối đa mỗi mảnh (gom nhiều mệnh đề liên tiếp cho tới giới hạn này);
+# feedback không dài hơn giữ nguyên như trước
+SEGMENT_MAX_WORDS = int(os.getenv('SEGMENT_MAX_WORDS', '50'))
+
+# Từ nối tương phản, giữ ở đầu mảnh sau để model vẫn thấy sắc thái
+CONTRAST_MARKERS = ("nhưng mà", "nhưng", "tuy nhiên", "tuy vậy", "mặc dù", "trong khi đó", "ngược lại")
+
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?;…])\s+|\s*\n+\s*")
+_CONTRAST_SPLIT = re.compile(
+    r"[,\s]+(?=(?:" + "|".join(re.escape(m) for m in CONTRAST_MARKERS) + r")\b)", re.IGNORECASE)
+_COMMA_SPLIT = re.compile(r"(?<=,)\s+")
+
+
+def config() -> dict:
+    """Cấu hình tách câu (đưa vào fingerprint model_version khi bật)"""
+    return {'merge_words': SEGMENT_MERGE_WORDS, 'max_words': SEGMENT_MAX_WORDS,
+            'markers': list(CONTRAST_MARKERS)}
+
+
+def _clauses(text: str) -> list:
+    """Tách theo dấu câu và từ nối tương phản; mảnh dài hơn SEGMENT_MAX_WORDS tách tiếp theo dấu phẩy"""
+    clauses = []
+    for sentence in _SENTENCE_SPLIT.split(text):
+        for piece in _CONTRAST_SPLIT.split(sentence):
+            piece = piece.strip()
+            if not piece:
+                continue
+            if len(piece.split()) > SEGMENT_MAX_WORDS:
+                clauses.extend(p for p in _COMMA_SPLIT.split(piece) if p)
+            else:
+                clauses.append(piece)
+    return clauses
+
+
+def split_segments(text: str) -> list:
+    """Tách feedback thành các mảnh; feedback ngắn (<= SEGMENT_MAX_WORDS từ) trả về [text]
+
+    Các mệnh đề liên tiếp được gom vào cùng mảnh cho tới khi vượt SEGMENT_MAX_WORDS
+    từ (mỗi mảnh đều phải ghép thêm prompt nên không tách lẻ từng mệnh đề ngắn);
+    mệnh đề ngắn hơn SEGMENT_MERGE_WORDS từ luôn đi cùng mảnh trước nó.
+    """
+    text = str(text).strip()
+    if len(text.split()) <= SEGMENT_MAX_WORDS:
+        return [text]
+    text = unicodedata.normalize("NFC", text)
+    segments, current, current_words = [], [], 0
+    for clause in _clauses(text):
+        words = clause.split()
+        if current and current_words + len(words) > SEGMENT_MAX_WORDS and len(words) >= SEGMENT_MERGE_WORDS:
+            segments.append(' '.join(current))
+            current, current_words = [], 0
+        # Mệnh đề không có dấu câu/dấu phẩy nào vẫn dài: cắt theo cửa sổ từ
+        while len(words) > SEGMENT_MAX_WORDS:
+            segments.append(' '.join(words[:SEGMENT_MAX_WORDS]))
+            words = words[SEGMENT_MAX_WORDS:]
+        current.extend(words)
+        current_words += len(words)
+    if current:
+        segments.append(' '.join(current))
+    return segments or [text]
+
+
+def expand(texts: list):
+    """Tách cả list: trả về (segments, owner) với owner[k] = vị trí feedback gốc của mảnh k"""
+    segments, owner = [], []
+    for i, text in enumerate(texts):
+        for segment in split_segments(text):
+            segments.append(segment)
+            owner.append(i)
+    return segments, owner
+
+
+def merge_segment_probs(probs, has_kw, owner: list, count: int):
+    """Gộp probs (S, A, C) và has_kw (S x A) của các mảnh về (count, A, C) và count x A
+
+    Mỗi (feedback, aspect) lấy hàng xác suất của mảnh có p_none nhỏ nhất (mảnh
+    đầu tiên nếu bằng nhau); has_kw là OR trên các mảnh.
+    """
+    if len(owner) == count:
+        return probs, has_kw
+    num_segments, num_aspects, _ = probs.shape
+    owner_t = torch.as_tensor(owner, device=probs.device).unsqueeze(1).expand(num_segments, num_aspects)
+    p_none = probs[..., 0]
+
+    best_p = torch.full((count, num_aspects), float('inf'), dtype=p_none.dtype, device=probs.device)
+    best_p = best_p.scatter_reduce(0, owner_t, p_none, reduce='amin')
+    seg_idx = torch.arange(num_segments, device=probs.device).unsqueeze(1).expand(num_segments, num_aspects)
+    candidate = torch.where(p_none == best_p.gather(0, owner_t), seg_idx, torch.full_like(seg_idx, num_segments))
+    chosen = torch.full((count, num_aspects), num_segments, dtype=seg_idx.dtype, device=probs.device)
+    chosen = chosen.scatter_reduce(0, owner_t, candidate, reduce='amin')
+
+    aspect_idx = torch.arange(num_aspects, device=probs.device).expand(count, num_aspects)
+    merged_probs = probs[chosen, aspect_idx]
+
+    kw = torch.as_tensor(has_kw, dtype=torch.bool).to(torch.uint8)
+    merged_kw = torch.zeros((count, num_aspects), dtype=torch.uint8)
+    merged_kw = merged_kw.scatter_reduce(0, owner_t.cpu(), kw, reduce='amax').bool()
+    return merged_probs, merged_kw.tolist()
@@ -258,7 +258,8 @@ async function loadFeedbackHistory(page = 1, shouldScroll = false) {
         });
         
         console.log('Loading feedback history, page:', page);
-        const response = await fetch(`/api/feedback-history?${queryParams.toString()}`);
+        // no-cache: trình duyệt gửi lại ETag, server trả 304 nếu lịch sử chưa đổi
+        const response = await fetch(`/api/feedback-history?${queryParams.toString()}`, { cache: 'no-cache' });
         const data = await response.json();
         console.log('Feedback history response:', data);
         if (response.ok) {
@@ -714,16 +715,17 @@ async function handleCsvUpload(event) {
         return;
     }
     
-    // Validate file size (max 10MB)
-    const maxSize = 10 * 1024 * 1024; // 10MB
+    // Validate file size (max 200MB, file lớn nên nén .csv.gz / .csv.zst trước khi upload)
+    const maxSize = 200 * 1024 * 1024; // 200MB
     if (csvFile.size > maxSize) {
-        showAlert('File quá lớn. Kích thước tối đa là 10MB.', 'danger');
+        showAlert('File quá lớn. Kích thước tối đa là 200MB, hãy nén file (.csv.gz) trước khi upload.', 'danger');
         return;
     }
     
     // Validate file type
-    if (!csvFile.name.toLowerCase().endsWith('.csv')) {
-        showAlert('Vui lòng chọn file có định dạng .csv', 'danger');
+    const fileName = csvFile.name.toLowerCase();
+    if (!['.csv', '.csv.gz', '.gz', '.csv.zst', '.zst'].some(ext => fileName.endsWith(ext))) {
+        showAlert('Vui lòng chọn file có định dạng .csv, .csv.gz hoặc .csv.zst', 'danger');
         return;
     }
     
@@ -753,6 +755,10 @@ async function handleCsvUpload(event) {
             }, 500);
         } else {
             showAlert(data.error || 'Có lỗi xảy ra khi xử lý file CSV', 'danger');
+            // Upload dừng giữa chừng: các dòng trước đó đã được lưu
+            if (data.processed_count) {
+                loadFeedbackHistory(1, true);
+            }
         }
     } catch (error) {
         console.error('CSV upload error:', error);
@@ -883,6 +889,7 @@ ${data.total_rows > 10 ? `
 
     
     results.innerHTML = html;
+    showTopClusters(results.querySelector('.card-body'), data.top_clusters);
     results.style.display = 'block';
     
     // Scroll to results with better positioning
@@ -893,6 +900,34 @@ ${data.total_rows > 10 ? `
     }, 100);
 }
 
+// Các ý kiến được nhiều sinh viên lặp lại (cụm gần trùng)
+function showTopClusters(container, clusters) {
+    if (!container || !clusters || clusters.length === 0) return;
+    
+    const block = document.createElement('div');
+    block.className = 'mt-3';
+    const title = document.createElement('h6');
+    title.textContent = 'Ý kiến lặp lại nhiều nhất';
+    block.appendChild(title);
+    
+    const list = document.createElement('ul');
+    list.className = 'list-group';
+    clusters.forEach(cluster => {
+        const item = document.createElement('li');
+        item.className = 'list-group-item d-flex justify-content-between align-items-center';
+        const text = document.createElement('span');
+        text.textContent = cluster.text;
+        const badge = document.createElement('span');
+        badge.className = 'badge bg-primary rounded-pill';
+        badge.textContent = `${cluster.size} sinh viên`;
+        item.appendChild(text);
+        item.appendChild(badge);
+        list.appendChild(item);
+    });
+    block.appendChild(list);
+    container.appendChild(block);
+}
+
 function downloadCsvTemplate(event) {
     event.preventDefault();
     
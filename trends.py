@@ -0,0 +1,229 @@
+"""Xu hướng sentiment theo topic và cảnh báo tăng đột biến feedback tiêu cực
+
+Bảng feedback_trend_buckets giữ số feedback theo (giờ UTC, topic, sentiment).
+Giống feedback_fts (search_index.py), trigger trên feedbacks cập nhật bảng này
+trong cùng transaction với mọi đường ghi: save_feedback_to_db, rescore.py,
+redecide.py, xoá/ghi lại hàng loạt. Báo cáo chỉ đọc vài nghìn dòng bucket thay
+vì quét bảng feedbacks.
+
+report() so sánh cửa sổ gần nhất (TREND_WINDOW_HOURS) với giai đoạn nền ngay
+trước đó (TREND_BASELINE_DAYS) cho từng topic bằng hai kiểm định:
+
+  - tỉ lệ tiêu cực: z-test hai tỉ lệ (negative / tổng ở cửa sổ so với nền)
+  - số lượng tiêu cực: số feedback tiêu cực mỗi giờ so với tốc độ nền (so sánh
+    hai tốc độ Poisson: với tổng n = cửa sổ + nền, số ở cửa sổ ~ Binomial(n, p)
+    với p = giờ cửa sổ / (giờ cửa sổ + giờ nền))
+
+Giờ nền là khoảng có dữ liệu thật: tính từ bucket sớm nhất trong giai đoạn nền
+(hệ thống mới chạy 2 ngày thì nền là 2 ngày, không phải TREND_BASELINE_DAYS).
+Kiểm định số lượng bị tắt (volume_tested = False) khi nền chưa đủ
+TREND_MIN_BASELINE_HOURS giờ hoặc topic có ít hơn TREND_MIN_BASELINE_COUNT
+feedback ở nền: tốc độ ước lượng từ vài giờ / vài feedback không đủ tin cậy.
+
+Topic bị gắn cờ spike khi một trong hai z >= TREND_Z_THRESHOLD và cửa sổ có ít
+nhất TREND_MIN_COUNT feedback tiêu cực (tránh báo động vì 2-3 comment).
+"""
+
+import os
+import math
+from datetime import datetime, timedelta
+
+from models import db
+
+TREND_TABLE = 'feedback_trend_buckets'
+TREND_WINDOW_HOURS = int(os.getenv('TREND_WINDOW_HOURS', '24'))
+TREND_BASELINE_DAYS = int(os.getenv('TREND_BASELINE_DAYS', '14'))
+TREND_Z_THRESHOLD = float(os.getenv('TREND_Z_THRESHOLD', '3.0'))
+TREND_MIN_COUNT = int(os.getenv('TREND_MIN_COUNT', '5'))
+TREND_MIN_BASELINE_HOURS = int(os.getenv('TREND_MIN_BASELINE_HOURS', '72'))
+TREND_MIN_BASELINE_COUNT = int(os.getenv('TREND_MIN_BASELINE_COUNT', '20'))
+NEGATIVE = 'negative'
+
+_BUCKET = "strftime('%Y-%m-%d %H:00:00', {}.created_at)"
+_BUCKET_FORMAT = '%Y-%m-%d %H:00:00'
+
+_CREATE_TABLE = (
+    f"CREATE TABLE IF NOT EXISTS {TREND_TABLE} ("
+    "bucket TEXT NOT NULL, topic TEXT NOT NULL, sentiment TEXT NOT NULL, count INTEGER NOT NULL, "
+    "PRIMARY KEY (bucket, topic, sentiment)) WITHOUT ROWID"
+)
+
+_ADD = (f"INSERT INTO {TREND_TABLE} (bucket, topic, sentiment, count) "
+        f"VALUES ({_BUCKET.format('new')}, new.topic, new.sentiment, 1) "
+        "ON CONFLICT (bucket, topic, sentiment) DO UPDATE SET count = count + 1;")
+_REMOVE = (f"UPDATE {TREND_TABLE} SET count = count - 1 "
+           f"WHERE bucket = {_BUCKET.format('old')} AND topic = old.topic AND sentiment = old.sentiment;")
+
+_TRIGGERS = [
+    f"CREATE TRIGGER IF NOT EXISTS {TREND_TABLE}_ai AFTER INSERT ON feedbacks BEGIN {_ADD} END",
+    f"CREATE TRIGGER IF NOT EXISTS {TREND_TABLE}_ad AFTER DELETE ON feedbacks BEGIN {_REMOVE} END",
+    f"CREATE TRIGGER IF NOT EXISTS {TREND_TABLE}_au AFTER UPDATE OF topic, sentiment, created_at ON feedbacks "
+    f"BEGIN {_REMOVE} {_ADD} END",
+]
+
+_REBUILD = (
+    f"INSERT INTO {TREND_TABLE} (bucket, topic, sentiment, count) "
+    f"SELECT {_BUCKET.format('f')}, f.topic, f.sentiment, COUNT(*) FROM feedbacks f "
+    "WHERE f.created_at IS NOT NULL GROUP BY 1, 2, 3"
+)
+
+
+def ensure_trend_buckets() -> bool:
+    """Tạo bảng bucket + trigger nếu chưa có (đếm toàn bộ feedbacks lần đầu, vd. sau khi restore backup cũ)"""
+    try:
+        exists = db.session.execute(db.text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': TREND_TABLE}).first()
+        if not exists:
+            db.session.execute(db.text(_CREATE_TABLE))
+            db.session.execute(db.text(_REBUILD))
+        for trigger in _TRIGGERS:
+            db.session.execute(db.text(trigger))
+        db.session.commit()
+        return True
+    except Exception:
+        db.session.rollback()
+        return False
+
+
+def rebuild() -> int:
+    """Đếm lại toàn bộ bucket từ feedbacks (sửa tay dữ liệu ngoài trigger); trả về số bucket"""
+    db.session.execute(db.text(f"DELETE FROM {TREND_TABLE}"))
+    db.session.execute(db.text(_REBUILD))
+    db.session.commit()
+    return db.session.execute(db.text(f"SELECT COUNT(*) FROM {TREND_TABLE}")).scalar()
+
+
+def _bucket_start(moment: datetime) -> datetime:
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def load_buckets(start: datetime, end: datetime) -> list:
+    """[(giờ bắt đầu bucket, topic, sentiment, count)] trong [start, end) (UTC)"""
+    rows = db.session.execute(db.text(
+        f"SELECT bucket, topic, sentiment, count FROM {TREND_TABLE} "
+        "WHERE bucket >= :start AND bucket < :end AND count > 0"),
+        {'start': start.strftime(_BUCKET_FORMAT), 'end': end.strftime(_BUCKET_FORMAT)}).all()
+    return [(datetime.strptime(row.bucket, _BUCKET_FORMAT), row.topic, row.sentiment, row.count) for row in rows]
+
+
+def first_bucket(start: datetime, end: datetime):
+    """Giờ của bucket sớm nhất có dữ liệu trong [start, end), None nếu không có"""
+    first = db.session.execute(db.text(
+        f"SELECT MIN(bucket) FROM {TREND_TABLE} WHERE bucket >= :start AND bucket < :end AND count > 0"),
+        {'start': start.strftime(_BUCKET_FORMAT), 'end': end.strftime(_BUCKET_FORMAT)}).scalar()
+    return datetime.strptime(first, _BUCKET_FORMAT) if first else None
+
+
+def _proportion_z(hits: int, total: int, base_hits: int, base_total: int) -> float:
+    """z-test hai tỉ lệ (pooled); 0 nếu một bên không có dữ liệu"""
+    if total == 0 or base_total == 0:
+        return 0.0
+    pooled = (hits + base_hits) / (total + base_total)
+    variance = pooled * (1 - pooled) * (1 / total + 1 / base_total)
+    if variance <= 0:
+        return 0.0
+    return (hits / total - base_hits / base_total) / math.sqrt(variance)
+
+
+def _rate_z(observed: int, base_count: int, hours: float, base_hours: float) -> float:
+    """z của số quan sát so với tốc độ nền (hai tốc độ Poisson, điều kiện theo tổng); 0 nếu không có dữ liệu"""
+    total = observed + base_count
+    if total == 0 or base_hours <= 0:
+        return 0.0
+    share = hours / (hours + base_hours)
+    # Hiệu chỉnh liên tục: với số đếm nhỏ (1 feedback so với nền 0) xấp xỉ chuẩn thổi phồng z
+    diff = observed - total * share
+    diff = math.copysign(max(abs(diff) - 0.5, 0.0), diff)
+    return diff / math.sqrt(total * share * (1 - share))
+
+
+def report(now: datetime = None, window_hours: int = None, baseline_days: int = None,
+           z_threshold: float = None, min_count: int = None,
+           min_baseline_hours: int = None, min_baseline_count: int = None) -> dict:
+    """Tỉ lệ tiêu cực theo topic ở cửa sổ gần nhất so với giai đoạn nền, kèm cờ spike"""
+    window_hours = window_hours or TREND_WINDOW_HOURS
+    baseline_days = baseline_days or TREND_BASELINE_DAYS
+    z_threshold = TREND_Z_THRESHOLD if z_threshold is None else z_threshold
+    min_count = TREND_MIN_COUNT if min_count is None else min_count
+    min_baseline_hours = TREND_MIN_BASELINE_HOURS if min_baseline_hours is None else min_baseline_hours
+    min_baseline_count = TREND_MIN_BASELINE_COUNT if min_baseline_count is None else min_baseline_count
+
+    # Bucket của giờ hiện tại (chưa trọn) thuộc cửa sổ
+    end = _bucket_start(now or datetime.utcnow()) + timedelta(hours=1)
+    window_start = end - timedelta(hours=window_hours)
+    baseline_start = window_start - timedelta(days=baseline_days)
+
+    stats = {}
+    for bucket, topic, sentiment, count in load_buckets(baseline_start, end):
+        entry = stats.setdefault(topic, {'window_total': 0, 'window_negative': 0,
+                                         'baseline_total': 0, 'baseline_negative': 0})
+        period = 'window' if bucket >= window_start else 'baseline'
+        entry[f'{period}_total'] += count
+        if sentiment == NEGATIVE:
+            entry[f'{period}_negative'] += count
+
+    # Nền chỉ tính từ lúc có dữ liệu (DB mới, hoặc vừa restore backup ngắn)
+    first = first_bucket(baseline_start, window_start)
+    baseline_hours = (window_start - first).total_seconds() / 3600 if first else 0
+    volume_ready = baseline_hours >= max(min_baseline_hours, 1)
+    topics = []
+    for topic, entry in sorted(stats.items()):
+        window_rate = entry['window_negative'] / entry['window_total'] if entry['window_total'] else 0.0
+        baseline_rate = entry['baseline_negative'] / entry['baseline_total'] if entry['baseline_total'] else 0.0
+        share_z = _proportion_z(entry['window_negative'], entry['window_total'],
+                                entry['baseline_negative'], entry['baseline_total'])
+        volume_tested = volume_ready and entry['baseline_total'] >= min_baseline_count
+        volume_z = (_rate_z(entry['window_negative'], entry['baseline_negative'], window_hours, baseline_hours)
+                    if volume_tested else 0.0)
+        reasons = []
+        if entry['window_negative'] >= min_count:
+            if share_z >= z_threshold:
+                reasons.append('share')
+            if volume_tested and volume_z >= z_threshold:
+                reasons.append('volume')
+        topics.append({
+            'topic': topic,
+            **entry,
+            'window_negative_rate': round(window_rate, 4),
+            'baseline_negative_rate': round(baseline_rate, 4),
+            'negative_per_hour': round(entry['window_negative'] / window_hours, 3),
+            'baseline_negative_per_hour': (round(entry['baseline_negative'] / baseline_hours, 3)
+                                           if baseline_hours else 0.0),
+            'share_z': round(share_z, 2),
+            'volume_z': round(volume_z, 2),
+            'volume_tested': volume_tested,
+            'spike': bool(reasons),
+            'reasons': reasons,
+        })
+    topics.sort(key=lambda t: (not t['spike'], -max(t['share_z'], t['volume_z'])))
+    return {
+        'window_start': window_start,
+        'window_end': end,
+        'baseline_start': baseline_start,
+        'window_hours': window_hours,
+        'baseline_days': baseline_days,
+        'baseline_hours': round(baseline_hours, 1),
+        'z_threshold': z_threshold,
+        'topics': topics,
+        'spikes': [t['topic'] for t in topics if t['spike']],
+    }
+
+
+def series(now: datetime = None, days: int = 7, hours_per_point: int = 24) -> dict:
+    """Số feedback tiêu cực và tổng theo topic, mỗi điểm hours_per_point giờ (cũ nhất trước)"""
+    end = _bucket_start(now or datetime.utcnow()) + timedelta(hours=1)
+    points = max(1, days * 24 // hours_per_point)
+    start = end - timedelta(hours=points * hours_per_point)
+    data = {}
+    for bucket, topic, sentiment, count in load_buckets(start, end):
+        index = int((bucket - start).total_seconds() // 3600) // hours_per_point
+        entry = data.setdefault(topic, {'total': [0] * points, 'negative': [0] * points})
+        entry['total'][index] += count
+        if sentiment == NEGATIVE:
+            entry['negative'][index] += count
+    return {
+        'start': start,
+        'hours_per_point': hours_per_point,
+        'points': [start + timedelta(hours=i * hours_per_point) for i in range(points)],
+        'topics': data,
+    }